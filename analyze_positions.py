@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+# Score a file of stored positions with a computer player, across worker
+# processes. Positions are read and results written as a stream, one JSON
+# object per line, in the same order as the input:
+#   {"position": ..., "best": <move>, "scores": [[<move>, <score>], ...], "nodes": n}
+# Scores are the Minimax scores of each move for the player to move,
+# as computed by BoardGame.score_moves(); other players (random, solver,
+# tree search) only report their "best" move. Finished games only report
+# their "condition". With --table the workers share Minimax results
+# through a SharedTable.
+#
+# Usage: python analyze_positions.py <file|-> <player> [--binary] [--workers N] [--table N]
+#        e.g. python analyze_positions.py positions.txt m 3 b --workers 8
+
+import argparse
+import json
+import multiprocessing
+import sys
+
+from positions import decode, read_positions, encode_text
+from game_registry import parse_player
+from board_games import SearchContext
+
+
+# set in each worker
+_options = None
+_context = None
+
+
+def _init_worker(options, table=None):
+    global _options, _context
+    _options = options
+    if table is not None:
+        _context = SearchContext(0, shared=table)
+
+
+def analyze(record, options=None, context=None):
+    if options is None:
+        options = _options
+        context = _context
+    game = decode(record)
+    result = {'position': encode_text(game)}
+    if game.condition != -1:
+        result['condition'] = game.condition
+        return result
+
+    if options[0] == 'm':
+        scores = game.score_moves(*game.minimax_args(options), context=context)
+        # first of the best moves, like get_move_minimax without the shuffle
+        best = max(scores, key=lambda x: x[1])[0]
+        result['best'] = best
+        result['scores'] = [[move, float(score)] for move, score in scores]
+    else:
+        # any other player only gives its move, as it would play it
+        game.interactive = False
+        game.configure_player(game.current_player, options)
+        try:
+            result['best'] = game.get_move()
+        finally:
+            game.stop_tree_searches()
+    result['nodes'] = game.nodes_searched
+    return result
+
+
+def parse_spec(spec):
+    lst = spec.split()
+    lst.reverse()
+    options = parse_player(lst)
+    if len(lst) != 0 or options[0] == 'h':
+        raise Exception('expected one computer player')
+    # the positions are already spread over the worker processes,
+    # which can't start processes of their own
+    if options[0] == 't' and options[2] > 0:
+        raise Exception("'t' players can't have playout workers here; use --workers")
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score stored positions with a computer player')
+    parser.add_argument('file', help="file of encoded positions, or '-' for stdin")
+    parser.add_argument('player', nargs='+', help="player, e.g. 'r' or 'm 2 r 5 2'")
+    parser.add_argument('--binary', action='store_true', help='positions are binary records')
+    parser.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+    parser.add_argument('--chunk', type=int, default=16, help='positions sent to a worker at once')
+    parser.add_argument('--table', type=int, default=0, help='Minimax positions shared by the workers (0 = none)')
+    args = parser.parse_args()
+
+    try:
+        options = parse_spec(' '.join(args.player))
+    except Exception as e:
+        parser.error(f"bad player {' '.join(args.player)!r}: {e}")
+
+    if args.file == '-':
+        f = sys.stdin.buffer if args.binary else sys.stdin
+    else:
+        f = open(args.file, 'rb' if args.binary else 'r')
+
+    table = None
+    if args.table > 0:
+        from shared_table import SharedTable
+        table = SharedTable(args.table)
+
+    try:
+        with f, multiprocessing.Pool(args.workers, _init_worker, (options, table)) as pool:
+            for result in pool.imap(analyze, read_positions(f, args.binary), args.chunk):
+                print(json.dumps(result))
+    finally:
+        if table is not None:
+            stats = table.stats()
+            print(f"Shared table: {stats['hits']} hits in {stats['probes']} probes "
+                  f"({100*stats['hit_rate']:.1f}%)", file=sys.stderr)
+            table.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+#!/usr/bin/python
+
+# Many games played at once, for statistics over large numbers of games
+# between simple agents.
+#
+# A batch holds N boards of one game in NumPy arrays: for Tic-Tac-Toe and
+# Connect 4 one row of squares per board (plus a spare square that is
+# always empty, which pads the lines walked from a square), and for
+# Othello a 64-bit bitboard of each player's pieces per board. Every
+# operation works on all the boards at once:
+#   legal_mask()   N x actions array of the valid moves of each board
+#   step(actions)  play one move on every unfinished board
+#   condition      per board, as in BoardGame (-1 ongoing, 0 draw, 1 or 2)
+# Actions are squares (row*cols + col) for Tic-Tac-Toe and Othello and
+# columns for Connect 4. An Othello player with no valid move passes
+# automatically. Finished boards are counted in results and, with
+# auto_reset, start a new game straight away.
+#
+# Agents are policies: functions of (batch, board indices) returning an
+# action for each of those boards.
+#
+# Usage: python batch_games.py <game> <policy1> <policy2> [--boards N] [--games N] [--seed N]
+#        e.g. python batch_games.py Connect4 greedy random --games 100000
+
+import argparse
+import time
+
+import numpy as np
+
+from board_games import BoardGame, BoardGeometry, TicTacToe, Connect_X, Othello, board_geometry
+
+
+class BatchGame:
+
+    def __init__(self, n_boards, n_rows, n_cols, seed=None, auto_reset=True):
+        self.n_boards = n_boards
+        self.num_rows = n_rows
+        self.num_cols = n_cols
+        self.num_squares = n_rows*n_cols
+        self.auto_reset = auto_reset
+        self.rng = np.random.default_rng(seed)
+
+        self.current_player = np.ones(n_boards, dtype=np.int8)
+        self.condition = np.full(n_boards, -1, dtype=np.int8)
+        self.counter = np.zeros(n_boards, dtype=np.int32)
+
+        # finished games: draws, player 1 wins, player 2 wins
+        self.results = np.zeros(3, dtype=np.int64)
+        self.moves = 0
+        self.reset()
+
+
+    # The boards as an N x rows x cols array
+    @property
+    def board(self):
+        return self.squares().reshape(self.n_boards, self.num_rows, self.num_cols)
+
+
+    def games(self):
+        return int(self.results.sum())
+
+
+    # Start new games on the boards in which (a boolean mask), or all of them
+    def reset(self, which=None):
+        idx = np.arange(self.n_boards) if which is None else np.flatnonzero(which)
+        self.current_player[idx] = 1
+        self.condition[idx] = -1
+        self.counter[idx] = 0
+        self.start(idx)
+
+
+    def pieces(self, idx):
+        return np.where(self.current_player[idx] == 1, BoardGame.XPIECE, BoardGame.OPIECE).astype(np.int8)
+
+
+    # Play actions[i] on board i, for every unfinished board. Returns a
+    # mask of the boards whose games just finished and their conditions
+    # (before any reset).
+    def step(self, actions):
+        idx = np.flatnonzero(self.condition == -1)
+        self.play(idx, np.asarray(actions)[idx])
+        self.moves += len(idx)
+
+        done = np.zeros(self.n_boards, dtype=bool)
+        done[idx] = self.condition[idx] != -1
+        finished = self.condition.copy()
+        if done.any():
+            self.results += np.bincount(finished[done], minlength=3)
+            if self.auto_reset:
+                self.reset(done)
+        return done, finished
+
+
+    # Set up the starting position of boards idx
+    def start(self, idx):
+        raise NotImplementedError
+
+
+    # N x squares array of the pieces on each board
+    def squares(self):
+        raise NotImplementedError
+
+
+    def legal_mask(self):
+        raise NotImplementedError
+
+
+    def play(self, idx, actions):
+        raise NotImplementedError
+
+
+    # Value of each action's square for the greedy policy
+    def square_values(self):
+        raise NotImplementedError
+
+
+
+# Tic-Tac-Toe and Connect 4: a move wins if every square of one of the
+# lines through it holds the mover's piece
+class BatchLineGame(BatchGame):
+
+    def __init__(self, n_boards, n_rows, n_cols, x, seed=None, auto_reset=True):
+        self.connect_x = x
+        geometry = board_geometry(n_rows, n_cols, x)
+        # lines[square]: the lines of x squares through it, padded with
+        # lines of the spare square (one more row for the spare square itself)
+        spare = n_rows*n_cols
+        width = max(1, max(len(lines) for lines in geometry.lines))
+        self.lines = np.full((spare + 1, width, x), spare, dtype=np.intp)
+        for i, lines in enumerate(geometry.lines):
+            if lines:
+                self.lines[i, :len(lines)] = lines
+        # the number of lines through each square
+        self.line_counts = np.array([len(lines) for lines in geometry.lines] + [0], dtype=np.float64)
+        self.boards = np.zeros((n_boards, spare + 1), dtype=np.int8)
+        super().__init__(n_boards, n_rows, n_cols, seed, auto_reset)
+
+
+    def start(self, idx):
+        self.boards[idx] = BoardGame.EMPTY
+
+
+    def squares(self):
+        return self.boards[:, :self.num_squares]
+
+
+    # The square each action plays, for boards idx (the spare square
+    # where it isn't valid)
+    def action_squares(self, idx):
+        raise NotImplementedError
+
+
+    # Mask of the actions on boards idx that complete a line of piece
+    def winning_actions(self, idx, piece):
+        squares = self.action_squares(idx)
+        cells = self.boards[idx[:, None, None, None], self.lines[squares]]
+        counts = np.count_nonzero(cells == piece[:, None, None, None], axis=3)
+        return (counts == self.connect_x - 1).any(axis=2) & (squares != self.num_squares)
+
+
+    def finish(self, idx, squares):
+        piece = self.pieces(idx)
+        cells = self.boards[idx[:, None, None], self.lines[squares]]
+        won = (cells == piece[:, None, None]).all(axis=2).any(axis=1)
+        self.counter[idx] += 1
+        self.condition[idx[won]] = self.current_player[idx[won]]
+        full = ~won & (self.counter[idx] >= self.num_squares)
+        self.condition[idx[full]] = 0
+        self.current_player[idx] = 3 - self.current_player[idx]
+
+
+
+class BatchTicTacToe(BatchLineGame):
+
+    def legal_mask(self):
+        return self.boards[:, :self.num_squares] == BoardGame.EMPTY
+
+
+    def action_squares(self, idx):
+        squares = np.broadcast_to(np.arange(self.num_squares), (len(idx), self.num_squares)).copy()
+        squares[self.boards[idx, :self.num_squares] != BoardGame.EMPTY] = self.num_squares
+        return squares
+
+
+    def play(self, idx, actions):
+        self.boards[idx, actions] = self.pieces(idx)
+        self.finish(idx, actions)
+
+
+    def square_values(self):
+        return self.line_counts[:self.num_squares]
+
+
+
+class BatchConnectX(BatchLineGame):
+
+    def __init__(self, n_boards, n_rows=6, n_cols=7, x=4, seed=None, auto_reset=True):
+        # pieces in each column
+        self.heights = np.zeros((n_boards, n_cols), dtype=np.intp)
+        super().__init__(n_boards, n_rows, n_cols, x, seed, auto_reset)
+
+
+    def start(self, idx):
+        super().start(idx)
+        self.heights[idx] = 0
+
+
+    def legal_mask(self):
+        return self.heights < self.num_rows
+
+
+    def action_squares(self, idx):
+        heights = self.heights[idx]
+        squares = (self.num_rows - 1 - heights)*self.num_cols + np.arange(self.num_cols)
+        squares[heights >= self.num_rows] = self.num_squares
+        return squares
+
+
+    def play(self, idx, actions):
+        squares = (self.num_rows - 1 - self.heights[idx, actions])*self.num_cols + actions
+        self.heights[idx, actions] += 1
+        self.boards[idx, squares] = self.pieces(idx)
+        self.finish(idx, squares)
+
+
+    # the value of the square each column would fill
+    def square_values(self):
+        return self.line_counts[self.action_squares(np.arange(self.n_boards))]
+
+
+
+# Square (row, col) is bit row*cols + col of a bitboard. Valid moves and
+# flips are found for all the boards at once by shifting the bitboards
+# along each of the 8 directions (as in Kogge-Stone fills), so boards are
+# limited to 64 squares.
+class BatchOthello(BatchGame):
+
+    def __init__(self, n_boards, n_rows=8, n_cols=8, seed=None, auto_reset=True):
+        if n_rows*n_cols > 64:
+            raise Exception(f'{n_rows}x{n_cols} is too large for a batch of Othello boards')
+        full = (1 << (n_rows*n_cols)) - 1
+        first_col = sum(1 << (r*n_cols) for r in range(n_rows))
+        last_col = first_col << (n_cols - 1)
+        # (shift, mask of squares a piece can land on without wrapping
+        # around a row) for each direction
+        self.shifts = []
+        for dr, dc in BoardGeometry.DIRECTIONS:
+            mask = full
+            if dc == 1:
+                mask &= ~first_col
+            elif dc == -1:
+                mask &= ~last_col
+            self.shifts.append((dr*n_cols + dc, np.uint64(mask)))
+        self.max_run = max(n_rows, n_cols) - 2
+        self.bits = np.array([1 << i for i in range(n_rows*n_cols)], dtype=np.uint64)
+
+        # pieces of player 1 and 2, and the valid moves of the player to move
+        self.x_bits = np.zeros(n_boards, dtype=np.uint64)
+        self.o_bits = np.zeros(n_boards, dtype=np.uint64)
+        self.legal = np.zeros(n_boards, dtype=np.uint64)
+        self.empty_mask = np.uint64(full)
+        super().__init__(n_boards, n_rows, n_cols, seed, auto_reset)
+
+
+    def start(self, idx):
+        r = self.num_rows//2
+        c = self.num_cols//2
+        self.x_bits[idx] = (1 << ((r-1)*self.num_cols + c)) | (1 << (r*self.num_cols + c-1))
+        self.o_bits[idx] = (1 << (r*self.num_cols + c)) | (1 << ((r-1)*self.num_cols + c-1))
+        self.legal[idx] = self.find_legal(*self.sides(idx))
+
+
+    def squares(self):
+        return ((self.x_bits[:, None] & self.bits) != 0).astype(np.int8) - \
+               ((self.o_bits[:, None] & self.bits) != 0).astype(np.int8)
+
+
+    def legal_mask(self):
+        return (self.legal[:, None] & self.bits) != 0
+
+
+    # The pieces of the player to move and their opponent on boards idx
+    def sides(self, idx):
+        first = self.current_player[idx] == 1
+        x = self.x_bits[idx]
+        o = self.o_bits[idx]
+        return np.where(first, x, o), np.where(first, o, x)
+
+
+    @staticmethod
+    def shift(bits, step, mask):
+        if step > 0:
+            return (bits << np.uint64(step)) & mask
+        return (bits >> np.uint64(-step)) & mask
+
+
+    def find_legal(self, mine, theirs):
+        empty = ~(mine | theirs) & self.empty_mask
+        legal = np.zeros_like(mine)
+        for step, mask in self.shifts:
+            run = self.shift(mine, step, mask) & theirs
+            for _ in range(self.max_run - 1):
+                run |= self.shift(run, step, mask) & theirs
+            legal |= self.shift(run, step, mask) & empty
+        return legal
+
+
+    def play(self, idx, actions):
+        mine, theirs = self.sides(idx)
+        move = self.bits[actions]
+        flips = np.zeros_like(mine)
+        for step, mask in self.shifts:
+            run = self.shift(move, step, mask) & theirs
+            for _ in range(self.max_run - 1):
+                run |= self.shift(run, step, mask) & theirs
+            closed = (self.shift(run, step, mask) & mine) != 0
+            flips |= np.where(closed, run, np.uint64(0))
+        mine = mine | flips | move
+        theirs = theirs & ~flips
+        first = self.current_player[idx] == 1
+        self.x_bits[idx] = np.where(first, mine, theirs)
+        self.o_bits[idx] = np.where(first, theirs, mine)
+        self.counter[idx] += 1
+
+        # the opponent moves next, unless they have to pass; if neither
+        # player can move, the game is over
+        self.current_player[idx] = 3 - self.current_player[idx]
+        self.legal[idx] = self.find_legal(theirs, mine)
+        stuck = idx[self.legal[idx] == 0]
+        if len(stuck) > 0:
+            self.current_player[stuck] = 3 - self.current_player[stuck]
+            self.legal[stuck] = self.find_legal(*self.sides(stuck))
+            over = stuck[self.legal[stuck] == 0]
+            score = np.bitwise_count(self.x_bits[over]).astype(np.int64) - np.bitwise_count(self.o_bits[over])
+            self.condition[over] = np.where(score > 0, 1, np.where(score < 0, 2, 0))
+
+
+    # corners best, then edges; the squares next to a corner worst
+    def square_values(self):
+        values = np.ones((self.num_rows, self.num_cols))
+        values[[0, -1], :] = values[:, [0, -1]] = 10
+        for r, c, dr, dc in [(0, 0, 1, 1), (0, -1, 1, -1), (-1, 0, -1, 1), (-1, -1, -1, -1)]:
+            values[r+dr, c] = values[r, c+dc] = -20
+            values[r+dr, c+dc] = -50
+            values[r, c] = 100
+        return values.ravel()
+
+
+
+# A uniformly random valid move for each of boards idx
+def random_policy(batch, idx):
+    legal = batch.legal_mask()[idx]
+    keys = np.where(legal, batch.rng.random(legal.shape), -1.0)
+    return np.argmax(keys, axis=1)
+
+
+# The valid move whose square is worth most (see square_values), at random
+# among equals. In Tic-Tac-Toe and Connect 4, a winning move comes first,
+# then one that blocks the opponent's win.
+def greedy_policy(batch, idx):
+    legal = batch.legal_mask()[idx]
+    values = batch.square_values()
+    if values.ndim == 2:
+        values = values[idx]
+    keys = values + batch.rng.random(legal.shape)
+    if isinstance(batch, BatchLineGame):
+        piece = batch.pieces(idx)
+        keys = keys + 1e4*batch.winning_actions(idx, piece) + 1e3*batch.winning_actions(idx, -piece)
+    return np.argmax(np.where(legal, keys, -np.inf), axis=1)
+
+
+POLICIES = {'random': random_policy, 'greedy': greedy_policy}
+
+
+# A batch of n_boards boards of the same game and size as game
+def batch_game(game, n_boards, seed=None, auto_reset=True):
+    if type(game) is TicTacToe:
+        return BatchTicTacToe(n_boards, game.num_rows, game.num_cols, game.connect_x, seed, auto_reset)
+    if type(game) is Connect_X:
+        return BatchConnectX(n_boards, game.num_rows, game.num_cols, game.connect_x, seed, auto_reset)
+    if type(game) is Othello:
+        return BatchOthello(n_boards, game.num_rows, game.num_cols, seed, auto_reset)
+    raise Exception(f'No batch version of {type(game).__name__}')
+
+
+# Play until num_games games have finished, with policy1 moving for
+# player 1 and policy2 for player 2 on every board
+def run_match(batch, policy1, policy2, num_games):
+    actions = np.zeros(batch.n_boards, dtype=np.intp)
+    while batch.games() < num_games:
+        first = batch.current_player == 1
+        for policy, which in [(policy1, first), (policy2, ~first)]:
+            idx = np.flatnonzero(which & (batch.condition == -1))
+            if len(idx) > 0:
+                actions[idx] = policy(batch, idx)
+        batch.step(actions)
+    return batch.results
+
+
+def main():
+    from game_registry import new_game
+
+    parser = argparse.ArgumentParser(description='Play many games at once between simple policies')
+    parser.add_argument('game', help="game name, e.g. 'Connect4' or 'Tic-Tac-Toe:15x15x5'")
+    parser.add_argument('policy1', choices=list(POLICIES))
+    parser.add_argument('policy2', choices=list(POLICIES))
+    parser.add_argument('--boards', type=int, default=4096, help='boards played at once')
+    parser.add_argument('--games', type=int, default=100000)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    batch = batch_game(new_game(args.game), args.boards, args.seed)
+    start = time.perf_counter()
+    draws, player1_wins, player2_wins = run_match(batch, POLICIES[args.policy1], POLICIES[args.policy2], args.games)
+    elapsed = time.perf_counter() - start
+
+    print(f'In {draws + player1_wins + player2_wins} games:')
+    print(f'\tPlayer 1: {player1_wins} wins')
+    print(f'\tPlayer 2: {player2_wins} wins')
+    print(f'\t{draws} draws')
+    print(f'{batch.moves} moves in {elapsed:.2f} s: {batch.moves/elapsed:,.0f} moves/sec, '
+          f'{batch.games()/elapsed:,.0f} games/sec')
+
+
+if __name__ == "__main__":
+    main()
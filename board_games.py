@@ -1,22 +1,416 @@
-import random
+import copy
+import os
+from array import array
 import numpy as np
-import queue
-from statistics import mean
+from collections import OrderedDict
 
 INFINITY = 10000
 
+
+# The symmetries of an m x n board, each stored as a triple
+# (transpose, flip_rows, flip_cols) applied in that order.
+# A transpose only maps the board onto itself if it is square.
+def dihedral_symmetries(n_rows, n_cols):
+    syms = []
+    for transpose in ([False, True] if n_rows == n_cols else [False]):
+        for flip_rows in [False, True]:
+            for flip_cols in [False, True]:
+                syms.append((transpose, flip_rows, flip_cols))
+    return syms
+
+
+# Tables for walking lines on an n_rows x n_cols board, where x pieces
+# in a row win. Squares are row-major indices row*n_cols + col.
+#   rays[i]:      for each of DIRECTIONS, the squares from square i
+#                 (not included) to the edge of the board
+#   neighbors[i]: the squares next to square i
+#   lines[i]:     every line of x squares through square i
+#   windows:      every line of x squares on the board, as an array
+#   cell_steps:   DIRECTIONS as offsets between the cells of a padded
+#                 board (see BoardGame.configure_board)
+# These are shared by all games of the same geometry (see board_geometry).
+class BoardGeometry:
+
+    # the 4 directions of a line, then the opposite of each
+    DIRECTIONS = ((1,0), (0,1), (1,1), (1,-1), (-1,0), (0,-1), (-1,-1), (-1,1))
+
+    def __init__(self, n_rows, n_cols, x=0):
+        self.key = (n_rows, n_cols, x)
+        self.rays = []
+        for row in range(n_rows):
+            for col in range(n_cols):
+                rays = []
+                for dr, dc in self.DIRECTIONS:
+                    ray = []
+                    r = row + dr
+                    c = col + dc
+                    while 0 <= r < n_rows and 0 <= c < n_cols:
+                        ray.append(r*n_cols + c)
+                        r += dr
+                        c += dc
+                    rays.append(tuple(ray))
+                self.rays.append(tuple(rays))
+        self.neighbors = [tuple(ray[0] for ray in rays if ray) for rays in self.rays]
+
+        self.lines = []
+        for i, rays in enumerate(self.rays):
+            lines = []
+            if x > 0:
+                for k in range(4):
+                    forward = rays[k]
+                    back = rays[k+4]
+                    # line with s squares before square i
+                    for s in range(x):
+                        if s <= len(back) and x-1-s <= len(forward):
+                            lines.append(back[:s][::-1] + (i,) + forward[:x-1-s])
+            self.lines.append(tuple(lines))
+        # each line starts from the same end whichever square it came from
+        self.windows = np.array(sorted({line for lines in self.lines for line in lines}),
+                                dtype=np.intp).reshape(-1, max(x, 1))
+
+        stride = n_cols + 2
+        self.cell_steps = tuple(dr*stride + dc for dr, dc in self.DIRECTIONS)
+
+
+    # Sent and copied as the key, since the tables can be large
+    def __reduce__(self):
+        return (board_geometry, self.key)
+
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+# BoardGeometry by (n_rows, n_cols, x), made when first needed
+_geometries = {}
+
+
+def board_geometry(n_rows, n_cols, x=0):
+    key = (n_rows, n_cols, x)
+    geometry = _geometries.get(key)
+    if geometry is None:
+        geometry = _geometries[key] = BoardGeometry(n_rows, n_cols, x)
+    return geometry
+
+
+# Raised inside a search when its abort check fires
+class SearchAborted(Exception):
+    pass
+
+
+# Last-in first-out stack of earlier moves, with the put()/get() of
+# queue.LifoQueue but without its locking (or import cost)
+class MoveStack(list):
+    put = list.append
+    get = list.pop
+
+
+# Each game draws its random numbers from its own stream, so that games
+# played with the same seed play out the same way, in any process.
+# Uniform numbers are drawn from the NumPy Generator a buffer at a time,
+# which is much cheaper than one call per number.
+class RandomStream:
+
+    BUFFER = 1024
+
+    # seed: anything numpy.random.default_rng() accepts; None for a fresh
+    # seed from the operating system
+    def __init__(self, seed=None):
+        self.generator = np.random.default_rng(seed)
+        self.buffer = []
+
+
+    def random(self):
+        if not self.buffer:
+            self.buffer = self.generator.random(self.BUFFER).tolist()
+        return self.buffer.pop()
+
+
+    def choice(self, seq):
+        return seq[int(self.random() * len(seq))]
+
+
+    # in place, like random.shuffle
+    def shuffle(self, lst):
+        for i in range(len(lst)-1, 0, -1):
+            j = int(self.random() * (i+1))
+            lst[i], lst[j] = lst[j], lst[i]
+
+
+# Seed of game number index of a run started from the master seed. Every
+# game gets an independent stream, whichever process plays it.
+def game_seed(master, index):
+    return np.random.SeedSequence(master, spawn_key=(index,))
+
+
+# Moves are lists, integers or None; this makes them hashable
+def move_key(move):
+    if isinstance(move, list):
+        return tuple(move)
+    return move
+
+
+class SearchContext:
+
+    # What a Minimax player remembers between searches:
+    #   table:   (player, canonical position key) -> (depth, score, bound, best move),
+    #            with the best move stored in the canonical frame.
+    #            Following the best moves gives the principal subtree.
+    #   history: (player, move) -> how often the move caused a cutoff,
+    #            used to order moves.
+    # The table holds at most max_entries positions, dropping the least
+    # recently stored. Unless keep_between_games is set, everything is
+    # forgotten when the game is reset.
+    # With a SharedTable (see shared_table.py) the table lives in shared
+    # memory instead, where searches in other processes see it. Its entries
+    # are keyed by the search settings too, and are never forgotten.
+
+    EXACT = 0
+    LOWER = 1
+    UPPER = 2
+
+    DEFAULT_ENTRIES = 200000
+
+    def __init__(self, max_entries=DEFAULT_ENTRIES, keep_between_games=False, shared=None):
+        self.max_entries = max_entries
+        self.keep_between_games = keep_between_games
+        self.table = OrderedDict()
+        self.shared = shared
+        self.history = {}
+        # scoring settings the table entries were computed with
+        self.settings = None
+        self.salt = b''
+        self.probes = 0
+        self.hits = 0
+
+
+    def clear(self):
+        self.table = OrderedDict()
+        self.history = {}
+
+
+    def new_game(self):
+        if not self.keep_between_games:
+            self.clear()
+
+
+    # Scores computed with other settings can't be reused
+    def start_search(self, settings):
+        if settings != self.settings:
+            self.table = OrderedDict()
+            self.settings = settings
+            self.salt = repr(settings).encode()
+
+
+    def probe(self, key):
+        self.probes += 1
+        if self.shared is not None:
+            entry = self.shared.probe(key, self.salt)
+            if entry is not None:
+                self.hits += 1
+            return entry
+        entry = self.table.get(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+
+    def store(self, key, entry):
+        if self.shared is not None:
+            self.shared.store(key, entry, self.salt)
+            return
+        table = self.table
+        if key in table:
+            table.move_to_end(key)
+        elif len(table) >= self.max_entries:
+            table.popitem(last=False)
+        table[key] = entry
+
+
+    def add_cutoff(self, player, move, depth):
+        key = (player, move_key(move))
+        self.history[key] = self.history.get(key, 0) + depth*depth
+
+
+    # Inside the search: the best move from the table first, before the
+    # moves are generated, so that a cutoff from it never generates them;
+    # then the rest by history, as in order_moves. moves is an iterator,
+    # and is_valid checks the table's move. None is no table move (a pass
+    # in Othello is None too, but is then the only move).
+    def iter_ordered_moves(self, player, moves, best_move, is_valid):
+        tried = best_move is not None and is_valid(best_move)
+        if tried:
+            yield best_move
+        history = self.history
+        for move in sorted(moves, key=lambda move: -history.get((player, move_key(move)), 0)):
+            if not tried or move != best_move:
+                yield move
+
+
+    # Best move from the table first, then by history (the sort is
+    # stable, so ties keep their random order)
+    def order_moves(self, player, moves, best_move=None):
+        history = self.history
+        moves = sorted(moves, key=lambda move: -history.get((player, move_key(move)), 0))
+        if best_move is not None and best_move in moves:
+            moves.remove(best_move)
+            moves.insert(0, best_move)
+        return moves
+
+
+    # Win/loss scores depend on the distance from the root, so they are
+    # stored relative to the position instead
+    @staticmethod
+    def to_table(score, depth_counter):
+        if score > INFINITY/2:
+            return score + depth_counter
+        if score < -INFINITY/2:
+            return score - depth_counter
+        return score
+
+
+    @staticmethod
+    def from_table(score, depth_counter):
+        if score > INFINITY/2:
+            return score - depth_counter
+        if score < -INFINITY/2:
+            return score + depth_counter
+        return score
+
+
+class EvalCache:
+
+    # Monte Carlo estimates of positions' scores, kept between searches,
+    # moves and games so that playouts are never thrown away:
+    #   table: (canonical position key, playout depth) -> [count, mean, m2]
+    #          of the playout scores for player 1, updated by Welford's
+    #          method (m2 is the sum of squared deviations from the mean).
+    # A query only adds playouts until the estimate has num_samples of
+    # them or, with a precision, until its standard error is at most
+    # precision (after at least MIN_SAMPLES). The table holds at most
+    # max_entries positions, dropping the least recently used.
+
+    DEFAULT_ENTRIES = 100000
+    MIN_SAMPLES = 4
+
+    def __init__(self, max_entries=DEFAULT_ENTRIES, precision=None):
+        self.max_entries = max_entries
+        self.precision = precision
+        self.table = OrderedDict()
+        self.queries = 0
+        self.hits = 0
+        self.playouts = 0
+
+
+    def clear(self):
+        self.table = OrderedDict()
+
+
+    # playout: function returning the score of one playout for player 1
+    def estimate(self, key, num_samples, playout):
+        self.queries += 1
+        table = self.table
+        entry = table.get(key)
+        if entry is None:
+            if len(table) >= self.max_entries:
+                table.popitem(last=False)
+            entry = [0, 0.0, 0.0]
+            table[key] = entry
+        else:
+            table.move_to_end(key)
+            if not self.wants_samples(entry, num_samples):
+                self.hits += 1
+        while self.wants_samples(entry, num_samples):
+            score = playout()
+            self.playouts += 1
+            entry[0] += 1
+            delta = score - entry[1]
+            entry[1] += delta/entry[0]
+            entry[2] += delta*(score - entry[1])
+        return entry[1]
+
+
+    def wants_samples(self, entry, num_samples):
+        count = entry[0]
+        if count >= num_samples:
+            return False
+        if self.precision is None or count < self.MIN_SAMPLES:
+            return True
+        return entry[2]/(count - 1)/count > self.precision*self.precision
+
+
+    def stats(self):
+        return {'queries': self.queries, 'hits': self.hits, 'playouts': self.playouts,
+                'entries': len(self.table)}
+
+
+    # The estimates can be large, and are rebuilt empty in other processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['table'] = OrderedDict()
+        return state
+
+
+# Empty squares where piece would complete x in a row on a line through
+# (row, col), which must hold piece. Returned as row-major square indices.
+def completing_squares(board, row, col, piece, x):
+    n_rows, n_cols = board.shape
+    found = set()
+    for dr, dc in ((1,0), (0,1), (1,1), (1,-1)):
+        # the run of pieces on each side of (row, col), and where it stops
+        runs = []
+        for sign in (1, -1):
+            r = row + sign*dr
+            c = col + sign*dc
+            n = 0
+            while 0 <= r < n_rows and 0 <= c < n_cols and board[r, c] == piece:
+                r += sign*dr
+                c += sign*dc
+                n += 1
+            runs.append((n, r, c, sign))
+        # only the empty square ending a run can complete a line
+        for side in (0, 1):
+            n, r, c, sign = runs[side]
+            if not (0 <= r < n_rows and 0 <= c < n_cols) or board[r, c] != BoardGame.EMPTY:
+                continue
+            # filling it joins both runs with any run beyond it
+            total = n + 1 + runs[1-side][0]
+            rr = r + sign*dr
+            cc = c + sign*dc
+            while total < x-1 and 0 <= rr < n_rows and 0 <= cc < n_cols and board[rr, cc] == piece:
+                total += 1
+                rr += sign*dr
+                cc += sign*dc
+            if total >= x-1:
+                found.add(r*n_cols + c)
+    return found
+
+
 class BoardGame:
 
     # values of board
     XPIECE = 1
     OPIECE = -1
     EMPTY = 0
+    # around the squares of a padded board (see configure_board)
+    BORDER = 2
+
+    # random squares random_move() tries before listing the valid moves
+    RANDOM_TRIES = 4
 
     def __init__(self, n_rows, n_cols, iactive=True):
         # instantiate the board
         self.num_rows = n_rows
         self.num_cols = n_cols
         self.board = np.zeros((self.num_rows, self.num_cols), dtype=np.int8)
+        # rays and lines through each square (child classes with a line
+        # length to win replace this)
+        self.geometry = board_geometry(n_rows, n_cols)
+        # Padded storage (see configure_board): None, or the squares in a
+        # flat array with a border, square (row, col) at origin + row*stride + col
+        self.cells = None
+        self.stride = self.num_cols
+        self.origin = 0
         # set the move counter to zero
         self.counter = 0
                 
@@ -30,13 +424,49 @@ class BoardGame:
         
         self.last_move = None
         # queue should contain all the moves prior to last_move
-        self.queue = queue.LifoQueue()
+        self.queue = MoveStack()
 
         self.current_player = 1
         self.interactive = iactive
         
         # Default to human players
         self.players = [self.get_move_human, self.get_move_human]
+        self.player_options = [['h'], ['h']]
+
+        # Optional Ponderer that may already have searched the position
+        self.ponderer = None
+        # Optional function polled by minimax; a search stops when it returns True
+        self.search_abort = None
+
+        # With search_memory, each Minimax player keeps a SearchContext
+        # between moves. It is off by default: a context orders the moves
+        # by what it remembers, so moves scoring the same are no longer
+        # chosen at random, and a cutoff can't spare generating the rest.
+        self.contexts = [None, None]
+        self.search_memory = 0
+        self.keep_search = False
+        # Each Monte Carlo tree search player keeps its MCTS (see mcts.py),
+        # which owns its pool of playout processes
+        self.tree_searches = [None, None]
+        # optional SharedTable used by the contexts instead of their own tables
+        self.shared_table = None
+        # optional EvalCache keeping the playouts of score_board_random
+        self.eval_cache = None
+        # context of the search in progress
+        self.search_context = None
+        # evaluation used in place of score_board by the search in progress
+        # (see evaluation.py), or None
+        self.evaluator = None
+
+        # Board symmetries that leave the rules unchanged
+        # (child classes extend this beyond the identity)
+        self.symmetries = [(False, False, False)]
+
+        # number of nodes visited by minimax, for measuring search cost
+        self.nodes_searched = 0
+
+        # source of every random choice the computer players make
+        self.rng = RandomStream()
 
 
     def change_player(self):
@@ -46,16 +476,184 @@ class BoardGame:
             self.current_player = 1
 
     def configure_player(self, n, options):
+        self.player_options[n-1] = options
         if options[0] == 'h':
             self.players[n-1] = self.get_move_human
         elif options[0] == 'r':
             self.players[n-1] = self.get_move_random
         elif options[0] == 'm':
-            if options[2] == 'b':
-                self.players[n-1] = lambda:self.get_move_minimax(options[1])
-            if options[2] == 'r':
-                self.players[n-1] = lambda:self.get_move_minimax(options[1], True, options[3], options[4])
-                
+            args = self.minimax_args(options)
+            if self.search_memory > 0 or self.shared_table is not None:
+                context = SearchContext(self.search_memory, self.keep_search, self.shared_table)
+            else:
+                context = None
+            self.contexts[n-1] = context
+            self.players[n-1] = lambda:self.get_move_minimax(*args, context=context)
+        elif options[0] == 's':
+            self.players[n-1] = self.solver_player()
+        elif options[0] == 't':
+            from mcts import MCTS
+            search = MCTS(options[2])
+            self.tree_searches[n-1] = search
+            self.players[n-1] = lambda:self.get_move_mcts(search, options[1])
+
+
+    # Stop the playout processes of the Monte Carlo tree search players;
+    # they start again with the next search
+    def stop_tree_searches(self):
+        for search in self.tree_searches:
+            if search is not None:
+                search.shutdown()
+
+
+    # How many positions each Minimax player remembers (0 to disable),
+    # and whether they are remembered from one game to the next
+    def configure_search_memory(self, max_entries, keep_between_games=False):
+        self.search_memory = max_entries
+        self.keep_search = keep_between_games
+        for n in [1, 2]:
+            self.configure_player(n, self.player_options[n-1])
+
+
+    # Share Minimax results through a SharedTable (None to stop sharing).
+    # The table goes with the game when it is sent to another process.
+    def configure_shared_table(self, table):
+        self.shared_table = table
+        for n in [1, 2]:
+            self.configure_player(n, self.player_options[n-1])
+
+
+    # Keep the Monte Carlo scores of random playouts (the 'm <depth> r'
+    # players) in an EvalCache of max_entries positions (0 to stop), with
+    # an optional target standard error. The cache is kept between games.
+    def configure_eval_cache(self, max_entries, precision=None):
+        if max_entries > 0:
+            self.eval_cache = EvalCache(max_entries, precision)
+        else:
+            self.eval_cache = None
+
+
+    # Full argument tuple for get_move_minimax() given a minimax player's options
+    def minimax_args(self, options):
+        if options[2] == 'r':
+            return (options[1], True, options[3], options[4], None, False)
+        if options[2] == 'h':
+            return (options[1], True, options[3], options[4], None, True)
+        if options[2] == 'e':
+            from evaluation import load_evaluator
+            return (options[1], False, 1, 0, load_evaluator(options[3], self), False)
+        return (options[1], False, 1, 0, None, False)
+
+
+    # Keep the squares in a flat array('b') with a border of BORDER around
+    # them (padded=True), or in a 2-D NumPy array (padded=False). With the
+    # border, a walk along a line stops at the edge of the board without
+    # any bounds checks, using integer offsets into cells. Either way,
+    # board is a NumPy array of the squares, for display and everything
+    # else; with padding it is a view of cells. Set this before playing.
+    def configure_board(self, padded):
+        board = np.array(self.board)
+        if padded:
+            self.stride = self.num_cols + 2
+            self.origin = self.stride + 1
+            self.cells = array('b', bytes([self.BORDER]) * (self.stride * (self.num_rows + 2)))
+            self.__attach_board()
+            self.board[:] = board
+        else:
+            self.stride = self.num_cols
+            self.origin = 0
+            self.cells = None
+            self.board = board
+
+
+    def __attach_board(self):
+        padded = np.frombuffer(self.cells, dtype=np.int8).reshape(self.num_rows+2, self.stride)
+        self.board = padded[1:-1, 1:-1]
+
+
+    # Replace the squares of the board with a copy of board
+    def load_board(self, board):
+        if self.cells is None:
+            self.board = np.array(board, dtype=np.int8)
+        else:
+            self.board[:] = board
+
+
+    # Number of piece in the line through cell i (which holds piece)
+    # in the direction step (padded boards only)
+    def line_length(self, i, piece, step):
+        cells = self.cells
+        n = 1
+        j = i + step
+        while cells[j] == piece:
+            n += 1
+            j += step
+        j = i - step
+        while cells[j] == piece:
+            n += 1
+            j -= step
+        return n
+
+
+    # True if piece, which is at (row, col), has at least x in a row
+    # along some line through it
+    def completes_line(self, row, col, piece, x):
+        if self.cells is not None:
+            i = self.origin + row*self.stride + col
+            for step in self.geometry.cell_steps[:4]:
+                if self.line_length(i, piece, step) >= x:
+                    return True
+            return False
+
+        flat = self.board.ravel()
+        rays = self.geometry.rays[row*self.num_cols + col]
+        for k in range(4):
+            n = 1
+            for j in rays[k]:
+                if flat[j] != piece:
+                    break
+                n += 1
+            for j in rays[k+4]:
+                if flat[j] != piece:
+                    break
+                n += 1
+            if n >= x:
+                return True
+        return False
+
+
+    # Make the computer players' random choices repeatable
+    def seed(self, seed):
+        self.rng = RandomStream(seed)
+
+
+    # Copy of the game that can be searched independently of this one
+    def clone(self):
+        return copy.deepcopy(self)
+
+
+    # Games can be pickled (e.g. sent to worker processes). The player
+    # agents are bound to this object, so they are rebuilt from their options.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['players'] = None
+        state['ponderer'] = None
+        state['search_abort'] = None
+        state['search_context'] = None
+        # contexts can be large, and are rebuilt empty
+        state['contexts'] = [None, None]
+        state['tree_searches'] = [None, None]
+        return state
+
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.cells is not None:
+            self.__attach_board()
+        self.players = [self.get_move_human, self.get_move_human]
+        for n in [1, 2]:
+            self.configure_player(n, self.player_options[n-1])
+
 
     def get_move(self):
         return self.players[self.current_player-1]()
@@ -91,29 +689,163 @@ class BoardGame:
             return self.get_move_minimax(5, random_score=True)
    
 
-    def get_move_minimax(self, depth, random_score=False, random_nums=1, random_depth=0):
+    # With halving (and random_score), the random_nums playouts per leaf
+    # are shared out between the moves by sequential halving instead of
+    # evenly (see halving_search)
+    def get_move_minimax(self, depth, random_score=False, random_nums=1, random_depth=0,
+                         evaluator=None, halving=False, context=None):
+        # the position may already have been searched while pondering
+        if self.ponderer is not None:
+            found, move = self.ponderer.take(self, (depth, random_score, random_nums, random_depth, evaluator, halving))
+            if found:
+                return move
+
         # get a list of valid moves
-        moves = self.valid_moves()
+        moves = self.search_moves()
         # if just one valid move, play that one
         if len(moves) == 1:
             return moves[0]
         
         # randomly shuffle them
-        random.shuffle(moves)
+        self.rng.shuffle(moves)
+        if halving and random_score:
+            return self.halving_search(moves, depth, random_nums, random_depth)
+        player = self.current_player
+        # try the moves that did well in earlier searches first
+        if context is not None:
+            context.start_search(self.search_settings((depth, random_score, random_nums, random_depth, evaluator, halving)))
+            key, sym = self.canonical_key()
+            key = (player, key)
+            entry = context.probe(key)
+            best_move = None
+            if entry is not None and entry[3] is not None:
+                best_move = self.inverse_transform_move(entry[3], sym)
+            moves = context.order_moves(player, moves, best_move)
+
         # pick the move that gives the biggest board score
+        best_move = None
+        best_score = None
+        # moves leading to symmetric positions score the same,
+        # so only the first of each is searched
+        seen = set()
+        self.search_context = context
+        self.evaluator = evaluator
+        try:
+            for move in moves:
+                self.make_move(move)
+                if len(self.symmetries) > 1:
+                    move_pos = self.canonical_key()[0]
+                    if move_pos in seen:
+                        self.undo_move()
+                        continue
+                    seen.add(move_pos)
+                # a move only needs an exact score if it beats the best so far
+                alpha = -2*INFINITY if best_score is None else best_score
+                score = self.minimax(0, depth, player, random_score, random_nums, random_depth, alpha)
+                self.undo_move()
+                if best_score is None or score > best_score:
+                    best_move = move
+                    best_score = score
+        finally:
+            self.search_context = None
+            self.evaluator = None
+
+        if context is not None:
+            context.store(key, (depth+1, SearchContext.to_table(best_score, -1),
+                                SearchContext.EXACT, self.transform_move(best_move, sym)))
+        return best_move
+
+
+    # Sequential halving over the moves of a Minimax search with random
+    # scoring, for the playouts a plain search would spend (random_nums
+    # per leaf for every move). Half of them are spread evenly over all
+    # the moves; the rest are split evenly between rounds, each of which
+    # keeps the better half of the moves by their mean score so far and
+    # searches them with an even share of its playouts, until two moves
+    # are left. (Halving from the start leaves too few playouts to tell
+    # the moves apart in the first round.) The best of the two is played.
+    # The playouts per leaf spent never exceed the budget: a round that
+    # can't give every move one ends the search, and a budget too small
+    # for a first round of half of it is spread evenly, as without halving.
+    def halving_search(self, moves, depth, random_nums, random_depth):
         player = self.current_player
-        scores = []
-        for move in moves:
-            self.make_move(move)
-            score = self.minimax(0, depth, player, random_score, random_nums, random_depth)
-            scores.append(score)
-            self.undo_move()
-        #print(f'{moves} and {scores}')
-        return moves[ scores.index(max(scores)) ]        
+        # moves leading to symmetric positions score the same
+        if len(self.symmetries) > 1:
+            seen = set()
+            distinct = []
+            for move in moves:
+                self.make_move(move)
+                move_pos = self.canonical_key()[0]
+                self.undo_move()
+                if move_pos not in seen:
+                    seen.add(move_pos)
+                    distinct.append(move)
+            moves = distinct
+        budget = random_nums * len(moves)
+        # rounds after the first, halving the moves until two are left
+        halvings = max(0, (len(moves) - 1).bit_length() - 1)
+        if budget // 2 < len(moves):
+            halvings = 0
+        # per move: sum of score * playouts per leaf, and playouts per leaf
+        totals = [0.0] * len(moves)
+        samples = [0] * len(moves)
+        candidates = list(range(len(moves)))
+        spent = 0
+        nums = random_nums if halvings == 0 else budget // 2 // len(moves)
+        # no SearchContext: its table would answer the later rounds with
+        # the scores of the first
+        while True:
+            for i in candidates:
+                self.make_move(moves[i])
+                score = self.minimax(0, depth, player, True, nums, random_depth)
+                self.undo_move()
+                totals[i] += score * nums
+                samples[i] += nums
+            spent += nums * len(candidates)
+            candidates.sort(key=lambda i: totals[i] / samples[i], reverse=True)
+            if len(candidates) <= 2 or halvings == 0:
+                return moves[candidates[0]]
+            candidates = candidates[:(len(candidates) + 1) // 2]
+            nums = (budget - spent) // halvings // len(candidates)
+            halvings -= 1
+            if nums == 0:
+                return moves[candidates[0]]
+
+
+    # The Minimax score of every valid move, as a list of (move, score).
+    # Unlike get_move_minimax, every score is exact rather than a bound.
+    # Moves leading to symmetric positions share one search. (halving is
+    # accepted for the same arguments, but every move is scored in full.)
+    def score_moves(self, depth, random_score=False, random_nums=1, random_depth=0,
+                    evaluator=None, halving=False, context=None):
+        if context is not None:
+            context.start_search(self.search_settings((depth, random_score, random_nums, random_depth, evaluator, halving)))
+        player = self.current_player
+        scored = {}
+        results = []
+        self.search_context = context
+        self.evaluator = evaluator
+        try:
+            for move in self.search_moves():
+                self.make_move(move)
+                key = self.canonical_key()[0]
+                if key not in scored:
+                    scored[key] = self.minimax(0, depth, player, random_score, random_nums, random_depth)
+                results.append((move, scored[key]))
+                self.undo_move()
+        finally:
+            self.search_context = None
+            self.evaluator = None
+        return results
 
 
     def get_move_random(self):
-        return random.choice(self.valid_moves())
+        return self.random_move()
+
+
+    # The move of a Monte Carlo tree search of num_playouts random playouts
+    def get_move_mcts(self, search, num_playouts):
+        return search.best_move(self, num_playouts)
 
 
     def get_piece(self, player = None):
@@ -125,8 +857,16 @@ class BoardGame:
             return self.OPIECE
 
 
-    # Implement a minimax-like scoring of the game tree
-    def minimax(self, depth_counter, depth, player, random_score, random_nums, random_depth):
+    # Implement a minimax-like scoring of the game tree.
+    # Scores are from the point of view of player. Branches that can't
+    # change the result are cut off (alpha-beta pruning): a returned score
+    # <= alpha or >= beta is only a bound on the true score.
+    def minimax(self, depth_counter, depth, player, random_score, random_nums, random_depth,
+                alpha=-2*INFINITY, beta=2*INFINITY):
+        self.nodes_searched += 1
+        if self.search_abort is not None and self.search_abort():
+            raise SearchAborted()
+
         # Handle an end condition immediately
         if self.condition > 0:
             if self.condition == player:
@@ -139,42 +879,167 @@ class BoardGame:
         if self.condition == 0:
             return 0
 
+        # reuse what an earlier search found about this position
+        context = self.search_context
+        best_move = None
+        if context is not None:
+            key, sym = self.canonical_key()
+            # scores are from the point of view of player
+            key = (player, key)
+            entry = context.probe(key)
+            if entry is not None:
+                if entry[0] >= depth:
+                    score = SearchContext.from_table(entry[1], depth_counter)
+                    if entry[2] == SearchContext.EXACT:
+                        return score
+                    elif entry[2] == SearchContext.LOWER:
+                        if score >= beta:
+                            return score
+                        alpha = max(alpha, score)
+                    elif score <= alpha:
+                        return score
+                    else:
+                        beta = min(beta, score)
+                if entry[3] is not None:
+                    best_move = self.inverse_transform_move(entry[3], sym)
+
         # at depth == 0, just score the board
         if depth == 0:
             # Note that score_board includes checks for winning,
             # but these should never be encountered
             if random_score:
-                return self.score_board_random(player, random_nums, random_depth)
+                score = self.score_board_random(player, random_nums, random_depth)
+            elif self.evaluator is not None:
+                score = self.evaluator.score_board(self, player)
             else:
-                return self.score_board(player)
-        else:
-            # get a list of possible moves
-            moves = self.valid_moves()            
-            # play each move and score the board
-            scores = []
-            for move in moves:
-                #print(f'Minimax (depth {depth}): Considering {move}')
-                self.make_move(move)
-                #self.display_board()
-                score = self.minimax(depth_counter+1, depth-1, player, random_score, random_nums, random_depth)
-                #print(f'Minimax (depth {depth}): Score {score}')
-                scores.append(score)
-                self.undo_move()
+                score = self.score_board(player)
+            if context is not None:
+                context.store(key, (0, score, SearchContext.EXACT, None))
+            return score
 
-            #print(f'Depth {depth}: {moves} and {scores}')
-            #print(f'Player {player} for {self.current_player}\n')
-                
-            # return the max or min score
-            if player == self.current_player:
-                return max(scores)
+        # the possible moves, generated as they are needed; with a context,
+        # all but its best move have to be generated to be ordered
+        moves = self.iter_search_moves()
+        if context is not None:
+            moves = context.iter_ordered_moves(self.current_player, moves, best_move, self.is_valid)
+
+        # play each move and score the board, keeping the max or min score
+        maximize = (player == self.current_player)
+        best_score = None
+        low = alpha
+        high = beta
+        for move in moves:
+            self.make_move(move)
+            score = self.minimax(depth_counter+1, depth-1, player, random_score, random_nums, random_depth, low, high)
+            self.undo_move()
+
+            if maximize:
+                if best_score is None or score > best_score:
+                    best_score = score
+                    best_move = move
+                    low = max(low, score)
             else:
-                return min(scores)
+                if best_score is None or score < best_score:
+                    best_score = score
+                    best_move = move
+                    high = min(high, score)
+            if low >= high:
+                # the opponent will avoid this position
+                if context is not None:
+                    context.add_cutoff(self.current_player, move, depth)
+                break
+
+        if context is not None:
+            if best_score <= alpha:
+                bound = SearchContext.UPPER
+            elif best_score >= beta:
+                bound = SearchContext.LOWER
+            else:
+                bound = SearchContext.EXACT
+            context.store(key, (depth, SearchContext.to_table(best_score, depth_counter), bound,
+                                self.transform_move(best_move, sym)))
+        return best_score
+
+
+    # Key identifying a position: the board (by default the current one)
+    # together with the player to move
+    def position_key(self, board=None):
+        if board is None:
+            board = self.board
+        return board.tobytes() + bytes([self.current_player])
+
+
+    # Map the current position to a canonical representative of its
+    # symmetry class. Returns the canonical key and the symmetry taking
+    # the current board to the canonical board, so that position-keyed
+    # caches can share entries between symmetric positions.
+    def canonical_key(self):
+        best_key = None
+        best_sym = None
+        for sym in self.symmetries:
+            key = self.position_key(self.transform_board(self.board, sym))
+            if best_key is None or key < best_key:
+                best_key = key
+                best_sym = sym
+        return best_key, best_sym
+
+
+    def canonical_board(self):
+        return self.transform_board(self.board, self.canonical_key()[1])
+
+
+    def transform_board(self, board, sym):
+        transpose, flip_rows, flip_cols = sym
+        if transpose:
+            board = board.T
+        if flip_rows:
+            board = board[::-1, :]
+        if flip_cols:
+            board = board[:, ::-1]
+        return board
+
+
+    def inverse_transform_board(self, board, sym):
+        transpose, flip_rows, flip_cols = sym
+        if flip_cols:
+            board = board[:, ::-1]
+        if flip_rows:
+            board = board[::-1, :]
+        if transpose:
+            board = board.T
+        return board
+
+
+    # Moves are mapped with the same symmetry as the board.
+    # (Transposes only occur for square boards.)
+    def transform_move(self, move, sym):
+        transpose, flip_rows, flip_cols = sym
+        row, col = move
+        if transpose:
+            row, col = col, row
+        if flip_rows:
+            row = self.num_rows-1-row
+        if flip_cols:
+            col = self.num_cols-1-col
+        return [row, col]
+
+
+    def inverse_transform_move(self, move, sym):
+        transpose, flip_rows, flip_cols = sym
+        row, col = move
+        if flip_cols:
+            col = self.num_cols-1-col
+        if flip_rows:
+            row = self.num_rows-1-row
+        if transpose:
+            row, col = col, row
+        return [row, col]
 
 
     def random_recursive_play(self, player, depth, max_depth):
         # Check game condition
         if self.condition == -1 and depth < max_depth:
-            move = random.choice(self.valid_moves())
+            move = self.random_search_move()
             self.make_move(move)
             score = self.random_recursive_play(player, depth+1, max_depth)
             self.undo_move()
@@ -191,21 +1056,41 @@ class BoardGame:
 
     # Reset the game board
     def reset(self):
-        self.board = np.zeros((self.num_rows, self.num_cols), dtype=np.int8)
+        self.load_board(np.zeros((self.num_rows, self.num_cols), dtype=np.int8))
         self.counter = 0
         self.condition = -1
         self.last_move = None
-        self.queue = queue.LifoQueue()
+        self.queue = MoveStack()
         self.current_player = 1
+        for context in self.contexts:
+            if context is not None:
+                context.new_game()
+
+
+    # Set up an arbitrary position, e.g. one read from a file.
+    # The move history is cleared, so earlier moves can't be undone.
+    def set_position(self, board, player):
+        self.load_board(board)
+        self.current_player = player
+        self.counter = int(np.count_nonzero(self.board))
+        self.condition = -1
+        self.last_move = None
+        self.queue = MoveStack()
 
 
     # universal scoring algorithm using dumb Monte Carlo sampling
     def score_board_random(self, player, num_samples, max_depth):
+        # with a cache, add to the playouts already made from this position
+        if self.eval_cache is not None:
+            key = (self.canonical_key()[0], max_depth)
+            score = self.eval_cache.estimate(key, num_samples,
+                                             lambda: self.random_recursive_play(1, 1, max_depth))
+            return score if player == 1 else -score
         # score the board by randomly recursively playing it to completion (or max_depth)
         scores = []
         for _ in range(num_samples):
             scores.append(self.random_recursive_play(player, 1, max_depth))
-        return mean(scores)
+        return sum(scores)/len(scores)
 
 
     def undo_move(self):
@@ -256,6 +1141,72 @@ class BoardGame:
         # Return list of possible moves
         return []
 
+
+    # The valid moves one at a time, in whatever order is cheapest to
+    # generate them, so that a search cut off after a few moves doesn't
+    # pay for the rest. The position may change between moves, as long as
+    # it is restored before the next one is asked for.
+    def iter_moves(self):
+        return iter(self.valid_moves())
+
+
+    # A valid move, chosen uniformly, ideally without listing them all
+    def random_move(self):
+        return self.rng.choice(self.valid_moves())
+
+
+    # Moves considered by searches and random playouts. Games may narrow
+    # these down from valid_moves() (see configure_candidate_moves), in
+    # which case they override the next two as well.
+    def search_moves(self):
+        return self.valid_moves()
+
+
+    def iter_search_moves(self):
+        return self.iter_moves()
+
+
+    def random_search_move(self):
+        return self.random_move()
+
+
+    def configure_candidate_moves(self, radius):
+        raise Exception(f'{type(self).__name__} has no candidate move generator')
+
+
+    # Features of the position for a fitted evaluation (see evaluation.py
+    # and tune_eval.py), as a float array matching eval_feature_names().
+    # For games won by x in a row: the number of lines of x squares holding
+    # k pieces of player 1 and none of player 2, less the reverse, for each
+    # k < x, plus who is to move.
+    def eval_features(self):
+        windows = self.geometry.windows
+        if len(windows) == 0:
+            raise Exception(f'{type(self).__name__} has no evaluation features')
+        cells = self.board.ravel()[windows]
+        xs = np.count_nonzero(cells == self.XPIECE, axis=1)
+        os = np.count_nonzero(cells == self.OPIECE, axis=1)
+        x = windows.shape[1]
+        open_lines = (np.bincount(xs[os == 0], minlength=x+1) -
+                      np.bincount(os[xs == 0], minlength=x+1))[1:x]
+        to_move = 1.0 if self.current_player == 1 else -1.0
+        return np.concatenate(([1.0, to_move], open_lines)).astype(np.float64)
+
+
+    def eval_feature_names(self):
+        return ['bias', 'to_move'] + [f'open_{k}' for k in range(1, self.geometry.windows.shape[1])]
+
+
+    # The move function of a perfect player, for games that have a solver
+    def solver_player(self):
+        raise Exception(f'{type(self).__name__} has no solver')
+
+
+    # Everything a search result depends on besides the position:
+    # the game, its rules and the minimax arguments
+    def search_settings(self, args):
+        return (type(self).__name__, self.num_rows, self.num_cols, args)
+
     
 
 class TicTacToe(BoardGame):
@@ -264,6 +1215,97 @@ class TicTacToe(BoardGame):
         super().__init__(n_rows, n_cols)
         # number of pieces in a row to win
         self.connect_x = x
+        self.geometry = board_geometry(n_rows, n_cols, x)
+        # every rotation and reflection of the board is equivalent
+        self.symmetries = dihedral_symmetries(n_rows, n_cols)
+
+        # When set, searches only consider empty squares within this
+        # distance of a piece (see configure_candidate_moves)
+        self.candidate_radius = None
+        self.__build_candidates()
+
+
+    # For large boards (e.g. 15x15 with 5 in a row): restrict searches and
+    # random playouts to the empty squares within radius of a piece, kept
+    # up to date as moves are made. An immediate win, or failing that a
+    # square blocking the opponent's immediate win, is the only move
+    # considered. None considers every empty square.
+    def configure_candidate_moves(self, radius):
+        self.candidate_radius = radius
+        self.__build_candidates()
+
+
+    def search_settings(self, args):
+        return super().search_settings(args) + (self.connect_x, self.candidate_radius)
+
+
+    def __build_candidates(self):
+        # near[i]: number of pieces within radius of square i (row-major)
+        # candidates: the empty squares with near[i] > 0
+        # threats[piece]: empty squares that would complete a line for piece
+        self.near = [0] * (self.num_rows * self.num_cols)
+        self.candidates = set()
+        self.threats = {self.XPIECE: set(), self.OPIECE: set()}
+        # threats before each move, for undo_move
+        self.threat_history = []
+        if self.candidate_radius is None:
+            return
+        r = self.candidate_radius
+        self.near_offsets = [(dr, dc) for dr in range(-r, r+1) for dc in range(-r, r+1)
+                             if dr != 0 or dc != 0]
+        for row, col in zip(*np.nonzero(self.board)):
+            row, col = int(row), int(col)
+            self.__add_near(row, col, 1)
+            piece = self.board[row][col]
+            self.threats[piece] |= completing_squares(self.board, row, col, piece, self.connect_x)
+
+
+    # Update the candidates after a piece is placed (step 1) or removed (step -1)
+    def __add_near(self, row, col, step):
+        n_rows = self.num_rows
+        n_cols = self.num_cols
+        near = self.near
+        candidates = self.candidates
+        board = self.board
+        for dr, dc in self.near_offsets:
+            r = row + dr
+            c = col + dc
+            if 0 <= r < n_rows and 0 <= c < n_cols:
+                i = r*n_cols + c
+                near[i] += step
+                if near[i] == 0:
+                    candidates.discard(i)
+                elif board[r, c] == self.EMPTY:
+                    candidates.add(i)
+        i = row*n_cols + col
+        if step > 0:
+            candidates.discard(i)
+        elif near[i] > 0:
+            candidates.add(i)
+
+
+    # Called after piece is placed at (row, col): any new winning square
+    # is on a line through it
+    def __add_threats(self, row, col, piece):
+        self.threat_history.append(self.threats)
+        i = row*self.num_cols + col
+        self.threats = {p: squares - {i} for p, squares in self.threats.items()}
+        self.threats[piece] |= completing_squares(self.board, row, col, piece, self.connect_x)
+
+
+    def search_moves(self):
+        if self.candidate_radius is None:
+            return self.valid_moves()
+        if self.counter == 0:
+            return [[self.num_rows//2, self.num_cols//2]]
+
+        current_piece = self.get_piece()
+        squares = self.threats[current_piece]
+        if not squares:
+            squares = self.threats[-current_piece]
+        if not squares:
+            squares = self.candidates
+        return [[i // self.num_cols, i % self.num_cols] for i in sorted(squares)]
 
 
     def check_draw(self):
@@ -277,25 +1319,7 @@ class TicTacToe(BoardGame):
         # To check for a win, we just need to look at the 
         # nearest neighbors of the move that was just made
     
-        current_piece = self.get_piece()
-
-        # check column
-        if self.__check_in_a_row(self.last_move, current_piece, [1,0]):
-            return True
-    
-        # check row
-        if self.__check_in_a_row(self.last_move, current_piece, [0,1]):
-            return True
-    
-        # check upper diagonal
-        if self.__check_in_a_row(self.last_move, current_piece, [1,1]):
-            return True
-    
-        # check lower diagonal
-        if self.__check_in_a_row(self.last_move, current_piece, [1,-1]):
-            return True
-
-        return False
+        return self.completes_line(*self.last_move, self.get_piece(), self.connect_x)
 
 
     def display_board(self):
@@ -327,13 +1351,13 @@ class TicTacToe(BoardGame):
         move_int = 0
         while (True):
             move_str = input(f"Player {self.current_player}: ").strip()
-            if len(move_str) != 2:
+            if len(move_str) < 2:
                 continue
-            if not move_str[0].isalpha() or not move_str[1].isdigit():
+            if not move_str[0].isalpha() or not move_str[1:].isdigit():
                 continue
             else:
                 row = ord(move_str[0]) - ord('a')
-                col = int(move_str[1])
+                col = int(move_str[1:])
                 if col < 1 or col > self.num_cols or row < 0 or row > self.num_rows-1:
                     continue
                 else:
@@ -356,6 +1380,13 @@ class TicTacToe(BoardGame):
         return move
 
 
+    def get_move_mcts(self, *args, **kwargs):
+        move = super().get_move_mcts(*args, **kwargs)
+        if self.interactive:
+            print(f"Player {self.current_player}: "+ self.unconvert_move(move))
+        return move
+
+
     def is_valid(self, move):
         # check if the current move is valid
         if self.board[move[0]][move[1]] == self.EMPTY:
@@ -366,13 +1397,42 @@ class TicTacToe(BoardGame):
 
     def make_move(self, move):
         self.board[move[0]][move[1]] = self.get_piece()
+        if self.candidate_radius is not None:
+            self.__add_near(move[0], move[1], 1)
+            self.__add_threats(move[0], move[1], self.get_piece())
         self.queue.put(self.last_move)
         self.last_move = move
         self.counter += 1
         self.update_condition()
         self.change_player()
 
+
+    def undo_move(self):
+        move = self.last_move
+        super().undo_move()
+        if self.candidate_radius is not None:
+            self.__add_near(move[0], move[1], -1)
+            self.threats = self.threat_history.pop()
+
+
+    def reset(self):
+        super().reset()
+        self.__build_candidates()
+
  
+    def set_position(self, board, player):
+        super().set_position(board, player)
+        self.__build_candidates()
+        # look for a finished line anywhere on the board
+        for row, col in zip(*np.nonzero(self.board)):
+            piece = self.board[row][col]
+            if self.completes_line(int(row), int(col), piece, self.connect_x):
+                self.condition = 1 if piece == self.XPIECE else 2
+                return
+        if self.check_draw():
+            self.condition = 0
+
+
     def update_condition(self):
         if self.check_win():
             self.condition = self.current_player
@@ -381,17 +1441,41 @@ class TicTacToe(BoardGame):
 
 
     def valid_moves(self):
-        moves = []
-        row = 0
-        col = 0
-        for row in range(self.num_rows):
-            for col in range(self.num_cols):
-                if self.board[row][col] == self.EMPTY:
-                    moves.append([row,col])
-        return moves
+        return [[int(row), int(col)] for row, col in np.argwhere(self.board == self.EMPTY)]
+
+
+    def iter_moves(self):
+        for i in np.flatnonzero(self.board == self.EMPTY).tolist():
+            yield [i // self.num_cols, i % self.num_cols]
+
+
+    # A few random squares usually turn up an empty one; on a nearly
+    # full board, choose from the list instead. Either way each empty
+    # square is equally likely.
+    def random_move(self):
+        board = self.board
+        for _ in range(self.RANDOM_TRIES):
+            i = int(self.rng.random() * self.num_rows * self.num_cols)
+            row = i // self.num_cols
+            col = i % self.num_cols
+            if board[row, col] == self.EMPTY:
+                return [row, col]
+        return self.rng.choice(self.valid_moves())
+
+
+    def iter_search_moves(self):
+        if self.candidate_radius is None:
+            return self.iter_moves()
+        return iter(self.search_moves())
+
+
+    def random_search_move(self):
+        if self.candidate_radius is None:
+            return self.random_move()
+        return self.rng.choice(self.search_moves())
     
     def convert_move(self, move_str):
-        return [ord(move_str[0]) - ord('a'), int(move_str[1])-1]
+        return [ord(move_str[0]) - ord('a'), int(move_str[1:])-1]
     
     
     def unconvert_move(self, move):
@@ -404,44 +1488,6 @@ class TicTacToe(BoardGame):
             moves_str.append( self.unconvert_move(move) )
         return moves_str
 
-        
-    # check if there are <current_piece> pieces in a line
-    #   <interval> defines the direction (x,y) of the line
-    def __check_in_a_row(self, last_move, current_piece, interval):
-        # Coordinates of the last_move made
-        x = last_move[0]
-        y = last_move[1]
-        
-        # count how many steps up we can make in the <interval> direction
-        step_up = 0
-    
-        # we can use try/catch blocks to handle when we go out of bounds
-        try:
-            while (x+(step_up+1)*interval[0] >= 0 and
-                   y+(step_up+1)*interval[1] >= 0 and
-                   self.board[x+(step_up+1)*interval[0], y+(step_up+1)*interval[1]] == current_piece):
-                step_up +=1
-        except IndexError:
-            pass
-    
-        # count how many steps down we can make in the <interval> direction
-        step_down = 0
-    
-        # we can use try/catch blocks to handle when we go out of bounds
-        # but we also need to handle Python allowing negative indices :-/
-        try:
-            while (x-(step_down+1)*interval[0] >= 0 and
-                   y-(step_down+1)*interval[1] >= 0 and
-                   self.board[x-(step_down+1)*interval[0], y-(step_down+1)*interval[1]] == current_piece):
-                step_down += 1
-        except IndexError:
-            pass
-    
-        if step_up + step_down >= self.connect_x - 1:
-            return True
-        else:
-            return False
-
 
 
 class Connect_X(BoardGame):
@@ -450,6 +1496,95 @@ class Connect_X(BoardGame):
         super().__init__(n_rows, n_cols)
         # size of connect_x board (for x=4)
         self.connect_x = x
+        self.geometry = board_geometry(n_rows, n_cols, x)
+        # gravity only allows the left-right mirror
+        self.symmetries = [(False, False, False), (False, False, True)]
+        # columns from the center out, the order iter_moves() tries them in
+        self.center_order = sorted(range(n_cols), key=lambda col: abs(2*col - (n_cols-1)))
+
+        # When set, searches only consider columns within this distance
+        # of an occupied column (see configure_candidate_moves)
+        self.candidate_radius = None
+        self.__build_threats()
+
+        # connect4_solver.Solver for the 's' player, made when needed
+        self.solver = None
+
+
+    # For wide boards: restrict searches and random playouts to columns
+    # within radius of an occupied column. An immediate win, or failing
+    # that a column blocking the opponent's immediate win, is the only
+    # move considered. None considers every column.
+    def configure_candidate_moves(self, radius):
+        self.candidate_radius = radius
+        self.__build_threats()
+
+
+    def search_settings(self, args):
+        return super().search_settings(args) + (self.connect_x, self.candidate_radius)
+
+
+    def __build_threats(self):
+        # threats[piece]: empty squares that would complete a line for piece
+        self.threats = {self.XPIECE: set(), self.OPIECE: set()}
+        self.threat_history = []
+        if self.candidate_radius is None:
+            return
+        for row, col in zip(*np.nonzero(self.board)):
+            row, col = int(row), int(col)
+            piece = self.board[row][col]
+            self.threats[piece] |= completing_squares(self.board, row, col, piece, self.connect_x)
+
+
+    # Called after piece is placed at (row, col): any new winning square
+    # is on a line through it
+    def __add_threats(self, row, col, piece):
+        self.threat_history.append(self.threats)
+        i = row*self.num_cols + col
+        self.threats = {p: squares - {i} for p, squares in self.threats.items()}
+        self.threats[piece] |= completing_squares(self.board, row, col, piece, self.connect_x)
+
+
+    # Columns where piece can complete a line right now
+    def __winning_columns(self, piece):
+        cols = set()
+        for i in self.threats[piece]:
+            row, col = divmod(i, self.num_cols)
+            if row == self.num_rows-1 or self.board[row+1][col] != self.EMPTY:
+                cols.add(col)
+        return sorted(cols)
+
+
+    def search_moves(self):
+        if self.candidate_radius is None:
+            return self.valid_moves()
+
+        current_piece = self.get_piece()
+        wins = self.__winning_columns(current_piece)
+        if wins:
+            return wins
+        blocks = self.__winning_columns(-current_piece)
+        if blocks:
+            return blocks
+
+        # a column is occupied if its bottom square is
+        moves = self.valid_moves()
+        occupied = [col for col in range(self.num_cols) if self.board[self.num_rows-1][col] != self.EMPTY]
+        if len(occupied) == 0:
+            return [self.num_cols//2]
+        r = self.candidate_radius
+        return [move for move in moves if any(abs(move - col) <= r for col in occupied)]
+
+
+    def undo_move(self):
+        super().undo_move()
+        if self.candidate_radius is not None:
+            self.threats = self.threat_history.pop()
+
+
+    def reset(self):
+        super().reset()
+        self.__build_threats()
 
 
     def check_draw(self):
@@ -463,25 +1598,7 @@ class Connect_X(BoardGame):
         # To check for a win, we just need to look at the 
         # nearest neighbors of the move that was just made
     
-        current_piece = self.get_piece()
-
-        # check column
-        if self.__check_in_a_row(self.last_move, current_piece, [1,0]):
-            return True
-    
-        # check row
-        if self.__check_in_a_row(self.last_move, current_piece, [0,1]):
-            return True
-    
-        # check upper diagonal
-        if self.__check_in_a_row(self.last_move, current_piece, [1,1]):
-            return True
-    
-        # check lower diagonal
-        if self.__check_in_a_row(self.last_move, current_piece, [1,-1]):
-            return True
-
-        return False
+        return self.completes_line(*self.last_move, self.get_piece(), self.connect_x)
 
 
     def display_board(self):
@@ -533,6 +1650,38 @@ class Connect_X(BoardGame):
         return move
 
 
+    def get_move_mcts(self, *args, **kwargs):
+        move = super().get_move_mcts(*args, **kwargs)
+        if self.interactive:
+            print(f"Player {self.current_player}: {move+1}")
+        return move
+
+
+    # Perfect play for 4 in a row, using the position database next to
+    # connect4_solver.py if one has been built for this board size
+    def solver_player(self):
+        if self.connect_x != 4:
+            raise Exception('The solver only plays 4 in a row')
+        if self.solver is None:
+            from connect4_solver import Solver
+            self.solver = Solver(self.num_rows, self.num_cols)
+        return self.get_move_solver
+
+
+    def get_move_solver(self):
+        move = self.solver.best_move(*self.solver.from_game(self))
+        if self.interactive:
+            print(f"Player {self.current_player}: {move+1}")
+        return move
+
+
+    # The solver's table can be large, and is rebuilt empty
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['solver'] = None
+        return state
+
+
     def is_valid(self, move):
         # check if the current move is valid
         if self.board[0][move] == self.EMPTY:
@@ -542,6 +1691,24 @@ class Connect_X(BoardGame):
 
 
     def make_move(self, move):
+        if self.cells is not None:
+            # drop the piece until the square below it isn't empty
+            i = self.origin + move
+            if self.cells[i] != self.EMPTY:
+                raise Exception('Illegal move')
+            while self.cells[i + self.stride] == self.EMPTY:
+                i += self.stride
+            row = (i - self.origin) // self.stride
+            self.cells[i] = self.get_piece()
+            if self.candidate_radius is not None:
+                self.__add_threats(row, move, self.get_piece())
+            self.queue.put(self.last_move)
+            self.last_move = [row, move]
+            self.counter += 1
+            self.update_condition()
+            self.change_player()
+            return
+
         # Find where the available slot is    
         for i in range(self.num_rows-1):
             if self.board[i+1][move] != self.EMPTY:
@@ -549,6 +1716,8 @@ class Connect_X(BoardGame):
                 if self.board[i][move] != self.EMPTY:
                     raise Exception('Illegal move')
                 self.board[i][move] = self.get_piece()
+                if self.candidate_radius is not None:
+                    self.__add_threats(i, move, self.get_piece())
                 self.queue.put(self.last_move)
                 self.last_move = [i, move]       
                 self.counter += 1
@@ -561,6 +1730,8 @@ class Connect_X(BoardGame):
         # check has already happened in the for loop
         
         self.board[i+1][move] = self.get_piece()
+        if self.candidate_radius is not None:
+            self.__add_threats(i+1, move, self.get_piece())
         self.queue.put(self.last_move)
         self.last_move = [i+1, move]
         self.counter += 1
@@ -601,6 +1772,40 @@ class Connect_X(BoardGame):
         return score
 
 
+    # The line features, plus the empty squares that would complete a line
+    # for each player, split by whether they are an odd or even row counting
+    # from the bottom (which decides who can use them late in the game)
+    def eval_features(self):
+        features = super().eval_features()
+        windows = self.geometry.windows
+        cells = self.board.ravel()[windows]
+        threats = []
+        for piece in [self.XPIECE, self.OPIECE]:
+            open_squares = cells == self.EMPTY
+            lines = (np.count_nonzero(cells == piece, axis=1) == self.connect_x - 1) & (open_squares.sum(axis=1) == 1)
+            squares = np.unique(windows[lines][open_squares[lines]])
+            odd = (self.num_rows - squares // self.num_cols) % 2 == 1
+            threats += [np.count_nonzero(odd), np.count_nonzero(~odd)]
+        return np.concatenate((features, threats))
+
+
+    def eval_feature_names(self):
+        return super().eval_feature_names() + ['odd_threats_x', 'even_threats_x', 'odd_threats_o', 'even_threats_o']
+
+
+    def set_position(self, board, player):
+        super().set_position(board, player)
+        self.__build_threats()
+        # look for a finished line anywhere on the board
+        for row, col in zip(*np.nonzero(self.board)):
+            piece = self.board[row][col]
+            if self.completes_line(int(row), int(col), piece, self.connect_x):
+                self.condition = 1 if piece == self.XPIECE else 2
+                return
+        if self.check_draw():
+            self.condition = 0
+
+
     def update_condition(self):
         if self.check_win():
             self.condition = self.current_player
@@ -617,47 +1822,46 @@ class Connect_X(BoardGame):
         return lst
 
 
-        
+    # Center columns first, as they tend to be the best
+    def iter_moves(self):
+        top = self.board[0]
+        for col in self.center_order:
+            if top[col] == self.EMPTY:
+                yield col
 
-    
-    
 
-    # check if there are <current_piece> pieces in a line
-    #   <interval> defines the direction (x,y) of the line
-    def __check_in_a_row(self, last_move, current_piece, interval):
-        # Coordinates of the last_move made
-        x = last_move[0]
-        y = last_move[1]
-        
-        # count how many steps up we can make in the <interval> direction
-        step_up = 0
-    
-        # we can use try/catch blocks to handle when we go out of bounds
-        try:
-            while (x+(step_up+1)*interval[0] >= 0 and
-                   y+(step_up+1)*interval[1] >= 0 and
-                   self.board[x+(step_up+1)*interval[0], y+(step_up+1)*interval[1]] == current_piece):
-                step_up +=1
-        except IndexError:
-            pass
-    
-        # count how many steps down we can make in the <interval> direction
-        step_down = 0
-    
-        # we can use try/catch blocks to handle when we go out of bounds
-        # but we also need to handle Python allowing negative indices :-/
-        try:
-            while (x-(step_down+1)*interval[0] >= 0 and
-                   y-(step_down+1)*interval[1] >= 0 and
-                   self.board[x-(step_down+1)*interval[0], y-(step_down+1)*interval[1]] == current_piece):
-                step_down += 1
-        except IndexError:
-            pass
-    
-        if step_up + step_down >= self.connect_x - 1:
-            return True
-        else:
-            return False
+    # A few random columns usually turn up an open one; failing that,
+    # choose from the list. Either way each open column is equally likely.
+    def random_move(self):
+        top = self.board[0]
+        for _ in range(self.RANDOM_TRIES):
+            col = int(self.rng.random() * self.num_cols)
+            if top[col] == self.EMPTY:
+                return col
+        return self.rng.choice(self.valid_moves())
+
+
+    def iter_search_moves(self):
+        if self.candidate_radius is None:
+            return self.iter_moves()
+        return iter(self.search_moves())
+
+
+    def random_search_move(self):
+        if self.candidate_radius is None:
+            return self.random_move()
+        return self.rng.choice(self.search_moves())
+
+
+    # Moves are columns, so only the column is mirrored
+    def transform_move(self, move, sym):
+        if sym[2]:
+            return self.num_cols-1-move
+        return move
+
+
+    def inverse_transform_move(self, move, sym):
+        return self.transform_move(move, sym)
 
             
     # Score an nparray of integers against the current_piece
@@ -717,6 +1921,119 @@ class Othello(BoardGame):
         # Counter to keep track of if we pass
         self.num_passes = 0
 
+        # Only symmetries preserving the starting position can relate
+        # two positions reachable in the same game
+        self.symmetries = [sym for sym in dihedral_symmetries(n_rows, n_cols)
+                           if np.array_equal(self.transform_board(self.board, sym), self.board)]
+
+        # othello_tablebase.Tablebase for the 's' player, loaded when needed
+        self.tablebase = None
+
+        self.__build_frontier()
+
+
+    # Only empty squares next to a piece can be valid moves. These form the
+    # frontier, which is kept up to date as moves are made and undone, so
+    # move generation scales with the frontier rather than the whole board.
+    # The pieces a move on each frontier square would flip (none if it isn't
+    # a valid move) are cached for each piece, and only forgotten when a
+    # move changes a square on one of its rays. So the ray walks that find
+    # the valid moves are also the ones make_move() uses to flip pieces.
+    def __build_frontier(self):
+        # squares as indices origin + row*stride + col (into cells, if padded)
+        self.frontier = set()
+        self.legal = {self.XPIECE: {}, self.OPIECE: {}}
+        flat = self.board.ravel()
+        for i in np.flatnonzero(self.board):
+            for j in self.geometry.neighbors[i]:
+                if flat[j] == self.EMPTY:
+                    row, col = divmod(j, self.num_cols)
+                    self.frontier.add(self.origin + row*self.stride + col)
+
+
+    # The frontier is indexed differently with padding
+    def configure_board(self, padded):
+        super().configure_board(padded)
+        self.__build_frontier()
+
+
+    # Forget the cached validity of every empty square that can see one of
+    # the changed squares along a line of pieces
+    def __invalidate(self, changed):
+        legal_x = self.legal[self.XPIECE]
+        legal_o = self.legal[self.OPIECE]
+        if self.cells is not None:
+            cells = self.cells
+            for i in changed:
+                for step in self.geometry.cell_steps:
+                    j = i + step
+                    while cells[j] == self.XPIECE or cells[j] == self.OPIECE:
+                        j += step
+                    if cells[j] == self.EMPTY:
+                        legal_x.pop(j, None)
+                        legal_o.pop(j, None)
+            return
+
+        flat = self.board.ravel()
+        rays = self.geometry.rays
+        for i in changed:
+            for ray in rays[i]:
+                for j in ray:
+                    if flat[j] == self.EMPTY:
+                        legal_x.pop(j, None)
+                        legal_o.pop(j, None)
+                        break
+
+
+    # The squares piece would flip if played on the empty square i (none
+    # if it isn't a valid move there)
+    def __flips(self, i, piece):
+        flat = self.board.ravel()
+        oppo_piece = -piece
+        flips = ()
+        # a line of opponent pieces followed by one of our pieces
+        for ray in self.geometry.rays[i]:
+            for n, j in enumerate(ray):
+                if flat[j] != oppo_piece:
+                    if n > 0 and flat[j] == piece:
+                        flips += ray[:n]
+                    break
+        return flips
+
+
+    # As __flips, for cell i of a padded board: the border stops every
+    # walk, so there are no bounds to check
+    def __flips_cell(self, i, piece):
+        cells = self.cells
+        oppo_piece = -piece
+        flips = []
+        for step in self.geometry.cell_steps:
+            j = i + step
+            if cells[j] != oppo_piece:
+                continue
+            j += step
+            while cells[j] == oppo_piece:
+                j += step
+            if cells[j] == piece:
+                flips.extend(range(i + step, j, step))
+        return tuple(flips)
+
+
+    # Cached flips of the frontier square i for piece (by default the
+    # current player's); empty, and so false, if it isn't a valid move
+    def __flips_index(self, i, piece=None):
+        if piece is None:
+            piece = self.get_piece()
+        cache = self.legal[piece]
+        flips = cache.get(i)
+        if flips is None:
+            if self.cells is not None:
+                flips = self.__flips_cell(i, piece)
+            else:
+                flips = self.__flips(i, piece)
+            cache[i] = flips
+        return flips
+
 
 
     def display_board(self):
@@ -760,13 +2077,13 @@ class Othello(BoardGame):
         # Get a move from the current player
         while (True):
             move_str = input(f"Player {self.current_player}: ").strip()
-            if len(move_str) != 2:
+            if len(move_str) < 2:
                 continue
-            if not move_str[0].isalpha() or not move_str[1].isdigit():
+            if not move_str[0].isalpha() or not move_str[1:].isdigit():
                 continue
             else:
                 row = ord(move_str[0]) - ord('a')
-                col = int(move_str[1])
+                col = int(move_str[1:])
                 if col < 1 or col > self.num_cols or row < 0 or row > self.num_rows-1:
                     continue
                 else:
@@ -786,8 +2103,36 @@ class Othello(BoardGame):
         if self.interactive:
             print(f"Player {self.current_player}: "+ self.unconvert_move(move))
         return move
+
+
+    def get_move_mcts(self, *args, **kwargs):
+        move = super().get_move_mcts(*args, **kwargs)
+        if self.interactive:
+            print(f"Player {self.current_player}: " + ('pass' if move is None else self.unconvert_move(move)))
+        return move
         
 
+    # Perfect play on small boards, from the tablebase next to
+    # othello_tablebase.py (build it first)
+    def solver_player(self):
+        if self.tablebase is None:
+            from othello_tablebase import Tablebase, default_path
+            path = default_path(self.num_rows, self.num_cols)
+            if not os.path.exists(path):
+                raise Exception(f'No tablebase for {self.num_rows}x{self.num_cols} Othello: '
+                                f'run python othello_tablebase.py build --rows {self.num_rows} --cols {self.num_cols}')
+            self.tablebase = Tablebase(path)
+        return self.get_move_solver
+
+
+    def get_move_solver(self):
+        square = self.tablebase.best_move(*self.tablebase.boards.from_game(self))
+        move = None if square is None else list(divmod(square, self.num_cols))
+        if self.interactive:
+            print(f"Player {self.current_player}: " + ('pass' if move is None else self.unconvert_move(move)))
+        return move
+
+
         
     def is_valid(self, move):
         if move == None:
@@ -795,128 +2140,90 @@ class Othello(BoardGame):
             return True
 
         # check if the current move is valid
-        try:
-            if self.board[move[0]][move[1]] != self.EMPTY:
-                return False
-        except IndexError:
+        row, col = move
+        if not (0 <= row < self.num_rows and 0 <= col < self.num_cols):
             return False
-        # Determine our piece and oppo piece
-        current_piece = self.get_piece()
-        if current_piece == self.XPIECE:
-            oppo_piece = self.OPIECE
-        else:
-            oppo_piece = self.XPIECE
-
-        # check rows/columns/diagonals for a valid move
-        intervals = [ [0,1], 
-                     [0,-1],
-                     [1,0],
-                     [-1,0],
-                     [1,1],
-                     [-1,-1],
-                     [1,-1],
-                     [-1,1] ]
-
-        for interval in intervals:
-            try:
-                row = move[0]+interval[0]
-                col = move[1]+interval[1]
-                
-                '''
-                valid move means there is some direction where we find some number
-                of opponent pieces, followed by one of our pieces
-                '''
-                
-                if (self.board[row][col] == oppo_piece and
-                    row >= 0 and
-                    col >= 0):
-                    row += interval[0]
-                    col += interval[1]                    
-                    while (self.board[row][col] == oppo_piece and
-                           row >= 0 and
-                           col >= 0):
-                        row += interval[0]
-                        col += interval[1]
-                    if (self.board[row][col] == current_piece and
-                        row >= 0 and
-                        col >= 0):
-                        return True
-            except IndexError:
-                # we ran off the end of the board
-                pass
-
-        # If we didn't find anything, return False
-        return False    
+        if self.board[row][col] != self.EMPTY:
+            return False
+        return len(self.__flips_index(self.origin + row*self.stride + col)) > 0
     
 
     def make_move(self, move):
+        if move == None:
+            self.make_move_flips(None, ())
+        else:
+            placed = self.origin + move[0]*self.stride + move[1]
+            self.make_move_flips(move, self.__flips_index(placed))
+
+
+    # Valid moves with the squares each flips, as a list of (move, flips)
+    # ([(None, ())] if the player must pass). Flips are indices into the
+    # board (or cells, if padded), to be given back to make_move_flips().
+    def move_flips(self):
+        moves = []
+        for i in sorted(self.frontier):
+            flips = self.__flips_index(i)
+            if flips:
+                row, col = divmod(i - self.origin, self.stride)
+                moves.append(([row, col], flips))
+        if len(moves) > 0:
+            return moves
+        return [(None, ())]
+
+
+    # make_move() with the flips already known (from move_flips), so no
+    # rays are walked
+    def make_move_flips(self, move, flips):
         if move == None:
             # If no valid move, don't bother storing the board state
             self.queue.put([self.num_passes, None])
             self.num_passes += 1
         else:
-            # Entire prior board state must be saved
-            # along with the number of passes that have occurred
-            self.queue.put([self.num_passes, self.board.copy()])
+            # Only the squares changed are saved (with the number of passes
+            # and the changes to the frontier), since undoing the move just
+            # means flipping them back
+            entry = [self.num_passes, None]
+            self.queue.put(entry)
             self.num_passes = 0
 
-            current_piece = self.get_piece()
-            if current_piece == self.XPIECE:
-                oppo_piece = self.OPIECE
+            placed = self.origin + move[0]*self.stride + move[1]
+            if self.cells is not None:
+                squares = self.cells
+                neighbors = [placed + step for step in self.geometry.cell_steps]
             else:
-                oppo_piece = self.XPIECE
-    
-            # Flip all pieces, reusing code from is_valid
-            
-            intervals = [ [0,1], 
-                         [0,-1],
-                         [1,0],
-                         [-1,0],
-                         [1,1],
-                         [-1,-1],
-                         [1,-1],
-                         [-1,1] ]
-            
-            for interval in intervals:
-                try:
-                    row = move[0]+interval[0]
-                    col = move[1]+interval[1]
-                    step = 1
-    
-                    if (self.board[row][col] == oppo_piece and
-                        row >= 0 and
-                        col >= 0):
-                        row += interval[0]
-                        col += interval[1]
-                        step += 1
-                        while (self.board[row][col] == oppo_piece and
-                               row >= 0 and
-                               col >= 0):
-                            row += interval[0]
-                            col += interval[1]
-                            step += 1
-                        if (self.board[row][col] == current_piece and
-                            row >= 0 and
-                            col >= 0):
-                            # flip all the pieces
-                            # step = num_pieces_to_flip + 1
-                            while (step > 0):
-                                row -= interval[0]
-                                col -= interval[1]
-                                self.board[row][col] = current_piece
-                                step -= 1
-                except IndexError:
-                    # we ran off the end of the board
-                    pass
-                
+                squares = self.board.ravel()
+                neighbors = self.geometry.neighbors[placed]
+            # an invalid move changes nothing
+            changed = []
+            if flips:
+                piece = self.get_piece()
+                for i in flips:
+                    squares[i] = piece
+                squares[placed] = piece
+                changed = list(flips)
+                changed.append(placed)
+
+            # The new piece leaves the frontier and its empty neighbors join it
+            added = []
+            if changed:
+                self.frontier.discard(placed)
+                self.legal[self.XPIECE].pop(placed, None)
+                self.legal[self.OPIECE].pop(placed, None)
+                for i in neighbors:
+                    if squares[i] == self.EMPTY and i not in self.frontier:
+                        self.frontier.add(i)
+                        added.append(i)
+                self.__invalidate(changed)
+            entry += [placed, added, changed]
+
         self.counter += 1
         self.update_condition()
         self.change_player()
 
- 
+
     # Reset the game board
     def reset(self):
-        self.board = np.zeros((self.num_rows, self.num_cols), dtype=np.int8)
+        super().reset()
         
         # initial board configuration for Othello
         self.board[self.num_rows//2][self.num_cols//2] = self.OPIECE
@@ -924,11 +2231,16 @@ class Othello(BoardGame):
         self.board[self.num_rows//2][self.num_cols//2-1] = self.XPIECE
         self.board[self.num_rows//2-1][self.num_cols//2-1] = self.OPIECE
 
-        self.counter = 0
-        self.condition = -1
-        self.last_move = None
-        self.queue = queue.LifoQueue()
-        self.current_player = 1
+        self.num_passes = 0
+        self.__build_frontier()
+
+
+    def set_position(self, board, player, num_passes=0):
+        super().set_position(board, player)
+        self.counter -= 4
+        self.num_passes = num_passes
+        self.__build_frontier()
+        self.update_condition()
 
 
     def score_board(self, player=1):
@@ -938,6 +2250,50 @@ class Othello(BoardGame):
             return -np.sum(self.board)
 
 
+    # Differences between the players' discs, corners, edges, squares next
+    # to an empty corner (X squares diagonally, C squares along the edge),
+    # discs next to an empty square and valid moves, plus who is to move.
+    # Each also comes multiplied by how full the board is, so that a fit
+    # can weigh them differently as the game goes on.
+    def eval_features(self):
+        board = self.board
+        rows = self.num_rows
+        cols = self.num_cols
+        corners = [(0, 0, 1, 1), (0, cols-1, 1, -1), (rows-1, 0, -1, 1), (rows-1, cols-1, -1, -1)]
+        corner_sum = 0
+        x_squares = 0
+        c_squares = 0
+        for r, c, dr, dc in corners:
+            corner_sum += board[r, c]
+            if board[r, c] == self.EMPTY:
+                x_squares += board[r+dr, c+dc]
+                c_squares += board[r+dr, c] + board[r, c+dc]
+        edges = board[0].sum() + board[-1].sum() + board[1:-1, 0].sum() + board[1:-1, -1].sum() - corner_sum
+
+        # discs with an empty neighbor
+        empty = np.pad(board == self.EMPTY, 1)
+        exposed = np.zeros((rows, cols), dtype=bool)
+        for dr in (0, 1, 2):
+            for dc in (0, 1, 2):
+                exposed |= empty[dr:dr+rows, dc:dc+cols]
+        frontier = board[exposed].sum()
+
+        mobility = 0
+        for i in self.frontier:
+            mobility += bool(self.__flips_index(i, self.XPIECE)) - bool(self.__flips_index(i, self.OPIECE))
+
+        to_move = 1 if self.current_player == 1 else -1
+        features = np.array([board.sum(), corner_sum, x_squares, c_squares, edges,
+                             frontier, mobility, to_move], dtype=np.float64)
+        phase = self.counter/(rows*cols)
+        return np.concatenate(([1.0], features, phase*features))
+
+
+    def eval_feature_names(self):
+        names = ['discs', 'corners', 'x_squares', 'c_squares', 'edges', 'frontier', 'mobility', 'to_move']
+        return ['bias'] + names + [name + '*phase' for name in names]
+
+
     def undo_move(self):
         self.condition = -1
         self.counter -= 1
@@ -946,13 +2302,44 @@ class Othello(BoardGame):
         if self.num_passes == 0:
             temp = self.queue.get()
             self.num_passes = temp[0]
-            self.board = temp[1]
+            placed, added, changed = temp[2:]
+            # flip the changed squares back to the opponent's
+            squares = self.cells if self.cells is not None else self.board.ravel()
+            piece = self.get_piece()
+            for i in changed:
+                squares[i] = -piece
+            # undo the changes to the frontier
+            if len(changed) > 0:
+                squares[placed] = self.EMPTY
+                self.frontier.difference_update(added)
+                self.frontier.add(placed)
+                self.legal[self.XPIECE].pop(placed, None)
+                self.legal[self.OPIECE].pop(placed, None)
+                self.__invalidate(changed)
         else:
             temp = self.queue.get()
             self.num_passes = temp[0]
             # board hasn't changed
 
 
+    # The number of passes matters for when the game ends
+    def position_key(self, board=None):
+        return super().position_key(board) + bytes([min(self.num_passes, 2)])
+
+
+    # A pass is the same move under any symmetry
+    def transform_move(self, move, sym):
+        if move == None:
+            return None
+        return super().transform_move(move, sym)
+
+
+    def inverse_transform_move(self, move, sym):
+        if move == None:
+            return None
+        return super().inverse_transform_move(move, sym)
+
+
     def update_condition(self):
         if self.num_passes >= 2:
             score = self.score_board()
@@ -966,22 +2353,51 @@ class Othello(BoardGame):
 
     def valid_moves(self):
         moves = []
-        for row in range(self.num_rows):
-            for col in range(self.num_cols):
-                if self.is_valid([row,col]):
-                    moves.append([row,col])
+        for i in sorted(self.frontier):
+            if self.__flips_index(i):
+                row, col = divmod(i - self.origin, self.stride)
+                moves.append([row, col])
         if len(moves) > 0:
             return moves
         else:
             return [None]
 
 
+    # Only the frontier squares tried are checked. The frontier is copied
+    # first, as making and undoing moves changes it.
+    def iter_moves(self):
+        found = False
+        for i in sorted(self.frontier):
+            if self.__flips_index(i):
+                found = True
+                row, col = divmod(i - self.origin, self.stride)
+                yield [row, col]
+        if not found:
+            yield None
+
+
+    # The first valid move in a random order of the frontier, which is as
+    # likely to be any of the valid moves, and usually found long before
+    # the whole frontier is checked
+    def random_move(self):
+        squares = sorted(self.frontier)
+        n = len(squares)
+        while n > 0:
+            k = int(self.rng.random() * n)
+            i = squares[k]
+            if self.__flips_index(i):
+                row, col = divmod(i - self.origin, self.stride)
+                return [row, col]
+            n -= 1
+            squares[k] = squares[n]
+        return None
+
+
     # This is faster than computing an additional valid_moves every time
     def is_any_valid_move(self):
-        for row in range(self.num_rows):
-            for col in range(self.num_cols):
-                if self.is_valid([row,col]):
-                    return True
+        for i in self.frontier:
+            if self.__flips_index(i):
+                return True
         return False
 
 
@@ -998,7 +2414,7 @@ class Othello(BoardGame):
     
 
     def convert_move(self, move_str):
-        return [ord(move_str[0]) - ord('a'), int(move_str[1])-1]
+        return [ord(move_str[0]) - ord('a'), int(move_str[1:])-1]
     
     
     def unconvert_move(self, move):
@@ -0,0 +1,474 @@
+#!/usr/bin/python
+
+# Perfect play for Connect 4 (4 in a row on boards up to 64 bits of
+# bitboard, e.g. the standard 6x7).
+#
+# Positions are bitboards as in Pascal Pons' solver: column c takes bits
+# c*(rows+1) .. c*(rows+1)+rows-1 from the bottom up, with one spare bit on
+# top. A position is (current, mask): the pieces of the player to move and
+# all the pieces. current + mask is a unique key for the position.
+#
+# A position's score is from the point of view of the player to move:
+# positive for a win, (squares + 1 - moves)/2 for a win with their last
+# piece at the given move count, so a sooner win scores higher; negative
+# likewise for a loss; 0 for a draw. Scores are found by a negamax search
+# with alpha-beta, narrowed to null windows (a binary search on the score).
+#
+# Solved positions can be kept in a database file: a header followed by
+# the sorted keys (uint64) and their scores (int8), memory-mapped and
+# searched with numpy.searchsorted. Only the lesser key of a position and
+# its mirror image is stored. Build one offline with e.g.
+#     python connect4_solver.py build --rows 4 --cols 5 --plies 6
+# which solves every position up to 6 moves in. This is only practical
+# for small boards (4x5 takes seconds, 5x6 about a CPU-hour). A 6x7
+# position 8 moves in takes from half a minute to a few minutes to solve
+# here, and there are 91,295 of them, about 1,500 CPU-hours in all;
+# deeper positions are quicker, but there are millions of them.
+#
+# Positions that take a while to solve at run time are also written to a
+# file of learned positions next to the database, as they are found, so
+# the solver answers them at once the next time they come up, in this
+# process or any later one. Openings played before become instant.
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+
+MAGIC = b'C4DB'
+# magic, rows, cols, plies, number of positions
+HEADER = np.dtype([('magic', 'S4'), ('rows', '<u2'), ('cols', '<u2'),
+                   ('plies', '<u2'), ('pad', '<u2'), ('count', '<u8')])
+
+
+def default_db_path(rows, cols):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f'connect4_{rows}x{cols}.c4db')
+
+
+class PositionDB:
+
+    def __init__(self, path):
+        header = np.fromfile(path, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise Exception(f'{path} is not a Connect 4 database')
+        self.rows = int(header['rows'])
+        self.cols = int(header['cols'])
+        self.plies = int(header['plies'])
+        count = int(header['count'])
+        self.keys = np.memmap(path, dtype='<u8', mode='r', offset=HEADER.itemsize, shape=(count,))
+        self.scores = np.memmap(path, dtype=np.int8, mode='r',
+                                offset=HEADER.itemsize + 8*count, shape=(count,))
+
+
+    def __len__(self):
+        return len(self.keys)
+
+
+    def get(self, key):
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.scores[i])
+        return None
+
+
+    @staticmethod
+    def write(path, rows, cols, plies, scores):
+        keys = np.array(sorted(scores), dtype='<u8')
+        values = np.array([scores[int(key)] for key in keys], dtype=np.int8)
+        header = np.array([(MAGIC, rows, cols, plies, 0, len(keys))], dtype=HEADER)
+        with open(path, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(keys.tobytes())
+            f.write(values.tobytes())
+
+
+
+def default_learned_path(rows, cols):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f'connect4_{rows}x{cols}.learned')
+
+
+# Scores of positions solved at run time, appended to a file as
+# (key, score) records. Records are small enough to be appended whole
+# by any number of processes at once.
+class LearnedPositions:
+
+    RECORD = np.dtype([('key', '<u8'), ('score', 'i1')])
+
+    def __init__(self, path):
+        self.path = path
+        self.scores = {}
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                data = f.read()
+            # a process stopped while writing may have left part of a record
+            data = data[:len(data) - len(data) % self.RECORD.itemsize]
+            for key, score in np.frombuffer(data, dtype=self.RECORD).tolist():
+                self.scores[key] = score
+
+
+    def __len__(self):
+        return len(self.scores)
+
+
+    def get(self, key):
+        return self.scores.get(key)
+
+
+    def add(self, key, score):
+        if key in self.scores:
+            return
+        self.scores[key] = score
+        with open(self.path, 'ab') as f:
+            f.write(np.array([(key, score)], dtype=self.RECORD).tobytes())
+
+
+
+class Solver:
+
+    # Positions remembered between searches before the table is cleared
+    MAX_TABLE = 4000000
+    # Positions whose solve searched at least this many nodes are learned
+    LEARN_NODES = 20000
+
+    # db_path: database to use; by default the one for this board size
+    # next to this module, if it exists ('' for none).
+    # learned_path: file of learned positions; by default the one for this
+    # board size next to this module ('' for none)
+    def __init__(self, rows=6, cols=7, db_path=None, learned_path=None):
+        if (rows+1)*cols > 64:
+            raise Exception(f'{rows}x{cols} is too large for the Connect 4 solver')
+        self.rows = rows
+        self.cols = cols
+        self.squares = rows*cols
+        h = rows + 1
+        self.h = h
+        self.bottom_mask = sum(1 << (c*h) for c in range(cols))
+        self.board_mask = self.bottom_mask * ((1 << rows) - 1)
+        self.column_masks = [((1 << rows) - 1) << (c*h) for c in range(cols)]
+        self.top_masks = [1 << (rows - 1 + c*h) for c in range(cols)]
+        self.bottom_masks = [1 << (c*h) for c in range(cols)]
+        # center columns first
+        self.column_order = [cols//2 + (1 - 2*(i % 2))*((i+1)//2) for i in range(cols)]
+
+        # key -> upper bound on the score, for the search in progress
+        self.table = {}
+        self.nodes = 0
+
+        self.db = None
+        if db_path is None:
+            db_path = default_db_path(rows, cols)
+            if not os.path.exists(db_path):
+                db_path = None
+        if db_path:
+            self.db = PositionDB(db_path)
+            if (self.db.rows, self.db.cols) != (rows, cols):
+                raise Exception(f'{db_path} is for {self.db.rows}x{self.db.cols} boards')
+
+        if learned_path is None:
+            learned_path = default_learned_path(rows, cols)
+        self.learned = LearnedPositions(learned_path) if learned_path else None
+
+
+    # Bitboards of a Connect_X game's position
+    def from_game(self, game):
+        current = 0
+        mask = 0
+        piece = game.get_piece()
+        for col in range(self.cols):
+            for height in range(self.rows):
+                value = game.board[self.rows-1-height][col]
+                if value == game.EMPTY:
+                    break
+                bit = 1 << (col*self.h + height)
+                mask |= bit
+                if value == piece:
+                    current |= bit
+        return current, mask
+
+
+    def num_moves(self, mask):
+        return mask.bit_count()
+
+
+    def can_play(self, mask, col):
+        return (mask & self.top_masks[col]) == 0
+
+
+    # Squares where the pieces in position would make 4 in a row
+    def winning_squares(self, position, mask):
+        h = self.h
+        # vertical
+        r = (position << 1) & (position << 2) & (position << 3)
+        # horizontal and both diagonals
+        for s in (h, h-1, h+1):
+            p = (position << s) & (position << 2*s)
+            r |= p & (position << 3*s)
+            r |= p & (position >> s)
+            p = (position >> s) & (position >> 2*s)
+            r |= p & (position << s)
+            r |= p & (position >> 3*s)
+        return r & (self.board_mask ^ mask)
+
+
+    def possible(self, mask):
+        return (mask + self.bottom_mask) & self.board_mask
+
+
+    def can_win_next(self, current, mask):
+        return self.winning_squares(current, mask) & self.possible(mask) != 0
+
+
+    # Moves (as single bits) that don't let the opponent win right away
+    def non_losing_moves(self, current, mask):
+        possible = self.possible(mask)
+        opponent_win = self.winning_squares(current ^ mask, mask)
+        forced = possible & opponent_win
+        if forced:
+            if forced & (forced - 1):
+                # two threats can't both be blocked
+                return 0
+            possible = forced
+        return possible & ~(opponent_win >> 1)
+
+
+    def key(self, current, mask):
+        return current + mask
+
+
+    def mirror(self, bits):
+        h = self.h
+        column = (1 << h) - 1
+        result = 0
+        for c in range(self.cols):
+            result |= ((bits >> (c*h)) & column) << ((self.cols-1-c)*h)
+        return result
+
+
+    # Key shared by a position and its mirror image
+    def canonical_key(self, current, mask):
+        key = current + mask
+        return min(key, self.mirror(current) + self.mirror(mask))
+
+
+    # Score of the position, which must not be won already.
+    # With no window, the exact score; otherwise only whether it is
+    # <= alpha or >= beta is exact (a null-window search).
+    def negamax(self, current, mask, alpha, beta):
+        self.nodes += 1
+        possible = self.non_losing_moves(current, mask)
+        moves = mask.bit_count()
+        if possible == 0:
+            return -((self.squares - moves)//2)
+        if moves >= self.squares - 2:
+            return 0
+        if self.db is not None and moves <= self.db.plies:
+            score = self.db.get(self.canonical_key(current, mask))
+            if score is not None:
+                return score
+
+        low = -((self.squares - 2 - moves)//2)
+        if alpha < low:
+            alpha = low
+            if alpha >= beta:
+                return alpha
+        high = (self.squares - 1 - moves)//2
+        key = current + mask
+        bound = self.table.get(key)
+        if bound is not None:
+            high = bound
+        if beta > high:
+            beta = high
+            if alpha >= beta:
+                return beta
+
+        # moves making the most new threats first, then center columns
+        ordered = []
+        for col in self.column_order:
+            move = possible & self.column_masks[col]
+            if move:
+                threats = self.winning_squares(current | move, mask).bit_count()
+                ordered.append((-threats, move))
+        ordered.sort(key=lambda x: x[0])
+
+        opponent = current ^ mask
+        for _, move in ordered:
+            score = -self.negamax(opponent, mask | move, -beta, -alpha)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        self.table[key] = alpha
+        return alpha
+
+
+    def solve(self, current, mask):
+        moves = mask.bit_count()
+        if self.can_win_next(current, mask):
+            return (self.squares + 1 - moves)//2
+
+        key = self.canonical_key(current, mask)
+        if self.db is not None and moves <= self.db.plies:
+            score = self.db.get(key)
+            if score is not None:
+                return score
+        if self.learned is not None:
+            score = self.learned.get(key)
+            if score is not None:
+                return score
+
+        if len(self.table) > self.MAX_TABLE:
+            self.table = {}
+        start_nodes = self.nodes
+        low = -((self.squares - moves)//2)
+        high = (self.squares + 1 - moves)//2
+        while low < high:
+            med = low + (high - low)//2
+            # look at small scores first, as they are quicker to settle
+            if med <= 0 and int(low/2) < med:
+                med = int(low/2)
+            elif med >= 0 and int(high/2) > med:
+                med = int(high/2)
+            score = self.negamax(current, mask, med, med + 1)
+            if score <= med:
+                high = score
+            else:
+                low = score
+        if self.learned is not None and self.nodes - start_nodes >= self.LEARN_NODES:
+            self.learned.add(key, low)
+        return low
+
+
+    # Score of every column that can be played, as a list of (column, score)
+    def score_moves(self, current, mask):
+        results = []
+        for col in self.column_order:
+            if not self.can_play(mask, col):
+                continue
+            move = (mask + self.bottom_masks[col]) & self.column_masks[col]
+            if self.winning_squares(current, mask) & move:
+                score = (self.squares + 1 - mask.bit_count())//2
+            else:
+                score = -self.solve(current ^ mask, mask | move)
+            results.append((col, score))
+        return results
+
+
+    # A best column, preferring the center
+    def best_move(self, current, mask):
+        best = None
+        for col, score in self.score_moves(current, mask):
+            if best is None or score > best[1]:
+                best = (col, score)
+        return best[0]
+
+
+
+# Every position reachable in exactly ply moves, for ply = 0 .. plies,
+# in which the game isn't over, up to mirror images.
+# Returns a list with {canonical key: (current, mask)} for each ply.
+def enumerate_positions(solver, plies):
+    levels = [{solver.canonical_key(0, 0): (0, 0)}]
+    for ply in range(plies):
+        next_level = {}
+        for current, mask in levels[-1].values():
+            for col in range(solver.cols):
+                if not solver.can_play(mask, col):
+                    continue
+                move = (mask + solver.bottom_masks[col]) & solver.column_masks[col]
+                if solver.winning_squares(current, mask) & move:
+                    # the game ends here
+                    continue
+                child = (current ^ mask, mask | move)
+                next_level.setdefault(solver.canonical_key(*child), child)
+        levels.append(next_level)
+    return levels
+
+
+_solver = None
+
+
+def _init_worker(rows, cols):
+    global _solver
+    # build from scratch rather than from a database
+    _solver = Solver(rows, cols, db_path='', learned_path='')
+
+
+def _solve_position(item):
+    key, (current, mask) = item
+    return key, _solver.solve(current, mask)
+
+
+# Only the positions plies moves in are searched. The score of each
+# earlier position follows from the scores of its children.
+def build(rows, cols, plies, path, workers=None):
+    solver = Solver(rows, cols, db_path='', learned_path='')
+    levels = enumerate_positions(solver, plies)
+    print(f'Solving {len(levels[-1])} positions {plies} moves in')
+    start = time.time()
+    scores = {}
+    with multiprocessing.Pool(workers, _init_worker, (rows, cols)) as pool:
+        for key, score in pool.imap_unordered(_solve_position, levels[-1].items(), 4):
+            scores[key] = score
+            if len(scores) % 100 == 0:
+                elapsed = time.time() - start
+                left = elapsed/len(scores) * (len(levels[-1]) - len(scores))
+                print(f'\t{len(scores)} / {len(levels[-1])} in {elapsed:.0f} s, '
+                      f'about {left/3600:.1f} h left', flush=True)
+
+    for level in reversed(levels[:-1]):
+        for key, (current, mask) in level.items():
+            best = None
+            for col in range(cols):
+                if not solver.can_play(mask, col):
+                    continue
+                move = (mask + solver.bottom_masks[col]) & solver.column_masks[col]
+                if solver.winning_squares(current, mask) & move:
+                    score = (solver.squares + 1 - mask.bit_count())//2
+                else:
+                    score = -scores[solver.canonical_key(current ^ mask, mask | move)]
+                if best is None or score > best:
+                    best = score
+            scores[key] = best
+
+    PositionDB.write(path, rows, cols, plies, scores)
+    print(f'Wrote {len(scores)} positions to {path} in {time.time()-start:.0f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connect 4 solver')
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    b = sub.add_parser('build', help='solve the early positions into a database')
+    b.add_argument('--rows', type=int, default=6)
+    b.add_argument('--cols', type=int, default=7)
+    b.add_argument('--plies', type=int, default=8, help='solve positions up to this many moves in')
+    b.add_argument('--out', help='database file (default: next to this module)')
+    b.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+
+    s = sub.add_parser('solve', help='score each column of a position')
+    s.add_argument('moves', help="columns played so far, from 1, e.g. '4453'")
+    s.add_argument('--rows', type=int, default=6)
+    s.add_argument('--cols', type=int, default=7)
+    s.add_argument('--db', help='database file')
+
+    args = parser.parse_args()
+    if args.mode == 'build':
+        build(args.rows, args.cols, args.plies, args.out or default_db_path(args.rows, args.cols), args.workers)
+    else:
+        solver = Solver(args.rows, args.cols, args.db)
+        current, mask = 0, 0
+        for char in args.moves:
+            col = int(char) - 1
+            move = (mask + solver.bottom_masks[col]) & solver.column_masks[col]
+            current, mask = current ^ mask, mask | move
+        start = time.time()
+        for col, score in sorted(solver.score_moves(current, mask)):
+            print(f'{col+1}: {score:+d}')
+        print(f'{solver.nodes} nodes in {time.time()-start:.2f} s')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+#!/usr/bin/python
+
+# Spread games or position analysis over worker processes on any number of
+# hosts. A coordinator holds the work units and serves them over TCP to the
+# workers that connect to it, and merges their results into one summary.
+#
+# Work units are JSON objects:
+#   {"id": 0, "kind": "game", "game": "Othello", "players": ["m 3 b", "m 2 b"],
+#    "seed": 1, "index": 0}
+#   {"id": 0, "kind": "position", "position": "Othello 8x8 ... X 0", "player": "m 3 b"}
+# A game is played with the seed of its index in the run (see game_seed), so
+# its result doesn't depend on which worker plays it or how often it is
+# retried. A position is scored as by analyze_positions.py.
+#
+# The protocol is one JSON object per line in each direction, as for
+# game_server.py. Worker requests, each answered with one reply:
+#   {"cmd": "hello", "worker": "host:pid"}    -> {"ok": true, "heartbeat": 5.0}
+#   {"cmd": "get"}                            -> {"ok": true, "unit": {...}},
+#                                                {"ok": true, "wait": 0.1} or {"ok": true, "done": true}
+#   {"cmd": "result", "unit": 0, "result": {...}} -> {"ok": true}
+# and heartbeats, {"cmd": "heartbeat"}, which are not answered. A worker
+# sends one every heartbeat seconds, even while it is busy with a unit. A
+# worker that hasn't been heard from for timeout seconds, or whose
+# connection drops, is given up on, and its units go back to the front of
+# the queue for other workers. The first result for a unit is kept. A
+# unit that fails in run_unit is reported as {"error": ...} instead of
+# being retried, since it would fail for every worker.
+# A worker told to wait (the units left are all out, but may come back)
+# asks again after the given wait, doubling it each time up to the
+# heartbeat, so a unit put back is picked up quickly without a worker
+# that is left with nothing to do asking many times a second.
+#
+# Usage: python distributed.py coordinator [--port N] [--local N] games <num_games> <game> <player1> <player2> [--seed N]
+#        python distributed.py coordinator [--port N] [--local N] analyze <file> <player> [--binary]
+#        python distributed.py worker --host <host> [--port N] [--processes N]
+#        e.g. python distributed.py coordinator --host 0.0.0.0 games 200 Othello 'm 3 b' 'm 2 b' --seed 1
+#             python distributed.py worker --host coordinator.example.com --processes 8
+#        --local N also starts N workers on this host.
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from game_registry import new_game, parse_player
+
+
+class WorkerConnection:
+    def __init__(self, writer):
+        self.name = None
+        self.writer = writer
+        self.last_seen = time.monotonic()
+        # units assigned and not yet reported
+        self.units = set()
+        self.completed = 0
+        self.dropped = False
+
+
+class Coordinator:
+
+    # first wait of a worker with nothing to do, in seconds
+    POLL = 0.1
+
+    def __init__(self, units, heartbeat=5.0, timeout=None, on_result=None):
+        self.units = units
+        self.heartbeat = heartbeat
+        self.timeout = 3*heartbeat if timeout is None else timeout
+        # called with each unit's id and result, the first time it arrives
+        self.on_result = on_result
+
+        self.pending = collections.deque(range(len(units)))
+        self.results = [None]*len(units)
+        self.remaining = len(units)
+        self.connections = []
+        self.reassigned = 0
+        self.finished = None
+
+
+    async def serve(self, host='127.0.0.1', port=8766, started=None):
+        self.finished = asyncio.Event()
+        if self.remaining == 0:
+            self.finished.set()
+        server = await asyncio.start_server(self.handle_worker, host, port)
+        if started is not None:
+            started(server.sockets[0].getsockname()[1])
+        reaper = asyncio.create_task(self.reap_silent())
+        try:
+            async with server:
+                await self.finished.wait()
+        finally:
+            reaper.cancel()
+            for connection in self.connections:
+                connection.writer.close()
+
+
+    async def handle_worker(self, reader, writer):
+        connection = WorkerConnection(writer)
+        self.connections.append(connection)
+        try:
+            while not connection.dropped:
+                line = await reader.readline()
+                if not line:
+                    break
+                connection.last_seen = time.monotonic()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('request must be a JSON object')
+                    reply = self.handle_request(connection, request)
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e) or type(e).__name__}
+                if reply is not None:
+                    writer.write((json.dumps(reply) + '\n').encode())
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # the worker went away, or the coordinator is finished
+            pass
+        finally:
+            self.drop(connection)
+
+
+    def handle_request(self, connection, request):
+        cmd = request.get('cmd')
+        if cmd == 'heartbeat':
+            return None
+        if cmd == 'hello':
+            connection.name = str(request.get('worker'))
+            return {'ok': True, 'heartbeat': self.heartbeat}
+        if cmd == 'get':
+            if self.pending:
+                uid = self.pending.popleft()
+                connection.units.add(uid)
+                return {'ok': True, 'unit': self.units[uid]}
+            if self.remaining == 0:
+                return {'ok': True, 'done': True}
+            # the units left are all out, but may come back
+            return {'ok': True, 'wait': min(self.POLL, self.heartbeat)}
+        if cmd == 'result':
+            uid = request.get('unit')
+            if not isinstance(uid, int) or not 0 <= uid < len(self.units):
+                raise ValueError(f'no unit {uid!r}')
+            connection.units.discard(uid)
+            if self.results[uid] is None:
+                self.results[uid] = request.get('result')
+                self.remaining -= 1
+                connection.completed += 1
+                if self.on_result is not None:
+                    self.on_result(uid, self.results[uid])
+                if self.remaining == 0:
+                    self.finished.set()
+            return {'ok': True}
+        raise ValueError(f'unknown command {cmd!r}')
+
+
+    # Give up on a worker, and hand its units to the others
+    def drop(self, connection):
+        if connection.dropped:
+            return
+        connection.dropped = True
+        for uid in sorted(connection.units, reverse=True):
+            if self.results[uid] is None:
+                self.pending.appendleft(uid)
+                self.reassigned += 1
+        connection.units.clear()
+        connection.writer.close()
+
+
+    async def reap_silent(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            cutoff = time.monotonic() - self.timeout
+            for connection in self.connections:
+                if not connection.dropped and connection.last_seen < cutoff:
+                    print(f'Worker {connection.name} is silent; reassigning its work', file=sys.stderr)
+                    self.drop(connection)
+
+
+    # Units completed by each worker, by name
+    def worker_counts(self):
+        counts = collections.Counter()
+        for connection in self.connections:
+            if connection.name is not None:
+                counts[connection.name] += connection.completed
+        return counts
+
+
+
+# Runs in a worker: play or analyze one unit
+_games = {}
+
+def run_unit(unit):
+    if unit['kind'] == 'game':
+        from play_games import play_seeded_game
+        key = (unit['game'], tuple(unit['players']))
+        game = _games.get(key)
+        if game is None:
+            game = new_game(unit['game'])
+            for n in [1, 2]:
+                game.configure_player(n, parse_spec(unit['players'][n-1]))
+            _games[key] = game
+        start = time.process_time()
+        condition = play_seeded_game(game, unit['seed'], unit['index'])
+        return {'condition': condition, 'moves': game.counter, 'cpu': time.process_time() - start}
+    if unit['kind'] == 'position':
+        from analyze_positions import analyze
+        return analyze(unit['position'], parse_spec(unit['player']))
+    raise Exception(f"Unknown kind of work {unit['kind']!r}")
+
+
+def parse_spec(spec):
+    lst = spec.split()
+    lst.reverse()
+    options = parse_player(lst)
+    if len(lst) != 0 or options[0] == 'h':
+        raise Exception(f'bad player {spec!r}')
+    return options
+
+
+def run_worker(host, port, name=None):
+    if name is None:
+        name = f'{socket.gethostname()}:{os.getpid()}'
+    sock = socket.create_connection((host, port))
+    f = sock.makefile('rwb')
+    lock = threading.Lock()
+
+    def send(message):
+        with lock:
+            f.write((json.dumps(message) + '\n').encode())
+            f.flush()
+
+    def call(message):
+        send(message)
+        line = f.readline()
+        if not line:
+            raise ConnectionError('coordinator closed the connection')
+        reply = json.loads(line)
+        if not reply['ok']:
+            raise Exception(reply['error'])
+        return reply
+
+    stop = threading.Event()
+
+    def beat(interval):
+        while not stop.wait(interval):
+            try:
+                send({'cmd': 'heartbeat'})
+            except (OSError, ValueError):
+                return
+
+    units = 0
+    try:
+        interval = call({'cmd': 'hello', 'worker': name})['heartbeat']
+        threading.Thread(target=beat, args=(interval,), daemon=True).start()
+        waits = 0
+        while True:
+            reply = call({'cmd': 'get'})
+            if reply.get('done'):
+                break
+            if 'wait' in reply:
+                time.sleep(min(reply['wait'] * 2**waits, interval))
+                waits += 1
+                continue
+            waits = 0
+            unit = reply['unit']
+            try:
+                result = run_unit(unit)
+            except Exception as e:
+                result = {'error': f'{type(e).__name__}: {e}'}
+            call({'cmd': 'result', 'unit': unit['id'], 'result': result})
+            units += 1
+    except ConnectionError:
+        # the coordinator has finished (or gone)
+        pass
+    finally:
+        stop.set()
+        sock.close()
+    return units
+
+
+# Start n workers on this host, as separate processes
+def start_workers(n, host, port):
+    return [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker',
+                              '--host', host, '--port', str(port)])
+            for _ in range(n)]
+
+
+def game_units(num_games, game_name, players, seed):
+    game = new_game(game_name)
+    for n in [1, 2]:
+        game.configure_player(n, parse_spec(players[n-1]))
+    return [{'id': index, 'kind': 'game', 'game': game_name, 'players': players,
+             'seed': seed, 'index': index} for index in range(num_games)]
+
+
+def position_units(path, player, binary):
+    from positions import decode, read_positions, encode_text
+    parse_spec(player)
+    records = []
+    with open(path, 'rb' if binary else 'r') as f:
+        for record in read_positions(f, binary):
+            try:
+                game = decode(record)
+            except Exception as e:
+                raise Exception(f'bad position {len(records)+1} in {path}: {e}')
+            records.append(record if not binary else encode_text(game))
+    return [{'id': index, 'kind': 'position', 'position': record, 'player': player}
+            for index, record in enumerate(records)]
+
+
+def print_game_summary(coordinator, elapsed):
+    failed = [result['error'] for result in coordinator.results if 'error' in result]
+    results = [result for result in coordinator.results if 'error' not in result]
+    wins = collections.Counter(result['condition'] for result in results)
+    moves = sum(result['moves'] for result in results)
+    cpu = sum(result['cpu'] for result in results)
+    print(f'In {len(results)} games:')
+    print(f'\tPlayer 1: {wins[1]} wins')
+    print(f'\tPlayer 2: {wins[2]} wins')
+    print(f'\t{wins[0]} draws')
+    print(f'{moves} moves in {elapsed:.1f} s ({cpu:.1f} s of worker CPU), '
+          f'{coordinator.reassigned} units reassigned')
+    for name, count in sorted(coordinator.worker_counts().items()):
+        print(f'\t{name}: {count} games')
+    if failed:
+        print(f'{len(failed)} games failed, e.g. {failed[0]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distribute games or analysis over workers')
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    c = sub.add_parser('coordinator', help='serve work units and merge the results')
+    c.add_argument('--host', default='127.0.0.1', help="address to listen on ('0.0.0.0' for all)")
+    c.add_argument('--port', type=int, default=8766)
+    c.add_argument('--heartbeat', type=float, default=5.0, help='seconds between worker heartbeats')
+    c.add_argument('--timeout', type=float, help='seconds of silence before a worker is given up on '
+                                                 '(default: 3 heartbeats)')
+    c.add_argument('--local', type=int, default=0, help='workers to start on this host')
+    work = c.add_subparsers(dest='work', required=True)
+    g = work.add_parser('games', help='play a match')
+    g.add_argument('num_games', type=int)
+    g.add_argument('game', help="game name, e.g. 'Othello' or 'Othello:6x6'")
+    g.add_argument('player1', help="e.g. 'm 3 b'")
+    g.add_argument('player2')
+    g.add_argument('--seed', type=int, default=0)
+    a = work.add_parser('analyze', help='score a file of positions')
+    a.add_argument('file')
+    a.add_argument('player', nargs='+', help="player, e.g. 'm 2 r 5 2'")
+    a.add_argument('--binary', action='store_true', help='positions are binary records')
+
+    w = sub.add_parser('worker', help='work for a coordinator')
+    w.add_argument('--host', default='127.0.0.1')
+    w.add_argument('--port', type=int, default=8766)
+    w.add_argument('--processes', type=int, default=1, help='workers to run on this host')
+
+    args = parser.parse_args()
+    if args.mode == 'worker':
+        if args.processes > 1:
+            workers = start_workers(args.processes, args.host, args.port)
+            for worker in workers:
+                worker.wait()
+        else:
+            run_worker(args.host, args.port)
+        return
+
+    on_result = None
+    try:
+        if args.work == 'games':
+            units = game_units(args.num_games, args.game, [args.player1, args.player2], args.seed)
+        else:
+            units = position_units(args.file, ' '.join(args.player), args.binary)
+    except Exception as e:
+        parser.error(str(e))
+    if args.work == 'analyze':
+        # results are written in the order of the positions, as they complete
+        written = [0]
+
+        def on_result(uid, result):
+            while written[0] < len(coordinator.results) and coordinator.results[written[0]] is not None:
+                print(json.dumps(coordinator.results[written[0]]), flush=True)
+                written[0] += 1
+
+    coordinator = Coordinator(units, args.heartbeat, args.timeout, on_result)
+    workers = []
+
+    def started(port):
+        print(f'Serving {len(units)} units on {args.host}:{port}', file=sys.stderr)
+        workers.extend(start_workers(args.local, '127.0.0.1', port))
+
+    start = time.time()
+    try:
+        asyncio.run(coordinator.serve(args.host, args.port, started))
+    finally:
+        for worker in workers:
+            worker.wait()
+    if args.work == 'games':
+        print_game_summary(coordinator, time.time() - start)
+    else:
+        failed = sum('error' in result for result in coordinator.results)
+        print(f'{len(units)} positions in {time.time() - start:.1f} s, '
+              f'{coordinator.reassigned} units reassigned, {failed} failed', file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
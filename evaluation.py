@@ -0,0 +1,99 @@
+# Fitted evaluations for Minimax, used in place of a game's score_board()
+# by the 'm <depth> e <file>' player.
+#
+# A weight file (written by tune_eval.py) is a JSON object:
+#   {"class": "Connect_X", "size": [6, 7, 4], "fit": "logistic",
+#    "features": ["bias", "to_move", ...], "weights": [...], ...}
+# The score of a position is the dot product of the weights with the
+# game's eval_features(), which predicts the result for player 1: the log
+# odds of winning for a logistic fit, or +1 for a win, -1 for a loss and
+# 0 for a draw for a least squares fit.
+#
+# The file may instead hold the tables of an Othello pattern evaluation
+# (see othello_patterns.py), which load_evaluator() recognizes.
+
+import json
+
+import numpy as np
+
+from board_games import INFINITY
+
+
+# predictions are scaled up to the size of score_board() scores, and kept
+# well away from the scores of won and lost games
+SCALE = 100
+LIMIT = INFINITY//2
+
+# evaluators this process has loaded, by path
+_loaded = {}
+
+
+def game_size(game):
+    size = [game.num_rows, game.num_cols]
+    if hasattr(game, 'connect_x'):
+        size.append(game.connect_x)
+    return size
+
+
+class EvalWeights:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path) as f:
+            data = json.load(f)
+        self.game_class = data['class']
+        self.size = data['size']
+        self.fit = data.get('fit')
+        self.features = data['features']
+        self.weights = np.array(data['weights'], dtype=np.float64)
+
+
+    # Raise an exception unless the weights were fitted for this game
+    def check(self, game):
+        if type(game).__name__ != self.game_class or game_size(game) != self.size:
+            raise Exception(f'{self.path} is for {self.game_class} {self.size}')
+        if game.eval_feature_names() != self.features:
+            raise Exception(f'{self.path} has different features from {self.game_class}')
+
+
+    def predict(self, game):
+        return float(game.eval_features() @ self.weights)
+
+
+    def score_board(self, game, player):
+        score = min(max(SCALE*self.predict(game), -LIMIT), LIMIT)
+        return score if player == 1 else -score
+
+
+    # The repr is part of the search settings, so it names the file
+    def __repr__(self):
+        return f'EvalWeights({self.path!r})'
+
+
+    # Sent to other processes by path; each process loads it once
+    def __reduce__(self):
+        return (load_evaluator, (self.path,))
+
+
+def load_evaluator(path, game=None):
+    evaluator = _loaded.get(path)
+    if evaluator is None:
+        with open(path, 'rb') as f:
+            magic = f.read(4)
+        if magic == b'OTPT':
+            from othello_patterns import PatternEvaluator
+            evaluator = PatternEvaluator(path)
+        else:
+            evaluator = EvalWeights(path)
+        _loaded[path] = evaluator
+    if game is not None:
+        evaluator.check(game)
+    return evaluator
+
+
+def save_weights(path, game, features, weights, **info):
+    data = {'class': type(game).__name__, 'size': game_size(game),
+            'features': list(features), 'weights': [float(w) for w in weights]}
+    data.update(info)
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=1)
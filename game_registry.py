@@ -0,0 +1,117 @@
+# Registry of the available games and computer agents.
+#
+# Games are registered by name with the module and class implementing them.
+# The module is only imported when the game is chosen, so its dependencies
+# (e.g. NumPy) don't slow down anything that doesn't play it.
+#
+# Agents are registered by the letter that starts a player specification
+# ('h', 'r', 'm 2 b', ...) with a function turning the rest of the
+# specification into the options list given to configure_player().
+
+import functools
+import importlib
+
+
+# name -> (module, class name)
+GAMES = {}
+
+# letter -> parser taking the remaining tokens (in reverse order, so the
+# next token is lst.pop()) and returning the player's options
+AGENTS = {}
+
+
+def register_game(name, module, attr):
+    GAMES[name] = (module, attr)
+
+
+def register_agent(letter, parser):
+    AGENTS[letter] = parser
+
+
+def game_names():
+    return list(GAMES)
+
+
+def load_game(name):
+    if name not in GAMES:
+        raise Exception(f'Unknown game {name}')
+    module, attr = GAMES[name]
+    return getattr(importlib.import_module(module), attr)
+
+
+# The name may end with the board size, e.g. 'Tic-Tac-Toe:15x15x5'
+# (rows x columns x pieces in a row) or 'Othello:6x6'
+def new_game(name):
+    name, _, size = name.partition(':')
+    args = [int(x) for x in size.split('x')] if size else []
+    return load_game(name)(*args)
+
+
+# Constructor for a game that doesn't import anything until it is called
+def game_factory(name):
+    return functools.partial(new_game, name)
+
+
+def parse_player(lst):
+    char = lst.pop()
+    if char not in AGENTS:
+        raise Exception(f'Unknown player {char}')
+    return AGENTS[char](lst)
+
+
+def pop_int(lst):
+    arg = lst.pop()
+    if not arg.isdigit():
+        raise Exception(f'Expected a number, not {arg}')
+    return int(arg)
+
+
+def parse_human(lst):
+    return ['h']
+
+
+def parse_random(lst):
+    return ['r']
+
+
+# 'm <depth> b', 'm <depth> r <samples> <sample depth>',
+# 'm <depth> h <samples> <sample depth>' (the same playouts shared out by
+# sequential halving) or 'm <depth> e <weight file>' (see evaluation.py)
+def parse_minimax(lst):
+    comp = ['m', pop_int(lst)]
+    mscoring = lst.pop()
+    if mscoring == 'b':
+        comp.append('b')
+    elif mscoring in ('r', 'h'):
+        comp.append(mscoring)
+        comp.append(pop_int(lst))
+        comp.append(pop_int(lst))
+    elif mscoring == 'e':
+        comp.append('e')
+        comp.append(lst.pop())
+    else:
+        raise Exception(f'Unknown scoring {mscoring}')
+    return comp
+
+
+# Perfect play, for games with a solver (Connect 4, small Othello boards)
+def parse_solver(lst):
+    return ['s']
+
+
+# Monte Carlo tree search: 't <playouts> [<workers>]' (see mcts.py)
+def parse_mcts(lst):
+    comp = ['t', pop_int(lst)]
+    comp.append(pop_int(lst) if lst and lst[-1].isdigit() else 0)
+    return comp
+
+
+register_game('Tic-Tac-Toe', 'board_games', 'TicTacToe')
+register_game('Connect4', 'board_games', 'Connect_X')
+register_game('Othello', 'board_games', 'Othello')
+
+register_agent('h', parse_human)
+register_agent('r', parse_random)
+register_agent('m', parse_minimax)
+register_agent('s', parse_solver)
+register_agent('t', parse_mcts)
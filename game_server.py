@@ -0,0 +1,419 @@
+#!/usr/bin/python
+
+# Serve many concurrent games over TCP (or a Unix socket).
+#
+# The protocol is one JSON object per line in each direction. Requests:
+#   {"cmd": "new", "game": "Connect4", "players": ["h", "m 2 b"], "move_timeout": 5}
+#   {"cmd": "move", "session": "1", "move": 3}
+#   {"cmd": "state", "session": "1"}
+#   {"cmd": "close", "session": "1"}
+#   {"cmd": "stats"}
+# Any request may carry an "id", which is echoed in the reply. Replies have
+# "ok": true plus the game state, or "ok": false and an "error" message.
+# After each human move the computer players move until it is a human's
+# turn again; their moves are listed in "engine_moves".
+#
+# Computer moves that need real work (Minimax) run in worker processes
+# so the event loop never blocks. Each session is served by one worker,
+# which keeps its own copy of the game between moves, so the players'
+# random streams and what their searches remember carry on from move to
+# move as in play_games.py; it is sent the moves made since it last saw
+# the game. At most max_pending computer moves are queued at a time;
+# further requests wait, which stops the server reading from those
+# clients. A computer move that takes longer than the session's
+# move_timeout is abandoned and replaced by a random move, and the
+# worker's copy, left partway through a search, is replaced by the next.
+# With --table, the workers share Minimax results through a SharedTable.
+
+import argparse
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import os
+import random
+import time
+
+from board_games import SearchAborted
+from game_registry import new_game, parse_player
+
+
+# set in each worker: session id -> its copy of the game
+_games = {}
+
+
+# Runs in a worker process: the session's game arrives pickled (with its
+# players rebuilt from their options) the first time, after that only the
+# moves made since. Plays the computer's move in the worker's copy too.
+# Returns None if the deadline passed.
+def engine_move(sid, game, moves, deadline):
+    if game is not None:
+        game.interactive = False
+        _games[sid] = game
+    else:
+        game = _games[sid]
+        for move in moves:
+            game.make_move(move)
+    if deadline is not None:
+        game.search_abort = lambda: time.time() > deadline
+    try:
+        move = game.get_move()
+    except SearchAborted:
+        # the search left the board partway through its moves
+        del _games[sid]
+        return None
+    finally:
+        game.search_abort = None
+    game.make_move(move)
+    return [move]
+
+
+def drop_game(sid):
+    _games.pop(sid, None)
+
+
+class Session:
+    def __init__(self, sid, game, move_timeout, executor):
+        self.sid = sid
+        self.game = game
+        self.move_timeout = move_timeout
+        self.last_active = time.monotonic()
+        # the worker keeping a copy of the game, and the moves it hasn't
+        # seen; None until it has a copy
+        self.executor = executor
+        self.unsent = None
+        # one request at a time may change the game
+        self.lock = asyncio.Lock()
+
+
+class GameServer:
+
+    def __init__(self, workers=None, max_sessions=10000, max_pending=None,
+                 move_timeout=10.0, idle_timeout=600.0, table_entries=0):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if max_pending is None:
+            max_pending = 4*workers
+        self.workers = workers
+        # one process each, so a session's moves go to the worker with its game
+        self.executors = [concurrent.futures.ProcessPoolExecutor(max_workers=1)
+                          for _ in range(workers)]
+        self.max_sessions = max_sessions
+        self.max_pending = max_pending
+        self.engine_slots = None
+        self.move_timeout = move_timeout
+        self.idle_timeout = idle_timeout
+        self.table = None
+        if table_entries > 0:
+            from shared_table import SharedTable
+            self.table = SharedTable(table_entries)
+
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.moves_played = 0
+        self.engine_timeouts = 0
+        self.requests = 0
+
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        self.engine_slots = asyncio.Semaphore(self.max_pending)
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle_client, path=path)
+        else:
+            server = await asyncio.start_server(self.handle_client, host, port)
+        reaper = asyncio.create_task(self.reap_idle())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reaper.cancel()
+            for executor in self.executors:
+                executor.shutdown(wait=False, cancel_futures=True)
+            if self.table is not None:
+                self.table.close()
+
+
+    async def handle_client(self, reader, writer):
+        # sessions belong to the connection that created them
+        owned = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError('request must be a JSON object')
+                    reply = await self.handle_request(request, owned)
+                except Exception as e:
+                    reply = {'ok': False, 'error': str(e) or type(e).__name__}
+                    if isinstance(request, dict) and 'id' in request:
+                        reply['id'] = request['id']
+                writer.write((json.dumps(reply) + '\n').encode())
+                # don't run ahead of a client that isn't reading its replies
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for sid in owned:
+                self.drop_session(sid)
+            writer.close()
+
+
+    async def handle_request(self, request, owned):
+        self.requests += 1
+        cmd = request.get('cmd')
+        if cmd == 'new':
+            reply = await self.new_session(request, owned)
+        elif cmd == 'move':
+            reply = await self.play_move(self.get_session(request, owned), request.get('move'))
+        elif cmd == 'state':
+            reply = self.state(self.get_session(request, owned))
+        elif cmd == 'close':
+            session = self.get_session(request, owned)
+            owned.discard(session.sid)
+            self.drop_session(session.sid)
+            reply = {'ok': True, 'session': session.sid}
+        elif cmd == 'stats':
+            reply = {'ok': True, 'sessions': len(self.sessions), 'moves': self.moves_played,
+                     'requests': self.requests, 'engine_timeouts': self.engine_timeouts}
+            if self.table is not None:
+                reply['table'] = self.table.stats()
+        else:
+            raise ValueError(f'unknown command {cmd!r}')
+        if 'id' in request:
+            reply['id'] = request['id']
+        return reply
+
+
+    def get_session(self, request, owned):
+        sid = str(request.get('session'))
+        if sid not in owned or sid not in self.sessions:
+            raise ValueError(f'no session {sid}')
+        session = self.sessions[sid]
+        session.last_active = time.monotonic()
+        return session
+
+
+    async def new_session(self, request, owned):
+        if len(self.sessions) >= self.max_sessions:
+            raise ValueError('server is full')
+        try:
+            game = new_game(request.get("game"))
+        except Exception:
+            raise ValueError(f'unknown game {request.get("game")!r}')
+        game.interactive = False
+        if self.table is not None:
+            game.configure_shared_table(self.table)
+        players = request.get('players', ['h', 'h'])
+        if not isinstance(players, list) or len(players) != 2:
+            raise ValueError('two players are needed')
+        for n in [1, 2]:
+            lst = str(players[n-1]).split()
+            lst.reverse()
+            try:
+                options = parse_player(lst)
+                if len(lst) != 0:
+                    raise Exception
+            except Exception:
+                raise ValueError(f'bad player {players[n-1]!r}')
+            game.configure_player(n, options)
+
+        move_timeout = float(request.get('move_timeout', self.move_timeout))
+        sid = str(next(self.ids))
+        session = Session(sid, game, move_timeout, self.executors[int(sid) % self.workers])
+        self.sessions[session.sid] = session
+        owned.add(session.sid)
+        # the computer may have the first move
+        return await self.play_move(session, None, human=False)
+
+
+    async def play_move(self, session, move, human=True):
+        async with session.lock:
+            game = session.game
+            if human:
+                if game.condition != -1:
+                    raise ValueError('game is over')
+                if game.player_options[game.current_player-1][0] != 'h':
+                    raise ValueError('not a human player\'s turn')
+                move = self.find_move(game, move)
+                self.make_move(session, move)
+
+            engine_moves = []
+            while (game.condition == -1 and
+                   game.player_options[game.current_player-1][0] != 'h'):
+                engine_moves.append(await self.engine_move(session))
+            reply = self.state(session)
+            reply['engine_moves'] = engine_moves
+            return reply
+
+
+    # The valid move the client sent. JSON 4.0 and true equal 4 and 1 in
+    # Python, so moves are compared as JSON.
+    @staticmethod
+    def find_move(game, move):
+        text = json.dumps(move)
+        for valid in game.valid_moves():
+            if json.dumps(valid) == text:
+                return valid
+        raise ValueError(f'invalid move {move!r}')
+
+
+    # A move made here, which the session's worker hasn't seen
+    def make_move(self, session, move):
+        session.game.make_move(move)
+        if session.unsent is not None:
+            session.unsent.append(move)
+        self.moves_played += 1
+
+
+    async def engine_move(self, session):
+        game = session.game
+        if game.player_options[game.current_player-1][0] == 'r':
+            # cheap enough to do in place
+            move = game.get_move()
+            self.make_move(session, move)
+            return move
+
+        async with self.engine_slots:
+            deadline = time.time() + session.move_timeout
+            if session.unsent is None:
+                args = (game, None)
+            else:
+                args = (None, session.unsent)
+            future = asyncio.get_running_loop().run_in_executor(
+                session.executor, engine_move, session.sid, *args, deadline)
+            session.unsent = []
+            try:
+                # the worker gives up at the deadline; this is only a backstop
+                result = await asyncio.wait_for(future, session.move_timeout + 5)
+            except asyncio.TimeoutError:
+                result = None
+        if result is None:
+            self.engine_timeouts += 1
+            # the worker's copy is no good now; it gets the game again
+            session.unsent = None
+            move = game.random_move()
+            self.make_move(session, move)
+        else:
+            move = result[0]
+            # already made in the worker's copy
+            game.make_move(move)
+            self.moves_played += 1
+        return move
+
+
+    def drop_session(self, sid):
+        session = self.sessions.pop(sid, None)
+        if session is not None:
+            session.executor.submit(drop_game, sid)
+
+
+    def state(self, session):
+        game = session.game
+        reply = {'ok': True, 'session': session.sid,
+                 'board': game.board.tolist(),
+                 'player': game.current_player,
+                 'condition': game.condition}
+        if game.condition == -1:
+            reply['moves'] = game.valid_moves()
+        return reply
+
+
+    # Drop sessions whose clients went quiet
+    async def reap_idle(self):
+        while True:
+            await asyncio.sleep(min(self.idle_timeout, 60))
+            cutoff = time.monotonic() - self.idle_timeout
+            for sid, session in list(self.sessions.items()):
+                if session.last_active < cutoff:
+                    self.drop_session(sid)
+
+
+
+# Load test: each client plays random moves as a human against the
+# given player, timing every request.
+async def load_client(host, port, game_name, player, num_games, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    moves = 0
+    request_id = 0
+
+    async def call(request):
+        nonlocal request_id
+        request_id += 1
+        request['id'] = request_id
+        start = time.perf_counter()
+        writer.write((json.dumps(request) + '\n').encode())
+        await writer.drain()
+        reply = json.loads(await reader.readline())
+        latencies.append(time.perf_counter() - start)
+        if not reply['ok']:
+            raise Exception(reply['error'])
+        return reply
+
+    for _ in range(num_games):
+        reply = await call({'cmd': 'new', 'game': game_name, 'players': ['h', player]})
+        moves += len(reply['engine_moves'])
+        while reply['condition'] == -1:
+            reply = await call({'cmd': 'move', 'session': reply['session'],
+                                'move': random.choice(reply['moves'])})
+            moves += 1 + len(reply['engine_moves'])
+        await call({'cmd': 'close', 'session': reply['session']})
+    writer.close()
+    return moves
+
+
+async def load_test(host, port, game_name, player, clients, num_games):
+    latencies = []
+    start = time.perf_counter()
+    counts = await asyncio.gather(*[load_client(host, port, game_name, player, num_games, latencies)
+                                    for _ in range(clients)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    moves = sum(counts)
+    print(f'{clients} clients x {num_games} games of {game_name} against {player!r}')
+    print(f'\t{moves} moves in {elapsed:.2f} s: {moves/elapsed:.1f} moves/sec')
+    print(f'\t{len(latencies)} requests: {len(latencies)/elapsed:.1f} requests/sec')
+    print(f'\tlatency p50 {1000*latencies[len(latencies)//2]:.2f} ms, '
+          f'p99 {1000*latencies[min(len(latencies)-1, int(0.99*len(latencies)))]:.2f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Board game server and load tester')
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    serve = sub.add_parser('serve', help='run the server')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--unix', help='listen on this Unix socket instead')
+    serve.add_argument('--workers', type=int, help='engine worker processes')
+    serve.add_argument('--max-sessions', type=int, default=10000)
+    serve.add_argument('--max-pending', type=int, help='queued engine moves before requests wait')
+    serve.add_argument('--move-timeout', type=float, default=10.0, help='seconds per computer move')
+    serve.add_argument('--idle-timeout', type=float, default=600.0, help='seconds before a quiet session is dropped')
+    serve.add_argument('--table', type=int, default=0, help='Minimax positions shared by the workers (0 = none)')
+
+    load = sub.add_parser('loadtest', help='measure a running server')
+    load.add_argument('--host', default='127.0.0.1')
+    load.add_argument('--port', type=int, default=8765)
+    load.add_argument('--game', default='Connect4')
+    load.add_argument('--player', default='m 1 b', help="opponent, e.g. 'r' or 'm 2 b'")
+    load.add_argument('--clients', type=int, default=20)
+    load.add_argument('--games', type=int, default=5, help='games per client')
+
+    args = parser.parse_args()
+    if args.mode == 'serve':
+        server = GameServer(args.workers, args.max_sessions, args.max_pending,
+                            args.move_timeout, args.idle_timeout, args.table)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+    else:
+        asyncio.run(load_test(args.host, args.port, args.game, args.player, args.clients, args.games))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+#!/usr/bin/python
+
+# Monte Carlo tree search with random playouts, for any game, optionally
+# with the playouts run in parallel worker processes.
+#
+# The tree is grown one node per playout from the position to move in. A
+# node's statistics are from the point of view of the player whose move
+# led to it: visits, and wins (a draw counts as half a win). Moves are
+# chosen down the tree by UCT (mean result plus exploration * sqrt(ln
+# parent visits / visits)), until a node with untried moves is reached;
+# one of them is added to the tree and played out randomly to the end of
+# the game, and the result is added to every node on the path. The move
+# played is the root's most visited child.
+#
+# With workers, the tree is kept in this process and the playouts are
+# sent to a pool of processes, so they don't take turns holding the GIL.
+# Several playouts are in flight at once, so while a path waits for its
+# result it carries a virtual loss: each of its nodes counts extra visits
+# that weren't won, which steers the next selections onto other branches.
+# The virtual loss is taken off when the result comes back. A worker gets
+# the root position (as in positions.py), the moves to the new node and a
+# seed drawn from the game's random stream, and plays batch playouts from
+# there. Results are added to the tree in the order the paths were sent,
+# whichever worker finishes first, so a search from a seeded game makes
+# the same choices for any number of workers that keeps the same number
+# of paths in flight (workers * in_flight).
+#
+# Usage: python mcts.py bench <game> [--playouts N] [--workers 1 2 4 ...] [--batch N]
+#        reports the playouts per second of a search for each number of workers.
+# As a player: 't <playouts> [<workers>]', e.g. python play_games.py Othello 't 2000 4' 'm 2 b'
+
+import argparse
+import collections
+import concurrent.futures
+import math
+import os
+import time
+
+
+class Node:
+    def __init__(self, move, parent, player, moves):
+        self.move = move
+        self.parent = parent
+        # the player who made the move leading here
+        self.player = player
+        self.children = []
+        # moves not yet added to the tree
+        self.untried = moves
+        self.visits = 0
+        self.wins = 0.0
+        self.virtual = 0
+
+
+    def uct_child(self, exploration):
+        log_visits = math.log(self.visits + self.virtual)
+        best = None
+        best_value = None
+        for child in self.children:
+            visits = child.visits + child.virtual
+            value = child.wins/visits + exploration*math.sqrt(log_visits/visits)
+            if best_value is None or value > best_value:
+                best = child
+                best_value = value
+        return best
+
+
+# Play batch random games from the game's position, and undo them.
+# Returns the number won by player 1, won by player 2, and drawn.
+def random_playouts(game, batch):
+    results = [0, 0, 0]
+    for _ in range(batch):
+        made = 0
+        while game.condition == -1:
+            game.make_move(game.random_move())
+            made += 1
+        results[game.condition] += 1
+        for _ in range(made):
+            game.undo_move()
+    return results[1], results[2], results[0]
+
+
+# set in each worker: the root position last seen, and its game
+_root = None
+_game = None
+
+
+def _worker_playouts(root, moves, batch, seed):
+    global _root, _game
+    if root != _root:
+        from positions import decode
+        _game = decode(root)
+        _root = root
+    _game.seed(seed)
+    for move in moves:
+        _game.make_move(move)
+    results = random_playouts(_game, batch)
+    for _ in moves:
+        _game.undo_move()
+    return results
+
+
+class MCTS:
+
+    # workers: playout processes (0 to play them in this process);
+    # batch: playouts per leaf sent to a worker; in_flight: paths waiting
+    # for playouts at once, per worker
+    def __init__(self, workers=0, batch=1, exploration=1.4, in_flight=2):
+        self.workers = workers
+        self.batch = batch
+        self.exploration = exploration
+        self.in_flight = in_flight
+        # started by the first search
+        self.executor = None
+        self.playouts = 0
+
+
+    def start(self):
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+
+
+    # The pool isn't sent to other processes; they start their own
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['executor'] = None
+        return state
+
+
+    # A pass in Othello is a move too, so players always alternate
+    @staticmethod
+    def new_node(game, move, parent, player):
+        moves = game.valid_moves() if game.condition == -1 else []
+        game.rng.shuffle(moves)
+        return Node(move, parent, player, moves)
+
+
+    # Walk down from the root by UCT and add a node. Returns it, with the
+    # moves from the root to it; the game is left in its position.
+    def select(self, game, root):
+        node = root
+        moves = []
+        while not node.untried and node.children:
+            node = node.uct_child(self.exploration)
+            game.make_move(node.move)
+            moves.append(node.move)
+        if node.untried:
+            move = node.untried.pop()
+            mover = game.current_player
+            game.make_move(move)
+            moves.append(move)
+            child = self.new_node(game, move, node, mover)
+            node.children.append(child)
+            node = child
+        return node, moves
+
+
+    @staticmethod
+    def backup(node, x_wins, o_wins, draws, virtual=0):
+        visits = x_wins + o_wins + draws
+        while node is not None:
+            node.visits += visits
+            node.virtual -= virtual
+            if node.player == 1:
+                node.wins += x_wins + 0.5*draws
+            elif node.player == 2:
+                node.wins += o_wins + 0.5*draws
+            node = node.parent
+
+
+    @staticmethod
+    def add_virtual(node, virtual):
+        while node is not None:
+            node.virtual += virtual
+            node = node.parent
+
+
+    @staticmethod
+    def terminal_result(game, batch):
+        results = [0, 0, 0]
+        results[[2, 0, 1][game.condition]] = batch
+        return results
+
+
+    # Search the game's position with num_playouts playouts; returns the root
+    def search(self, game, num_playouts):
+        root = self.new_node(game, None, None, None)
+        done = 0
+        if self.workers == 0:
+            while done < num_playouts:
+                node, moves = self.select(game, root)
+                if game.condition != -1:
+                    results = self.terminal_result(game, self.batch)
+                else:
+                    results = random_playouts(game, self.batch)
+                for _ in moves:
+                    game.undo_move()
+                self.backup(node, *results)
+                done += self.batch
+            self.playouts += done
+            return root
+
+        from positions import encode_text
+        self.start()
+        position = encode_text(game)
+        # (future, node) in the order sent
+        pending = collections.deque()
+        started = 0
+        try:
+            while done < num_playouts:
+                while started < num_playouts and len(pending) < self.workers*self.in_flight:
+                    node, moves = self.select(game, root)
+                    terminal = game.condition != -1
+                    if terminal:
+                        results = self.terminal_result(game, self.batch)
+                    for _ in moves:
+                        game.undo_move()
+                    started += self.batch
+                    if terminal:
+                        self.backup(node, *results)
+                        done += self.batch
+                        continue
+                    # the path counts as lost until its playouts are in
+                    self.add_virtual(node, self.batch)
+                    seed = int(game.rng.random() * 2**63)
+                    future = self.executor.submit(_worker_playouts, position, moves, self.batch, seed)
+                    pending.append((future, node))
+                future, node = pending.popleft()
+                self.backup(node, *future.result(), virtual=self.batch)
+                done += self.batch
+        finally:
+            for future, _ in pending:
+                future.cancel()
+        self.playouts += done
+        return root
+
+
+    # The root's most visited move
+    def best_move(self, game, num_playouts):
+        root = self.search(game, num_playouts)
+        return max(root.children, key=lambda child: child.visits).move
+
+
+
+def bench(game_name, num_playouts, worker_counts, batch, seed):
+    from game_registry import new_game
+    rates = {}
+    for workers in worker_counts:
+        game = new_game(game_name)
+        game.interactive = False
+        game.seed(seed)
+        mcts = MCTS(workers, batch)
+        try:
+            if workers > 0:
+                # start the processes before timing
+                mcts.search(game, workers*batch)
+            start = time.perf_counter()
+            start_cpu = time.process_time()
+            mcts.search(game, num_playouts)
+            elapsed = time.perf_counter() - start
+            tree_cpu = time.process_time() - start_cpu
+        finally:
+            mcts.shutdown()
+        rates[workers] = num_playouts/elapsed
+        base = rates[worker_counts[0]]
+        print(f'{workers:>3} workers: {num_playouts} playouts in {elapsed:.2f} s, '
+              f'{rates[workers]:,.0f} playouts/sec ({rates[workers]/base:.2f}x)', end='')
+        if workers > 0:
+            # the tree is grown in this process however many workers there are,
+            # which limits the speedup with enough CPUs
+            print(f', tree {tree_cpu/elapsed:.0%} of a CPU', end='')
+        print()
+    print(f'({os.cpu_count()} CPUs)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Monte Carlo tree search')
+    sub = parser.add_subparsers(dest='mode', required=True)
+    b = sub.add_parser('bench', help='playouts per second for each number of workers')
+    b.add_argument('game', help="game name, e.g. 'Othello' or 'Connect4'")
+    b.add_argument('--playouts', type=int, default=2000)
+    b.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4],
+                   help='worker processes to try (0 = playouts in this process)')
+    b.add_argument('--batch', type=int, default=4, help='playouts per leaf sent to a worker')
+    b.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    bench(args.game, args.playouts, args.workers, args.batch, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# Pattern evaluation for Othello: the value of a position is the sum of
+# table entries, one for each pattern of squares on the board, as in
+# Logistello and Edax.
+#
+# The patterns are each edge, the row in from each edge, the 3x3 block in
+# each corner and the diagonal from each corner. The squares of a pattern
+# are read as the digits of a base-3 number (0 empty, 1 for player 1,
+# 2 for player 2), which indexes that pattern's table. Edges, rows and
+# corners are read in both directions (and diagonals from both ends), so
+# that the sum is the same for a position and its mirror images. Tables
+# are shared by every pattern of the same kind and length, and there is
+# a separate set of tables for each stage of the game (by disc count).
+#
+# The values predict the result for player 1 like the weights of
+# evaluation.py, and are fitted the same way (tune_eval.py --patterns).
+# They are stored in a binary file: a header followed by the values of
+# every table for each stage as int16, in units of header['unit'].
+
+import numpy as np
+
+from evaluation import SCALE, LIMIT
+
+
+MAGIC = b'OTPT'
+# magic, rows, cols, stages, number of values per stage, value of 1 unit
+HEADER = np.dtype([('magic', 'S4'), ('rows', '<u2'), ('cols', '<u2'),
+                   ('stages', '<u2'), ('pad', '<u2'), ('count', '<u4'), ('unit', '<f4')])
+
+
+# The patterns of an n_rows x n_cols board, as (table name, squares)
+def pattern_instances(n_rows, n_cols):
+    def square(r, c):
+        return r*n_cols + c
+
+    instances = [('bias', ())]
+    corners = [(0, 0, 1, 1), (0, n_cols-1, 1, -1), (n_rows-1, 0, -1, 1), (n_rows-1, n_cols-1, -1, -1)]
+    for r, c, dr, dc in corners:
+        # along the row and down the column from the corner
+        row = tuple(square(r, c + k*dc) for k in range(n_cols))
+        col = tuple(square(r + k*dr, c) for k in range(n_rows))
+        instances += [(f'edge{n_cols}', row), (f'edge{n_rows}', col)]
+        if n_rows >= 4 and n_cols >= 4:
+            instances += [(f'row2_{n_cols}', tuple(square(r + dr, c + k*dc) for k in range(n_cols))),
+                          (f'row2_{n_rows}', tuple(square(r + k*dr, c + dc) for k in range(n_rows)))]
+        block = tuple(square(r + i*dr, c + j*dc) for i in range(3) for j in range(3))
+        transposed = tuple(square(r + j*dr, c + i*dc) for i in range(3) for j in range(3))
+        instances += [('corner', block), ('corner', transposed)]
+        length = min(n_rows, n_cols)
+        instances.append((f'diag{length}', tuple(square(r + k*dr, c + k*dc) for k in range(length))))
+    return instances
+
+
+class PatternSet:
+
+    def __init__(self, n_rows, n_cols, stages=1):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.stages = stages
+        instances = pattern_instances(n_rows, n_cols)
+
+        # offset of each table in the values of a stage
+        self.tables = {}
+        self.count = 0
+        for name, squares in instances:
+            if name not in self.tables:
+                self.tables[name] = self.count
+                self.count += 3**len(squares)
+
+        # instances grouped by length: (squares, powers of 3, table offsets)
+        self.groups = []
+        for length in sorted({len(squares) for _, squares in instances}):
+            group = [(name, squares) for name, squares in instances if len(squares) == length]
+            self.groups.append((np.array([squares for _, squares in group], dtype=np.intp).reshape(len(group), length),
+                                3**np.arange(length, dtype=np.intp),
+                                np.array([self.tables[name] for name, _ in group], dtype=np.intp)))
+
+
+    # Index into the values of a stage of every pattern of the position
+    def indices(self, game):
+        flat = game.board.ravel()
+        indices = []
+        for squares, powers, offsets in self.groups:
+            # 0, 1, -1 -> digits 0, 1, 2
+            digits = flat[squares].astype(np.intp) % 3
+            indices.append(digits @ powers + offsets)
+        return np.concatenate(indices)
+
+
+    def stage(self, game):
+        discs = np.count_nonzero(game.board)
+        return min(self.stages - 1, max(0, discs - 4)*self.stages//(self.n_rows*self.n_cols - 3))
+
+
+class PatternEvaluator(PatternSet):
+
+    def __init__(self, path):
+        header = np.fromfile(path, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise Exception(f'{path} is not an Othello pattern file')
+        super().__init__(int(header['rows']), int(header['cols']), int(header['stages']))
+        if int(header['count']) != self.count:
+            raise Exception(f'{path} does not match the patterns of {self.n_rows}x{self.n_cols} boards')
+        self.path = path
+        values = np.fromfile(path, dtype='<i2', offset=HEADER.itemsize, count=self.stages*self.count)
+        self.values = (values.astype(np.float32)*header['unit']).reshape(self.stages, self.count)
+
+
+    def check(self, game):
+        if type(game).__name__ != 'Othello' or (game.num_rows, game.num_cols) != (self.n_rows, self.n_cols):
+            raise Exception(f'{self.path} is for {self.n_rows}x{self.n_cols} Othello')
+
+
+    def predict(self, game):
+        return float(self.values[self.stage(game)][self.indices(game)].sum())
+
+
+    def score_board(self, game, player):
+        score = min(max(SCALE*self.predict(game), -LIMIT), LIMIT)
+        return score if player == 1 else -score
+
+
+    def __repr__(self):
+        return f'PatternEvaluator({self.path!r})'
+
+
+    def __reduce__(self):
+        from evaluation import load_evaluator
+        return (load_evaluator, (self.path,))
+
+
+    # values: stages x count array of table values
+    @staticmethod
+    def write(path, n_rows, n_cols, values):
+        values = np.asarray(values, dtype=np.float64)
+        unit = max(float(np.abs(values).max()), 1e-9)/32767
+        header = np.array([(MAGIC, n_rows, n_cols, values.shape[0], 0, values.shape[1], unit)], dtype=HEADER)
+        with open(path, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(np.round(values/unit).astype('<i2').tobytes())
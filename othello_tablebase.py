@@ -0,0 +1,400 @@
+#!/usr/bin/python
+
+# Perfect play for Othello on small boards (up to 32 squares, e.g. 4x4),
+# from a table of every position that can come up in a game.
+#
+# Positions are bitboards: square (row, col) is bit row*cols + col, and a
+# position is (mine, theirs), the pieces of the player to move and of their
+# opponent. Its key is mine | theirs << squares. Positions related by a
+# symmetry of the starting position share the key of whichever is least.
+#
+# The value of a position is the final disc difference (mine - theirs)
+# when both players play perfectly from it, so a positive value is a win
+# for the player to move. A player with no valid move passes, and the game
+# ends when neither player can move, as in Othello.
+#
+# The builder enumerates every reachable position, level by level, by
+# number of discs (each move adds one disc; a pass adds none and stays on
+# the same level). Values are then worked out backwards from the fullest
+# level, where each position's children are already solved. Passes are
+# done last on each level, since the position after a pass is on the same
+# level and has a move.
+#
+# The table file is a header, then an open addressing hash table of the
+# keys (uint64, 0 for an empty slot), the values (int8) and the best move
+# of each position (uint8, the square in the position's least orientation,
+# or NO_MOVE for a pass). It is memory-mapped, and finding a position's
+# value or best move takes one hash and a probe or two. Build one with
+#     python othello_tablebase.py build --rows 4 --cols 4
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+from board_games import BoardGeometry, dihedral_symmetries
+
+
+MAGIC = b'OTTB'
+# magic, rows, cols, number of positions, number of slots
+HEADER = np.dtype([('magic', 'S4'), ('rows', '<u2'), ('cols', '<u2'),
+                   ('count', '<u8'), ('slots', '<u8')])
+
+NO_MOVE = 255
+
+# Fibonacci hashing: the top bits of key*HASH_MULTIPLIER pick the slot
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+MASK64 = (1 << 64) - 1
+
+
+def default_path(rows, cols):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f'othello_{rows}x{cols}.ottb')
+
+
+# Move generation, flips and symmetries for one board size
+class Bitboards:
+
+    def __init__(self, rows, cols):
+        if rows*cols > 32:
+            raise Exception(f'{rows}x{cols} is too large for an Othello tablebase')
+        self.rows = rows
+        self.cols = cols
+        self.squares = rows*cols
+        self.full = (1 << self.squares) - 1
+        first_col = sum(1 << (r*cols) for r in range(rows))
+        last_col = first_col << (cols - 1)
+        # (shift, squares a piece can land on without wrapping around a
+        # row) for each direction
+        self.shifts = []
+        for dr, dc in BoardGeometry.DIRECTIONS:
+            mask = self.full
+            if dc == 1:
+                mask &= ~first_col
+            elif dc == -1:
+                mask &= ~last_col
+            self.shifts.append((dr*cols + dc, mask))
+        self.max_run = max(rows, cols) - 2
+
+        r = rows//2
+        c = cols//2
+        # player 1 moves first
+        self.start = ((1 << ((r-1)*cols + c)) | (1 << (r*cols + c-1)),
+                      (1 << (r*cols + c)) | (1 << ((r-1)*cols + c-1)))
+
+        # The symmetries preserving the starting position, as the square
+        # each square goes to, and tables mapping each byte of a key to its
+        # image under the symmetry
+        self.symmetries = []
+        for sym in dihedral_symmetries(rows, cols):
+            perm = [self.transform(i, sym) for i in range(self.squares)]
+            if self.permute(self.start[0], perm) == self.start[0] and \
+               self.permute(self.start[1], perm) == self.start[1]:
+                self.symmetries.append(perm)
+        self.key_tables = []
+        for perm in self.symmetries:
+            both = perm + [self.squares + i for i in perm]
+            tables = []
+            for shift in range(0, 2*self.squares, 8):
+                table = []
+                for byte in range(256):
+                    bits = 0
+                    for k in range(8):
+                        if byte >> k & 1 and shift + k < 2*self.squares:
+                            bits |= 1 << both[shift + k]
+                    table.append(bits)
+                tables.append((shift, table))
+            self.key_tables.append(tables)
+
+
+    # Square i under a symmetry (transpose, flip_rows, flip_cols)
+    def transform(self, i, sym):
+        transpose, flip_rows, flip_cols = sym
+        row, col = divmod(i, self.cols)
+        if flip_rows:
+            row = self.rows - 1 - row
+        if flip_cols:
+            col = self.cols - 1 - col
+        if transpose:
+            row, col = col, row
+        return row*self.cols + col
+
+
+    @staticmethod
+    def permute(bits, perm):
+        result = 0
+        for i, j in enumerate(perm):
+            if bits >> i & 1:
+                result |= 1 << j
+        return result
+
+
+    def key(self, mine, theirs):
+        return mine | theirs << self.squares
+
+
+    # The least key of the position's symmetric images, and the
+    # symmetry giving it
+    def canonical(self, mine, theirs):
+        key = mine | theirs << self.squares
+        best = None
+        for n, tables in enumerate(self.key_tables):
+            image = 0
+            for shift, table in tables:
+                image |= table[key >> shift & 255]
+            if best is None or image < best[0]:
+                best = (image, n)
+        return best
+
+
+    def position(self, key):
+        return key & self.full, key >> self.squares
+
+
+    def shift(self, bits, step, mask):
+        if step > 0:
+            return (bits << step) & mask
+        return (bits >> -step) & mask
+
+
+    # Bitboard of the valid moves of the player to move
+    def moves(self, mine, theirs):
+        empty = ~(mine | theirs) & self.full
+        legal = 0
+        for step, mask in self.shifts:
+            run = self.shift(mine, step, mask) & theirs
+            for _ in range(self.max_run - 1):
+                run |= self.shift(run, step, mask) & theirs
+            legal |= self.shift(run, step, mask) & empty
+        return legal
+
+
+    # Discs flipped by a move (a single bit)
+    def flips(self, move, mine, theirs):
+        flipped = 0
+        for step, mask in self.shifts:
+            run = self.shift(move, step, mask) & theirs
+            for _ in range(self.max_run - 1):
+                run |= self.shift(run, step, mask) & theirs
+            if self.shift(run, step, mask) & mine:
+                flipped |= run
+        return flipped
+
+
+    # The position after a move, from the opponent's point of view
+    def play(self, move, mine, theirs):
+        flipped = self.flips(move, mine, theirs)
+        return theirs & ~flipped, mine | flipped | move
+
+
+    # Bitboards of an Othello game's position
+    def from_game(self, game):
+        flat = game.board.ravel()
+        piece = game.get_piece()
+        mine = sum(1 << int(i) for i in np.flatnonzero(flat == piece))
+        theirs = sum(1 << int(i) for i in np.flatnonzero(flat == -piece))
+        return mine, theirs
+
+
+
+class Tablebase:
+
+    def __init__(self, path):
+        header = np.fromfile(path, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC:
+            raise Exception(f'{path} is not an Othello tablebase')
+        self.path = path
+        self.boards = Bitboards(int(header['rows']), int(header['cols']))
+        self.count = int(header['count'])
+        slots = int(header['slots'])
+        self.bits = slots.bit_length() - 1
+        offset = HEADER.itemsize
+        self.keys = np.memmap(path, dtype='<u8', mode='r', offset=offset, shape=(slots,))
+        self.values = np.memmap(path, dtype=np.int8, mode='r', offset=offset + 8*slots, shape=(slots,))
+        self.best = np.memmap(path, dtype=np.uint8, mode='r', offset=offset + 9*slots, shape=(slots,))
+
+
+    def __len__(self):
+        return self.count
+
+
+    # Memory-mapped again in other processes
+    def __reduce__(self):
+        return (Tablebase, (self.path,))
+
+
+    @staticmethod
+    def first_slot(key, bits):
+        return ((key*HASH_MULTIPLIER) & MASK64) >> (64 - bits)
+
+
+    # Slot of a canonical key, or None if it isn't in the table
+    def find(self, key):
+        mask = (1 << self.bits) - 1
+        slot = self.first_slot(key, self.bits)
+        while True:
+            found = int(self.keys[slot])
+            if found == key:
+                return slot
+            if found == 0:
+                return None
+            slot = (slot + 1) & mask
+
+
+    def value(self, mine, theirs):
+        slot = self.find(self.boards.canonical(mine, theirs)[0])
+        if slot is None:
+            raise Exception('Position not in the tablebase')
+        return int(self.values[slot])
+
+
+    # A best move, as a square, or None to pass
+    def best_move(self, mine, theirs):
+        key, n = self.boards.canonical(mine, theirs)
+        slot = self.find(key)
+        if slot is None:
+            raise Exception('Position not in the tablebase')
+        square = int(self.best[slot])
+        if square == NO_MOVE:
+            return None
+        return self.boards.symmetries[n].index(square)
+
+
+    # positions: {canonical key: (value, best square or NO_MOVE)}
+    @staticmethod
+    def write(path, rows, cols, positions):
+        slots = 1 << max(4, (2*len(positions) - 1).bit_length())
+        bits = slots.bit_length() - 1
+        keys = np.zeros(slots, dtype='<u8')
+        values = np.zeros(slots, dtype=np.int8)
+        best = np.zeros(slots, dtype=np.uint8)
+        for key, (value, move) in positions.items():
+            slot = Tablebase.first_slot(key, bits)
+            while keys[slot] != 0:
+                slot = (slot + 1) & (slots - 1)
+            keys[slot] = key
+            values[slot] = value
+            best[slot] = move
+        header = np.array([(MAGIC, rows, cols, len(positions), slots)], dtype=HEADER)
+        with open(path, 'wb') as f:
+            f.write(header.tobytes())
+            f.write(keys.tobytes())
+            f.write(values.tobytes())
+            f.write(best.tobytes())
+
+
+
+# Every reachable position, by number of discs: a list of sets of
+# canonical keys, with games over included
+def enumerate_positions(boards):
+    levels = [set() for _ in range(boards.squares + 1)]
+    levels[4].add(boards.canonical(*boards.start)[0])
+    for discs in range(4, boards.squares + 1):
+        pending = list(levels[discs])
+        while pending:
+            mine, theirs = boards.position(pending.pop())
+            moves = boards.moves(mine, theirs)
+            if moves:
+                while moves:
+                    move = moves & -moves
+                    moves ^= move
+                    child = boards.canonical(*boards.play(move, mine, theirs))[0]
+                    levels[discs + 1].add(child)
+            elif boards.moves(theirs, mine):
+                child = boards.canonical(theirs, mine)[0]
+                if child not in levels[discs]:
+                    levels[discs].add(child)
+                    pending.append(child)
+    return levels
+
+
+def solve(boards, levels):
+    positions = {}
+    for discs in range(boards.squares, 3, -1):
+        passes = []
+        for key in levels[discs]:
+            mine, theirs = boards.position(key)
+            moves = boards.moves(mine, theirs)
+            if moves:
+                best = None
+                while moves:
+                    move = moves & -moves
+                    moves ^= move
+                    child = boards.canonical(*boards.play(move, mine, theirs))[0]
+                    value = -positions[child][0]
+                    if best is None or value > best[0]:
+                        best = (value, move.bit_length() - 1)
+                positions[key] = best
+            elif boards.moves(theirs, mine):
+                passes.append(key)
+            else:
+                positions[key] = (mine.bit_count() - theirs.bit_count(), NO_MOVE)
+        for key in passes:
+            mine, theirs = boards.position(key)
+            positions[key] = (-positions[boards.canonical(theirs, mine)[0]][0], NO_MOVE)
+    return positions
+
+
+# The moves of a game between two perfect players, and its final position
+# from player 1's point of view
+def perfect_game(table):
+    boards = table.boards
+    mine, theirs = boards.start
+    player = 1
+    moves = []
+    while boards.moves(mine, theirs) or boards.moves(theirs, mine):
+        square = table.best_move(mine, theirs)
+        moves.append(square)
+        if square is None:
+            mine, theirs = theirs, mine
+        else:
+            mine, theirs = boards.play(1 << square, mine, theirs)
+        player = 3 - player
+    if player == 2:
+        mine, theirs = theirs, mine
+    return moves, mine, theirs
+
+
+def build(rows, cols, path):
+    boards = Bitboards(rows, cols)
+    start = time.time()
+    levels = enumerate_positions(boards)
+    print(f'{sum(len(level) for level in levels)} positions (up to symmetry) in {time.time()-start:.1f} s')
+    positions = solve(boards, levels)
+    Tablebase.write(path, rows, cols, positions)
+    print(f'Wrote {len(positions)} positions to {path} in {time.time()-start:.1f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Othello tablebase for small boards')
+    sub = parser.add_subparsers(dest='mode', required=True)
+
+    b = sub.add_parser('build', help='solve every reachable position into a table file')
+    b.add_argument('--rows', type=int, default=4)
+    b.add_argument('--cols', type=int, default=4)
+    b.add_argument('--out', help='table file (default: next to this module)')
+
+    s = sub.add_parser('show', help='the result and moves of perfect play')
+    s.add_argument('--rows', type=int, default=4)
+    s.add_argument('--cols', type=int, default=4)
+    s.add_argument('--table', help='table file')
+
+    args = parser.parse_args()
+    path = args.out if args.mode == 'build' else args.table
+    path = path or default_path(args.rows, args.cols)
+    if args.mode == 'build':
+        build(args.rows, args.cols, path)
+
+    table = Tablebase(path)
+    moves, x_bits, o_bits = perfect_game(table)
+    names = ['pass' if move is None else chr(move//table.boards.cols + ord('a')) + str(move % table.boards.cols + 1)
+             for move in moves]
+    x = x_bits.bit_count()
+    o = o_bits.bit_count()
+    winner = 'player 1 wins' if x > o else 'player 2 wins' if o > x else 'a draw'
+    print(f'{table.boards.rows}x{table.boards.cols}: {len(table)} positions, perfect play is {winner} {x}-{o}')
+    print('\t' + ' '.join(names))
+
+
+if __name__ == "__main__":
+    main()
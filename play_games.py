@@ -2,7 +2,7 @@
 
 
 import sys
-from board_games import *
+from game_registry import game_names, game_factory, new_game, parse_player
 
 
 game_lst = []
@@ -13,29 +13,51 @@ class GameWrapper:
         self.obj = o
 
 def load_games():
-    # Load all the games
-    game_lst.append(GameWrapper('Tic-Tac-Toe', TicTacToe))
-    game_lst.append(GameWrapper('Connect4', Connect_X))
-    game_lst.append(GameWrapper('Othello', Othello))
+    # List all the games; each is only imported once it is created
+    for name in game_names():
+        game_lst.append(GameWrapper(name, game_factory(name)))
 
 
-def play_game(game, interactive = True):
+# With a GameProfiler, every move is measured (see profiling.py)
+def play_game(game, interactive = True, ponder = False, profiler = None):
     game.current_player = 1
     game.interactive = interactive
-    
-    while (game.condition == -1):
-        if interactive:
-            game.display_board()
-
-        # Get a move from the player and ensure it is valid
-        valid_move = False        
-        while (not valid_move):
-            move = game.get_move()
-            valid_move = game.is_valid(move)
-
-        # Make the move
-        game.make_move(move)
-        
+    if profiler is not None:
+        profiler.new_game()
+
+    # Think on the opponent's time, unless play_many_games already set this up
+    own_ponderer = ponder and game.ponderer is None
+    if own_ponderer:
+        game.ponderer = make_ponderer(game)
+
+    try:
+        while (game.condition == -1):
+            if interactive:
+                game.display_board()
+
+            if game.ponderer is not None:
+                game.ponderer.start(game)
+
+            # Get a move from the player and ensure it is valid
+            valid_move = False
+            while (not valid_move):
+                if profiler is None:
+                    move = game.get_move()
+                else:
+                    move = profiler.get_move(game)
+                valid_move = game.is_valid(move)
+
+            # Make the move
+            game.make_move(move)
+    finally:
+        if own_ponderer:
+            game.ponderer.shutdown()
+            game.ponderer = None
+        elif game.ponderer is not None:
+            game.ponderer.clear()
+        # a process playing games can't exit while they are still running
+        game.stop_tree_searches()
+
     if interactive:
         game.display_board()
         if (game.condition != 0):
@@ -47,31 +69,87 @@ def play_game(game, interactive = True):
     return game.condition
 
 
-def play_many_games(num_games, game, interactive = True):
+# With an SPRT (see sprt.py), the games stop as soon as the test decides
+# whether player 1 is stronger. Games are always counted in order, so a
+# parallel run stops after the same games as a sequential one.
+def play_many_games(num_games, game, interactive = True, ponder = False, seed = None, workers = 1, sprt = None,
+                    profiler = None):
     player1_wins = 0
     player2_wins = 0
     draws = 0
-    for counter in range(num_games):
-        game.reset()
-        result = play_game(game, interactive)
-        if result == 1:
-            player1_wins += 1
-        elif result == 2:
-            player2_wins += 1
-        else:
-            draws += 1
-            
-        if not interactive:
-            print(f'Played {counter} / {num_games} games. Stats: {player1_wins}/{player2_wins}/{draws} ')
+    # Without a seed, the run still gets a master seed of its own: a game
+    # sent to a worker process takes its random stream with it, so every
+    # game would otherwise make the same choices
+    if seed is None:
+        import secrets
+        seed = secrets.randbits(128)
+    # a profile is only taken of the games played in this process
+    if workers > 1 and profiler is None:
+        # games are independent, so each can be played in any process
+        # (pondering only applies when they are played one at a time)
+        import concurrent.futures
+        import itertools
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(play_seeded_game, itertools.repeat(game), itertools.repeat(seed), range(num_games))
+        ponder = False
+    else:
+        executor = None
+        results = (play_seeded_game(game, seed, counter, interactive, profiler) for counter in range(num_games))
+    # share one pool of pondering workers between all the games
+    if ponder:
+        game.ponderer = make_ponderer(game)
+    try:
+        for counter, result in enumerate(results):
+            if result == 1:
+                player1_wins += 1
+            elif result == 2:
+                player2_wins += 1
+            else:
+                draws += 1
+
+            if not interactive:
+                print(f'Played {counter} / {num_games} games. Stats: {player1_wins}/{player2_wins}/{draws} ')
+
+            if sprt is not None:
+                sprt.add(result)
+                if sprt.status() is not None:
+                    break
+    finally:
+        if ponder:
+            game.ponderer.shutdown()
+            game.ponderer = None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
             
-    print(f'In {num_games} games:')
+    print(f'In {player1_wins + player2_wins + draws} games:')
     print(f'\tPlayer 1: {player1_wins} wins')
     print(f'\tPlayer 2: {player2_wins} wins')
     print(f'\t{draws} draws')
+    if sprt is not None:
+        print(sprt.summary(num_games))
+
 
+# Play game number index of a run. With a seed, each game's random choices
+# depend only on the seed and index, so a run gives the same results
+# however many processes play it.
+def play_seeded_game(game, seed, index, interactive = False, profiler = None):
+    game.reset()
+    if seed is not None:
+        from board_games import game_seed
+        game.seed(game_seed(seed, index))
+    return play_game(game, interactive, profiler=profiler)
 
 
 
+
+# Pondering runs in a thread while a human types a move,
+# and in separate processes when two computers play
+def make_ponderer(game):
+    from ponder import Ponderer
+    human = any(options[0] == 'h' for options in game.player_options)
+    return Ponderer(processes=not human)
+
+
 def console_main():
     load_games()    
     game_choice = select_game()
@@ -84,6 +162,11 @@ def console_main():
         num_plays_str = input("You have selected two computers.\nHow many games do you want them to play? [default=1] ").strip()
         if num_plays_str.isdigit():
             num_plays = int(num_plays_str)
+
+    ponder = False
+    if player1[0] == 'm' or player2[0] == 'm':
+        ponder_str = input("Should Minimax think during its opponent's turn? [y/N] ").strip().lower()
+        ponder = ponder_str == 'y'
                 
     # Create a game object
     game = game_choice.obj()
@@ -92,9 +175,9 @@ def console_main():
     game.configure_player(2, player2)
 
     if num_plays == 1:
-        play_game(game, True)
+        play_game(game, True, ponder)
     else:
-        play_many_games(num_plays, game, True)
+        play_many_games(num_plays, game, True, ponder)
 
 
 def select_game():
@@ -134,21 +217,30 @@ def configure_player(n):
     print("\nThe Minimax player will play to a certain depth (d), after which " +
           "it will either evaluate the board using (b) a built-in scoring method or " +
           "by randomly sampling (r) the rest of the game tree. For random sampling, " +
-          "you can set the number of samples and the depth of the sampling.\n")
+          "you can set the number of samples and the depth of the sampling. " +
+          "Weights fitted by tune_eval.py can also score the board (e <file>).\n")
     
-    print("To change settings, enter e.g. 'd 10', 'b', or 'r 3 4' or press enter to continue.")
+    print("To change settings, enter e.g. 'd 10', 'b', 'r 3 4' or 'e weights.json' or press enter to continue.")
 
     mdepth = 2
     mscoring = 'b'
     mrandom_n = 10
     mrandom_depth = 10
+    mweights = None
 
     while (True):
         if mscoring == 'b':
             print(f'\nCurrent minimax settings: Depth = {mdepth}, Scoring = {mscoring}')
+        elif mscoring == 'e':
+            print(f'\nCurrent minimax settings: Depth = {mdepth}, Scoring = {mscoring} {mweights}')
         else:
             print(f'\nCurrent minimax settings: Depth = {mdepth}, Scoring = {mscoring} {mrandom_n} {mrandom_depth}')
-        input_str = input().strip().lower()
+        input_str = input().strip()
+        if input_str[:2] == 'e ':
+            mscoring = 'e'
+            mweights = input_str[2:].strip()
+            continue
+        input_str = input_str.lower()
         if len(input_str) == 0:
             break
         if input_str[0] == 'd':
@@ -167,110 +259,212 @@ def configure_player(n):
 
     comp.append(mdepth)
     comp.append(mscoring)
+    if mscoring == 'e':
+        comp.append(mweights)
+        return comp
     comp.append(mrandom_n)
     comp.append(mrandom_depth)
     return comp
 
 
 def commandline_main():
+    if sys.argv[1] == 'batch':
+        batch_main()
+        return
     try:
-        lst = sys.argv.copy()
-        lst.reverse()
-        lst.pop()
-        
-        arg1 = lst.pop()
-        if arg1.isdigit():
-            num_plays = int(arg1)
-            game_name = lst.pop()
-        else:
-            num_plays = 1
-            game_name = arg1
+        run_commandline(sys.argv[1:])
+    except Exception as e:
+        print(f'Error: {e}')
+        print_usage()
+
+
+# Run many games in one process, to avoid paying for start-up each time.
+# Each line of stdin holds the arguments of one command line.
+def batch_main():
+    for line in sys.stdin:
+        args = line.split()
+        if len(args) == 0 or args[0].startswith('#'):
+            continue
+        try:
+            run_commandline(args)
+        except Exception as e:
+            print(f'Error in {line.strip()!r}: {e}')
+        sys.stdout.flush()
 
-        game = parse_game(game_name)
-        player1 = parse_player(lst)
-        player2 = parse_player(lst)
-        
-        if (len(lst) == 0):
-            iactive = True
-        else:
+
+def run_commandline(args):
+    lst = list(args)
+    lst.reverse()
+
+    arg1 = lst.pop()
+    if arg1.isdigit():
+        num_plays = int(arg1)
+        game_name = lst.pop()
+    else:
+        num_plays = 1
+        game_name = arg1
+
+    game = parse_game(game_name)
+    player1 = parse_player(lst)
+    player2 = parse_player(lst)
+
+    iactive = True
+    ponder = False
+    search_memory = game.search_memory
+    keep_search = False
+    shared_entries = 0
+    cache_entries = 0
+    cache_precision = None
+    seed = None
+    workers = 1
+    sprt = None
+    profile_path = None
+    while (len(lst) != 0):
+        arg = lst.pop()
+        if arg == 'hide':
+            iactive = False
+        elif arg == 'ponder':
+            ponder = True
+        elif arg == 'memory':
             arg = lst.pop()
-            if arg == 'hide':
-                iactive = False
-            else:
+            if not arg.isdigit():
                 raise Exception
-
-        if (len(lst) != 0):
+            search_memory = int(arg)
+        elif arg == 'keep':
+            keep_search = True
+        elif arg == 'padded':
+            game.configure_board(True)
+        elif arg == 'near':
+            arg = lst.pop()
+            if not arg.isdigit():
+                raise Exception
+            game.configure_candidate_moves(int(arg))
+        elif arg == 'share':
+            arg = lst.pop()
+            if not arg.isdigit():
+                raise Exception
+            shared_entries = int(arg)
+        elif arg == 'mccache':
+            arg = lst.pop()
+            if not arg.isdigit():
+                raise Exception
+            cache_entries = int(arg)
+            # the precision is optional
+            if len(lst) >= 1 and is_number(lst[-1]):
+                cache_precision = float(lst.pop())
+        elif arg == 'seed':
+            arg = lst.pop()
+            if not arg.isdigit():
+                raise Exception
+            seed = int(arg)
+        elif arg == 'workers':
+            arg = lst.pop()
+            if not arg.isdigit():
+                raise Exception
+            workers = int(arg)
+        elif arg == 'sprt':
+            from sprt import SPRT
+            bounds = [float(lst.pop()), float(lst.pop())]
+            # alpha and beta are optional
+            if len(lst) >= 2 and is_number(lst[-1]):
+                bounds += [float(lst.pop()), float(lst.pop())]
+            sprt = SPRT(*bounds)
+        elif arg == 'profile':
+            profile_path = lst.pop()
+        else:
             raise Exception
 
-        game.configure_player(1, player1)
-        game.configure_player(2, player2)
-    
+    game.configure_search_memory(search_memory, keep_search)
+    game.configure_eval_cache(cache_entries, cache_precision)
+    game.configure_player(1, player1)
+    game.configure_player(2, player2)
+
+    if profile_path is not None:
+        if ponder or any(options[0] == 't' and options[2] > 0 for options in (player1, player2)):
+            print("Note: 'profile' only measures this process; the work of pondering and playout "
+                  "workers is only in the wall times")
+
+    table = None
+    if shared_entries > 0:
+        from shared_table import SharedTable
+        table = SharedTable(shared_entries)
+        game.configure_shared_table(table)
+        if seed is not None and (workers > 1 or ponder):
+            print("Note: with 'share', games see what other processes stored, so a seeded run "
+                  "is not repeatable with 'workers' or 'ponder'")
+
+    # started only now, since it traces memory until it is closed
+    profiler = None
+    try:
+        if profile_path is not None:
+            from profiling import GameProfiler
+            profiler = GameProfiler(profile_path)
         if num_plays == 1:
-            play_game(game, iactive)
+            if seed is not None:
+                game.seed(seed)
+            play_game(game, iactive, ponder, profiler)
         else:
-            play_many_games(num_plays, game, iactive)
-
-    #print(player1)
-    except Exception:
-        print("Usage: python play_game.py <name> <player1> <player2>")
-        print("       python play_game.py <num_plays> <name> <player1> <player2>")
-        print("       python play_game.py <num_plays> <name> <player1> <player2> hide")
-        print("")
-        print("\t <name> = 'Tic-Tac-Toe', 'Connect4', or 'Othello'")
-        print("\t <player> = 'h', 'r', 'm 2 b', or 'm 2 r 5 2' (for example)")
+            play_many_games(num_plays, game, iactive, ponder, seed, workers, sprt, profiler)
+    finally:
+        if table is not None:
+            stats = table.stats()
+            print(f"Shared table: {stats['hits']} hits in {stats['probes']} probes "
+                  f"({100*stats['hit_rate']:.1f}%), {100*stats['used']:.1f}% full")
+            game.configure_shared_table(None)
+            table.close()
+        if game.eval_cache is not None:
+            stats = game.eval_cache.stats()
+            print(f"Playout cache: {stats['playouts']} playouts for {stats['queries']} leaves, "
+                  f"{stats['hits']} answered without new playouts, {stats['entries']} positions kept")
+        if profiler is not None:
+            profiler.close()
+            print(profiler.report())
+
+
+def is_number(arg):
+    try:
+        float(arg)
+        return True
+    except ValueError:
+        return False
+
+
+def print_usage():
+    print("Usage: python play_game.py <name> <player1> <player2>")
+    print("       python play_game.py <num_plays> <name> <player1> <player2>")
+    print("       python play_game.py <num_plays> <name> <player1> <player2> [hide] [ponder] [memory <n>] [keep] [near <r>] [share <n>] [mccache <n> [<precision>]] [seed <n>] [workers <n>] [padded] [sprt <elo0> <elo1> [<alpha> <beta>]] [profile <file>]")
+    print("       python play_game.py batch < file_of_command_lines")
+    print("")
+    print("\t <name> = " + ", ".join(f"'{name}'" for name in game_names()))
+    print("\t          optionally with a size, e.g. 'Tic-Tac-Toe:15x15x5' or 'Othello:6x6'")
+    print("\t <player> = 'h', 'r', 'm 2 b', or 'm 2 r 5 2' (for example)")
+    print("\t            or 's' for perfect play (Connect4, see connect4_solver.py,")
+    print("\t            or small Othello boards, see othello_tablebase.py)")
+    print("\t            or 'm 2 e <file>' to score with weights fitted by tune_eval.py")
+    print("\t            or 'm 2 h 5 2' to share the playouts of 'm 2 r 5 2' between the moves")
+    print("\t            by sequential halving, most going to the best moves")
+    print("\t            or 't 2000' for Monte Carlo tree search with 2000 playouts a move,")
+    print("\t            't 2000 4' to play them in 4 processes (see mcts.py)")
+    print("\t 'hide' suppresses the board, 'ponder' lets Minimax think on its opponent's time")
+    print("\t 'memory <n>' sets how many positions Minimax remembers between moves (none by default,")
+    print("\t 200000 is a good size), 'keep' remembers them from one game to the next")
+    print("\t 'near <r>' only searches moves within r squares of a piece, plus forced moves")
+    print("\t (Tic-Tac-Toe and Connect4, for large boards)")
+    print("\t 'share <n>' keeps n Minimax positions in shared memory, seen by pondering processes")
+    print("\t (and other games, so a seeded run with it depends on how the games are spread out)")
+    print("\t 'mccache <n>' keeps the random playouts of 'm 2 r' players for n positions, adding")
+    print("\t to them only as needed (to the sample count, or a standard error of precision)")
+    print("\t 'seed <n>' makes the computer players' random choices repeatable,")
+    print("\t 'workers <n>' plays the games in n processes (same results for the same seed)")
+    print("\t 'padded' stores the board in a flat array with a border (faster move generation)")
+    print("\t 'sprt <elo0> <elo1>' stops once it is clear whether player 1 is elo0 or elo1 Elo stronger")
+    print("\t (with error rates alpha and beta, 0.05 by default)")
+    print("\t 'profile <file>' measures the CPU and memory of each move (in this process, ignoring 'workers'),")
+    print("\t writing cProfile statistics to file and the moves to file.moves.csv (see profiling.py)")
     
     
 def parse_game(game_name):
-    if game_name == 'Tic-Tac-Toe':
-        return TicTacToe()
-    elif game_name == 'Connect4':
-        return Connect_X()
-    elif game_name == 'Othello':
-        return Othello()
-    else:
-        raise Exception
-
-    
-def parse_player(lst):
-    char = lst.pop()
-    if char == 'h':
-        return ['h']
-    elif char == 'r':
-        return ['r']
-    elif char == 'm':
-        comp = ['m']
-        mdepth = lst.pop()
-        if mdepth.isdigit():
-            comp.append(int(mdepth))
-        else:
-            # exception
-            raise Exception
-        
-        mscoring = lst.pop()
-        if mscoring == 'b':
-            comp.append('b')
-            return comp
-        elif mscoring  == 'r':
-            comp.append('r')
-            mrandom_n = lst.pop()
-            if mrandom_n.isdigit():
-                comp.append(int(mrandom_n))
-            else:
-                #exception
-                raise Exception
-            mrandom_depth = lst.pop()
-            if mrandom_depth.isdigit():
-                comp.append(int(mrandom_depth))
-                return comp
-            else:
-                #exception
-                raise Exception
-        else:
-            # exception
-            raise Exception
-    else:
-        # exception
-        raise Exception
+    return new_game(game_name)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,136 @@
+import concurrent.futures
+import multiprocessing
+import os
+
+from board_games import SearchAborted
+
+
+# Each pondering search gets a slot in a shared array of cancel flags.
+# Slots are reused round robin, so this only needs to exceed the number
+# of searches that can be outstanding at once.
+CANCEL_SLOTS = 4096
+
+# cancel flags inherited by worker processes
+_worker_flags = None
+
+
+def _init_worker(flags):
+    global _worker_flags
+    _worker_flags = flags
+
+
+# Search a position in a worker, giving up as soon as its flag is set.
+# Returns None if the search was cancelled.
+def _ponder_search(game, args, slot, flags=None):
+    if flags is None:
+        flags = _worker_flags
+    game.search_abort = lambda: flags[slot]
+    # the player's context, which has the game's SharedTable if it has one
+    context = game.contexts[game.current_player-1]
+    try:
+        return [game.get_move_minimax(*args, context=context)]
+    except SearchAborted:
+        return None
+
+
+class Ponderer:
+
+    # While one player is thinking, search the other player's reply to
+    # each of its possible moves in the background.
+    #
+    # Against a human, a thread is enough since input() releases the GIL.
+    # Between two computer players, searches run in separate processes.
+    def __init__(self, processes=False, workers=None):
+        self.processes = processes
+        if processes:
+            if workers is None:
+                workers = max(1, (os.cpu_count() or 2) - 1)
+            self.flags = multiprocessing.Array('b', CANCEL_SLOTS, lock=False)
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(self.flags,))
+        else:
+            if workers is None:
+                workers = 1
+            self.flags = bytearray(CANCEL_SLOTS)
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        # (move counter, position key, minimax args) -> (future, slot)
+        self.pending = {}
+        self.next_slot = 0
+
+        # how often a search was answered from pondering
+        self.hits = 0
+        self.misses = 0
+
+
+    # Start searching the replies to every move the current player could make
+    def start(self, game):
+        opponent = 2 if game.current_player == 1 else 1
+        options = game.player_options[opponent-1]
+        if options[0] != 'm':
+            return
+        args = game.minimax_args(options)
+
+        # Guess that the current player picks the move that looks best to
+        # them right away, and search the replies to it first
+        replies = []
+        for move in game.valid_moves():
+            child = game.clone()
+            child.interactive = False
+            child.ponderer = None
+            child.make_move(move)
+            if child.condition != -1:
+                continue
+            replies.append((-child.score_board(game.current_player), child))
+        replies.sort(key=lambda x: x[0])
+
+        for _, child in replies:
+            key = (child.counter, child.position_key(), args)
+            if key in self.pending:
+                continue
+            slot = self.next_slot
+            self.next_slot = (self.next_slot + 1) % CANCEL_SLOTS
+            self.flags[slot] = 0
+            if self.processes:
+                future = self.executor.submit(_ponder_search, child, args, slot)
+            else:
+                future = self.executor.submit(_ponder_search, child, args, slot, self.flags)
+            self.pending[key] = (future, slot)
+
+
+    # Look for a pondered search of the current position.
+    # Searches of positions that can no longer occur are cancelled.
+    # Returns (True, move) if one was found, otherwise (False, None).
+    def take(self, game, args):
+        found = self.pending.pop((game.counter, game.position_key(), tuple(args)), None)
+        for key in list(self.pending):
+            if key[0] <= game.counter:
+                self.__cancel(key)
+
+        if found is not None:
+            future = found[0]
+            # a search that has not started yet saves nothing
+            if not future.cancel():
+                result = future.result()
+                if result is not None:
+                    self.hits += 1
+                    return True, result[0]
+        self.misses += 1
+        return False, None
+
+
+    # Cancel everything, e.g. at the end of a game
+    def clear(self):
+        for key in list(self.pending):
+            self.__cancel(key)
+
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=True)
+
+
+    def __cancel(self, key):
+        future, slot = self.pending.pop(key)
+        if not future.cancel():
+            self.flags[slot] = 1
@@ -0,0 +1,168 @@
+# Compact, round-trippable encodings of a game position
+# (board, player to move, and for Othello the number of passes).
+#
+# Text:   <game> <rows>x<cols>[x<connect>] <board> <player> [<passes>]
+#         e.g. 'Othello 8x8 8/8/8/3OX3/3XO3/8/8/8 X 0'
+#         The board lists the rows from the top separated by '/', with X and
+#         O for pieces and a number for each run of empty squares.
+#
+# Binary: 5 header bytes (game id, rows, cols, connect, flags) followed
+#         by the board at 2 bits per square, 4 squares per byte.
+#         flags holds the player to move (bit 0) and passes (bits 1-2).
+
+import numpy as np
+
+from board_games import BoardGame, TicTacToe, Connect_X, Othello
+
+
+# (name, class) by binary game id
+GAMES = [('Tic-Tac-Toe', TicTacToe), ('Connect4', Connect_X), ('Othello', Othello)]
+
+HEADER_SIZE = 5
+
+
+def game_id(game):
+    for i, (name, cls) in enumerate(GAMES):
+        if type(game) is cls:
+            return i
+    raise Exception(f'No encoding for {type(game).__name__}')
+
+
+def new_game(gid, rows, cols, connect):
+    cls = GAMES[gid][1]
+    if cls is Othello:
+        game = Othello(rows, cols)
+    else:
+        game = cls(rows, cols, connect)
+    game.interactive = False
+    return game
+
+
+def set_game_position(game, board, player, passes):
+    if isinstance(game, Othello):
+        game.set_position(board, player, passes)
+    else:
+        game.set_position(board, player)
+    return game
+
+
+def encode_text(game):
+    gid = game_id(game)
+    dims = f'{game.num_rows}x{game.num_cols}'
+    if not isinstance(game, Othello):
+        dims += f'x{game.connect_x}'
+
+    rows = []
+    for row in game.board:
+        row_str = ''
+        empties = 0
+        for element in row:
+            if element == BoardGame.EMPTY:
+                empties += 1
+                continue
+            if empties > 0:
+                row_str += str(empties)
+                empties = 0
+            row_str += 'X' if element == BoardGame.XPIECE else 'O'
+        if empties > 0:
+            row_str += str(empties)
+        rows.append(row_str)
+
+    fields = [GAMES[gid][0], dims, '/'.join(rows), 'X' if game.current_player == 1 else 'O']
+    if isinstance(game, Othello):
+        fields.append(str(game.num_passes))
+    return ' '.join(fields)
+
+
+def decode_text(text):
+    fields = text.split()
+    names = [name for name, cls in GAMES]
+    if len(fields) < 4 or fields[0] not in names:
+        raise ValueError(f'Bad position {text!r}')
+    gid = names.index(fields[0])
+    dims = [int(x) for x in fields[1].split('x')]
+    rows, cols = dims[0], dims[1]
+    connect = dims[2] if len(dims) > 2 else 0
+
+    board = np.zeros((rows, cols), dtype=np.int8)
+    board_rows = fields[2].split('/')
+    if len(board_rows) != rows:
+        raise ValueError(f'Bad board in {text!r}')
+    for r, row_str in enumerate(board_rows):
+        c = 0
+        empties = ''
+        for char in row_str + ' ':
+            if char.isdigit():
+                empties += char
+                continue
+            if empties:
+                c += int(empties)
+                empties = ''
+            if char == 'X':
+                board[r][c] = BoardGame.XPIECE
+                c += 1
+            elif char == 'O':
+                board[r][c] = BoardGame.OPIECE
+                c += 1
+        if c != cols:
+            raise ValueError(f'Bad board in {text!r}')
+
+    player = 1 if fields[3] == 'X' else 2
+    passes = int(fields[4]) if len(fields) > 4 else 0
+    return set_game_position(new_game(gid, rows, cols, connect), board, player, passes)
+
+
+def record_size(rows, cols):
+    return HEADER_SIZE + (rows*cols + 3)//4
+
+
+def encode_binary(game):
+    gid = game_id(game)
+    connect = 0 if isinstance(game, Othello) else game.connect_x
+    passes = getattr(game, 'num_passes', 0)
+    flags = (game.current_player - 1) | (min(passes, 3) << 1)
+    header = bytes([gid, game.num_rows, game.num_cols, connect, flags])
+
+    # 0 = empty, 1 = X, 2 = O, packed 4 to a byte
+    codes = np.zeros(((game.num_rows*game.num_cols + 3)//4)*4, dtype=np.uint8)
+    flat = np.asarray(game.board).ravel()
+    codes[:flat.size] = (flat == BoardGame.XPIECE) + 2*(flat == BoardGame.OPIECE)
+    codes = codes.reshape(-1, 4)
+    packed = codes[:, 0] | (codes[:, 1] << 2) | (codes[:, 2] << 4) | (codes[:, 3] << 6)
+    return header + packed.astype(np.uint8).tobytes()
+
+
+# Decode the record starting at offset. Returns the game and the offset
+# of the next record.
+def decode_binary(data, offset=0):
+    gid, rows, cols, connect, flags = data[offset:offset+HEADER_SIZE]
+    end = offset + record_size(rows, cols)
+    packed = np.frombuffer(data[offset+HEADER_SIZE:end], dtype=np.uint8)
+    codes = np.stack([(packed >> shift) & 3 for shift in (0, 2, 4, 6)], axis=1).ravel()
+    codes = codes[:rows*cols].reshape(rows, cols)
+    board = np.where(codes == 1, BoardGame.XPIECE, np.where(codes == 2, BoardGame.OPIECE, BoardGame.EMPTY))
+    game = set_game_position(new_game(gid, rows, cols, connect), board,
+                             1 + (flags & 1), (flags >> 1) & 3)
+    return game, end
+
+
+# Yield the encoded positions in a file one at a time: lines of text
+# (blank lines and lines starting with '#' are skipped), or binary records.
+def read_positions(f, binary=False):
+    if not binary:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+        return
+    while True:
+        header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            return
+        yield header + f.read(record_size(header[1], header[2]) - HEADER_SIZE)
+
+
+def decode(record):
+    if isinstance(record, (bytes, bytearray)):
+        return decode_binary(record)[0]
+    return decode_text(record)
@@ -0,0 +1,140 @@
+# CPU and memory profile of the computer players' moves.
+#
+# Each move is timed and profiled while get_move() chooses it, so the
+# cost of a player is seen apart from the rest of the program. A move is
+# attributed to the agent that chose it (its options, e.g. 'm 4 r 20 10'),
+# the phase of the game (the opening, middle or end third of the squares
+# by move number) and its move number. cProfile keeps the function
+# statistics of each agent in each phase; tracemalloc measures the peak
+# memory allocated during the move and how much of it was still held at
+# the end of it.
+#
+# Only this process is measured. Playout workers ('t <playouts> <workers>')
+# and pondering processes do their work elsewhere, so it is missing from
+# the CPU time, the function statistics and the memory; the wall time of
+# each move, kept next to its CPU time, still includes the wait for it.
+#
+# Results:
+#   <path>             cProfile statistics of all the moves, for pstats
+#                      (python -m pstats <path>) or any viewer of them
+#   <path>.moves.csv   one row per move: game, move number, player, agent,
+#                      phase, CPU and wall seconds, peak and retained bytes
+#   report()           a short text summary
+
+import cProfile
+import csv
+import pstats
+import time
+import tracemalloc
+
+PHASES = ['opening', 'middle', 'end']
+# functions listed for each agent, and allocation sites overall
+TOP = 8
+
+
+class GameProfiler:
+
+    def __init__(self, path):
+        self.path = path
+        # (agent, phase) -> cProfile.Profile
+        self.profiles = {}
+        # one (game, move, player, agent, phase, cpu, wall, peak, retained) per move
+        self.moves = []
+        self.game = 0
+        tracemalloc.start()
+        self.start_memory = tracemalloc.get_traced_memory()[0]
+        self.peak = 0
+
+
+    # Call at the start of each game
+    def new_game(self):
+        self.game += 1
+
+
+    @staticmethod
+    def phase(game):
+        third = 3*game.counter // (game.num_rows*game.num_cols)
+        return PHASES[min(third, len(PHASES)-1)]
+
+
+    # get_move() of the current player, measured
+    def get_move(self, game):
+        player = game.current_player
+        agent = ' '.join(str(x) for x in game.player_options[player-1])
+        phase = self.phase(game)
+        profile = self.profiles.get((agent, phase))
+        if profile is None:
+            profile = self.profiles[(agent, phase)] = cProfile.Profile()
+
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.process_time()
+        start_wall = time.perf_counter()
+        profile.enable()
+        try:
+            move = game.get_move()
+        finally:
+            profile.disable()
+        cpu = time.process_time() - start
+        wall = time.perf_counter() - start_wall
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        self.moves.append((self.game, game.counter+1, player, agent, phase,
+                           cpu, wall, peak - before, current - before))
+        return move
+
+
+    # Write the statistics and the moves, and stop tracing memory
+    def close(self):
+        self.snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        if self.profiles:
+            stats = pstats.Stats(*self.profiles.values())
+            stats.dump_stats(self.path)
+        with open(self.path + '.moves.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['game', 'move', 'player', 'agent', 'phase', 'cpu_s', 'wall_s', 'peak_bytes', 'retained_bytes'])
+            writer.writerows(self.moves)
+
+
+    # Where the time went, by agent and phase, and where the memory is
+    def report(self):
+        lines = [f'Profile of {len(self.moves)} moves in {self.game} games '
+                 f'(statistics in {self.path}, moves in {self.path}.moves.csv)']
+        agents = list(dict.fromkeys(move[3] for move in self.moves))
+
+        lines.append(f"\t{'agent':<16}{'phase':<9}{'moves':>6}{'CPU s':>9}{'wall s':>9}{'ms/move':>9}"
+                     f"{'max ms':>9}{'peak KB':>9}{'max KB':>9}")
+        for agent in agents:
+            for phase in PHASES:
+                rows = [move for move in self.moves if move[3] == agent and move[4] == phase]
+                if not rows:
+                    continue
+                cpu = [row[5] for row in rows]
+                wall = sum(row[6] for row in rows)
+                peak = [row[7] for row in rows]
+                lines.append(f'\t{agent:<16}{phase:<9}{len(rows):>6}{sum(cpu):>9.2f}{wall:>9.2f}'
+                             f'{1000*sum(cpu)/len(rows):>9.1f}{1000*max(cpu):>9.1f}'
+                             f'{sum(peak)/len(rows)/1024:>9.0f}{max(peak)/1024:>9.0f}')
+
+        slowest = max(self.moves, key=lambda move: move[5], default=None)
+        if slowest is not None:
+            lines.append(f"\tSlowest move: game {slowest[0]} move {slowest[1]} by '{slowest[3]}' "
+                         f'({slowest[4]}), {1000*slowest[5]:.0f} ms CPU, {1000*slowest[6]:.0f} ms wall, '
+                         f'peak {slowest[7]/1024:.0f} KB')
+        lines.append(f'\tPeak memory traced: {(self.peak - self.start_memory)/1024:.0f} KB above the start, '
+                     f'{sum(move[8] for move in self.moves)/1024:.0f} KB kept by the moves')
+
+        for agent in agents:
+            profiles = [profile for (a, _), profile in self.profiles.items() if a == agent]
+            stats = pstats.Stats(*profiles)
+            lines.append(f"\tTop functions of '{agent}' (own time):")
+            for func, (_, calls, tottime, cumtime, _) in sorted(stats.stats.items(),
+                                                                key=lambda item: -item[1][2])[:TOP]:
+                lines.append(f'\t\t{tottime:8.3f} s {cumtime:8.3f} s cum {calls:>9} calls  {pstats.func_std_string(func)}')
+
+        lines.append('\tLargest allocation sites still held:')
+        for stat in self.snapshot.statistics('lineno')[:TOP]:
+            frame = stat.traceback[0]
+            lines.append(f'\t\t{stat.size/1024:8.0f} KB {stat.count:>8} blocks  {frame.filename}:{frame.lineno}')
+        return '\n'.join(lines)
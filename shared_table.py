@@ -0,0 +1,187 @@
+# A transposition table in shared memory, so that Minimax searches in
+# several processes on one machine share what they find.
+#
+# The table is a fixed number of entries of three 64-bit words:
+#   check = hash ^ data ^ score, data, score
+# where hash is a 64-bit hash of the position key and search settings,
+# data packs the depth, bound and best move, and score holds the bits of
+# a float64. Entries are written and read without locks. If two processes
+# write an entry at once, or one reads while another writes, check no
+# longer matches and the entry is ignored (or overwritten), so a torn
+# entry is never used.
+#
+# Entries come in buckets of two: the first keeps the deepest search of a
+# position, the second always takes the most recent one.
+#
+# Entries are never cleared between games: every game sees what the
+# others stored, and which entries survive depends on which processes
+# wrote last. Searches using a table are therefore not repeatable, even
+# from seeded games, once more than one process writes to it (games in
+# several workers, pondering); with one process they depend on the games
+# played before.
+
+import hashlib
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+# Counters shared by all processes. They are updated without locks, so
+# they are only approximate when processes collide.
+PROBES = 0
+HITS = 1
+STORES = 2
+NUM_COUNTERS = 4
+
+WORDS = 3
+
+# data: depth in bits 0-7, bound in bits 8-9, best move in bits 10-31
+DEPTH_MASK = 0xff
+BOUND_SHIFT = 8
+MOVE_SHIFT = 10
+# a move [row, col] is stored with this flag, an int column without it
+LIST_FLAG = 1 << 21
+
+DEFAULT_ENTRIES = 1 << 20
+
+# tables this process has attached to, by name
+_attached = {}
+
+
+def key_hash(key, salt=b''):
+    player, position = key
+    digest = hashlib.blake2b(salt + bytes([player]) + position, digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def encode_move(move):
+    if move is None:
+        return 0
+    if isinstance(move, list):
+        return LIST_FLAG | (move[0] << 10) | move[1]
+    return 1 + move
+
+
+def decode_move(code):
+    if code == 0:
+        return None
+    if code & LIST_FLAG:
+        return [(code >> 10) & 0x3ff, code & 0x3ff]
+    return code - 1
+
+
+class SharedTable:
+
+    # entries is rounded up to an even number (whole buckets).
+    # Pass name to attach to a table another process created.
+    def __init__(self, entries=DEFAULT_ENTRIES, name=None):
+        if name is None:
+            self.num_buckets = max(1, (entries + 1)//2)
+            size = 8*(NUM_COUNTERS + 2*WORDS*self.num_buckets)
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        words = np.ndarray((self.memory.size//8,), dtype=np.uint64, buffer=self.memory.buf)
+        if self.owner:
+            words[:] = 0
+        else:
+            self.num_buckets = (len(words) - NUM_COUNTERS)//(2*WORDS)
+        self.counters = words[:NUM_COUNTERS]
+        self.entries = words[NUM_COUNTERS:NUM_COUNTERS + 2*WORDS*self.num_buckets].reshape(-1, WORDS)
+        _attached[self.memory.name] = self
+
+        # this process's own counts
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+
+    @property
+    def name(self):
+        return self.memory.name
+
+
+    # Returns (depth, score, bound, best move) like SearchContext, or None
+    def probe(self, key, salt=b''):
+        h = key_hash(key, salt)
+        index = 2*(h % self.num_buckets)
+        self.probes += 1
+        self.counters[PROBES] += 1
+        for check, data, score in self.entries[index:index+2].tolist():
+            if check ^ data ^ score == h and data != 0:
+                self.hits += 1
+                self.counters[HITS] += 1
+                return ((data & DEPTH_MASK) - 1,
+                        float(np.uint64(score).view(np.float64)),
+                        (data >> BOUND_SHIFT) & 3,
+                        decode_move(data >> MOVE_SHIFT))
+        return None
+
+
+    def store(self, key, entry, salt=b''):
+        depth, score, bound, move = entry
+        h = key_hash(key, salt)
+        index = 2*(h % self.num_buckets)
+        # depth 0 is stored as 1 so that data is never 0 (an empty entry)
+        data = min(max(depth, 0) + 1, DEPTH_MASK) | (bound << BOUND_SHIFT) | (encode_move(move) << MOVE_SHIFT)
+        score = int(np.float64(score).view(np.uint64))
+
+        # keep the deeper search in the first slot, unless it is this position
+        first_check, first_data, first_score = self.entries[index].tolist()
+        first_depth = first_data & DEPTH_MASK
+        if first_check ^ first_data ^ first_score == h or first_data == 0 or first_depth <= data & DEPTH_MASK:
+            slot = index
+        else:
+            slot = index + 1
+        self.entries[slot] = (h ^ data ^ score, data, score)
+        self.stores += 1
+        self.counters[STORES] += 1
+
+
+    def stats(self):
+        probes, hits, stores = (int(x) for x in self.counters[:STORES+1])
+        return {'probes': probes, 'hits': hits, 'stores': stores,
+                'hit_rate': hits/probes if probes else 0.0,
+                'used': int(np.count_nonzero(self.entries[:, 1]))/len(self.entries)}
+
+
+    def clear(self):
+        self.counters[:] = 0
+        self.entries[:] = 0
+
+
+    # The creator removes the table when done with it
+    def close(self):
+        _attached.pop(self.memory.name, None)
+        self.counters = None
+        self.entries = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+    # Sent to other processes by name; each process attaches once
+    def __reduce__(self):
+        return (attach, (self.memory.name,))
+
+
+    # Copies of a game share its table
+    def __deepcopy__(self, memo):
+        return self
+
+
+def attach(name):
+    table = _attached.get(name)
+    if table is None:
+        table = SharedTable(name=name)
+    return table
@@ -0,0 +1,126 @@
+# Sequential probability ratio test for a match between two agents.
+#
+# Tests H0: player 1 is elo0 Elo stronger than player 2, against
+# H1: player 1 is elo1 Elo stronger. After each game the log-likelihood
+# ratio (LLR) of H1 to H0 is updated, and the match can stop as soon as it
+# leaves [log(beta/(1-alpha)), log((1-beta)/alpha)]: above accepts H1,
+# below accepts H0. alpha and beta are the chances of wrongly accepting
+# H1 and H0.
+#
+# This is the generalized SPRT used by engine testing frameworks: each game
+# scores 1, 1/2 or 0 for player 1, and the LLR compares the most likely
+# chances of a win, a draw and a loss whose mean score is that of H1 with
+# the most likely ones whose mean is that of H0. They are fitted to the
+# results with PSEUDO_COUNT games of each result added, so that they exist
+# after a run of identical results; the LLR counts only the games played.
+
+import math
+
+# games of each result added to the ones played, for fitting the chances
+PSEUDO_COUNT = 0.5
+
+
+def elo_to_score(elo):
+    return 1/(1 + 10**(-elo/400))
+
+
+def score_to_elo(score):
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return -400*math.log10(1/score - 1)
+
+
+class SPRT:
+
+    def __init__(self, elo0=0.0, elo1=10.0, alpha=0.05, beta=0.05):
+        if elo1 <= elo0:
+            raise Exception('elo1 must be greater than elo0')
+        self.elo0 = elo0
+        self.elo1 = elo1
+        self.alpha = alpha
+        self.beta = beta
+        self.lower = math.log(beta/(1-alpha))
+        self.upper = math.log((1-beta)/alpha)
+        self.wins = 0
+        self.draws = 0
+        self.losses = 0
+
+
+    # condition as returned by play_game: 1 or 2 for a win, 0 for a draw
+    def add(self, result):
+        if result == 1:
+            self.wins += 1
+        elif result == 2:
+            self.losses += 1
+        else:
+            self.draws += 1
+
+
+    def games(self):
+        return self.wins + self.draws + self.losses
+
+
+    def llr(self):
+        counts = [self.wins, self.draws, self.losses]
+        if sum(counts) == 0:
+            return 0.0
+        total = sum(counts) + 3*PSEUDO_COUNT
+        freqs = [(count + PSEUDO_COUNT)/total for count in counts]
+        probs0 = self.likeliest(freqs, elo_to_score(self.elo0))
+        probs1 = self.likeliest(freqs, elo_to_score(self.elo1))
+        return sum(count*math.log(p1/p0) for count, p0, p1 in zip(counts, probs0, probs1))
+
+
+    # The chances of (win, draw, loss) with mean score score that make the
+    # results, with these frequencies, the most likely. They are
+    # freq/(1 + lam*(result - score)) for the lam that gives that mean,
+    # found by bisection (the mean falls as lam grows).
+    @staticmethod
+    def likeliest(freqs, score):
+        results = [1, 0.5, 0]
+        low = -1/(1 - score)
+        high = 1/score
+        for _ in range(60):
+            lam = (low + high)/2
+            probs = [freq/(1 + lam*(result - score)) for freq, result in zip(freqs, results)]
+            if sum(p*result for p, result in zip(probs, results)) > score*sum(probs):
+                low = lam
+            else:
+                high = lam
+        total = sum(probs)
+        return [p/total for p in probs]
+
+
+    # 'H1' or 'H0' once the test has decided, otherwise None
+    def status(self):
+        llr = self.llr()
+        if llr >= self.upper:
+            return 'H1'
+        if llr <= self.lower:
+            return 'H0'
+        return None
+
+
+    def elo(self):
+        n = self.games()
+        if n == 0:
+            return 0.0
+        return score_to_elo((self.wins + 0.5*self.draws)/n)
+
+
+    def summary(self, num_games=None):
+        status = self.status()
+        lines = [f'SPRT elo0={self.elo0:g} elo1={self.elo1:g} alpha={self.alpha:g} beta={self.beta:g}',
+                 f'\tLLR {self.llr():.2f} in [{self.lower:.2f}, {self.upper:.2f}] after {self.games()} games '
+                 f'(player 1 Elo difference {self.elo():+.0f})']
+        if status == 'H1':
+            lines.append(f'\tH1 accepted: player 1 is at least {self.elo1:g} Elo stronger')
+        elif status == 'H0':
+            lines.append(f'\tH0 accepted: player 1 is at most {self.elo0:g} Elo stronger')
+        else:
+            lines.append('\tNo decision')
+        if num_games is not None and status is not None:
+            lines.append(f'\t{num_games - self.games()} of {num_games} games saved')
+        return '\n'.join(lines)
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+
+# Fit the weights of a game's eval_features() to the results of played
+# games, and save them for the 'm <depth> e <file>' player (see evaluation.py).
+#
+# Each game starts with some random moves, for variety, and is then played
+# out by the given player on both sides. Every position after the random
+# moves is labelled with the result for player 1 (1 for a win, -1 for a
+# loss, 0 for a draw), and the weights are fitted to all of them at once,
+# by logistic regression or least squares. The last tenth of the games are
+# held out to check the fit.
+#
+# With --patterns, the values of the tables of an Othello pattern
+# evaluation (see othello_patterns.py) are fitted instead, by gradient
+# descent, and saved in its binary format.
+#
+# Usage: python tune_eval.py <game> <file> [--games N] [--random-moves N]
+#            [--player P] [--fit logistic|lsq] [--workers N] [--seed N]
+#            [--patterns] [--stages N]
+#        e.g. python tune_eval.py Connect4 connect4.json --games 2000 --player 'm 1 b'
+#             python tune_eval.py Othello othello.pat --games 2000 --patterns
+
+import argparse
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+
+from board_games import game_seed
+from evaluation import save_weights
+from game_registry import new_game, parse_player
+
+
+# Play game number index and return the features of its positions (or
+# with stages > 0, their pattern indices and stages), and its result for
+# player 1
+def play_positions(job):
+    name, options, random_moves, seed, index, stages = job
+    game = new_game(name)
+    game.interactive = False
+    game.configure_player(1, options)
+    game.configure_player(2, options)
+    game.seed(game_seed(seed, index))
+    patterns = None
+    if stages > 0:
+        from othello_patterns import PatternSet
+        patterns = PatternSet(game.num_rows, game.num_cols, stages)
+
+    for _ in range(random_moves):
+        if game.condition != -1:
+            break
+        game.make_move(game.get_move_random())
+    features = []
+    position_stages = []
+    while game.condition == -1:
+        if patterns is None:
+            features.append(game.eval_features())
+        else:
+            features.append(patterns.indices(game))
+            position_stages.append(patterns.stage(game))
+        game.make_move(game.get_move())
+
+    result = {0: 0, 1: 1, 2: -1}[game.condition]
+    return np.array(features).reshape(len(features), -1), np.array(position_stages, dtype=np.intp), result
+
+
+# Weights w minimizing |Fw - y|^2 + ridge*|w|^2
+def fit_least_squares(F, y, ridge=1e-3):
+    A = F.T @ F + ridge*len(F)*np.eye(F.shape[1])
+    return np.linalg.solve(A, F.T @ y)
+
+
+# Weights w of the model P(player 1 wins) = 1/(1 + exp(-Fw)), by Newton's
+# method on the L2-regularized log loss. A draw counts as half a win.
+def fit_logistic(F, y, ridge=1e-3, iterations=50):
+    target = (y + 1)/2
+    w = np.zeros(F.shape[1])
+    penalty = ridge*len(F)*np.eye(F.shape[1])
+    for _ in range(iterations):
+        p = 1/(1 + np.exp(-(F @ w)))
+        gradient = F.T @ (p - target) + penalty @ w
+        hessian = (F.T * (p*(1 - p))) @ F + penalty
+        step = np.linalg.solve(hessian, gradient)
+        w -= step
+        if np.abs(step).max() < 1e-8:
+            break
+    return w
+
+
+# Table values of a pattern evaluation, as a stages x count array. I holds
+# the pattern indices of each position and S its stage, so its prediction
+# is the sum of values[S, I]. Fitted by full-batch gradient descent (Adam)
+# on the mean loss plus ridge*|values|^2, since there are far too many
+# values for a direct solve.
+def fit_patterns(I, S, y, count, stages, fit, ridge=1e-3, iterations=500, rate=0.05):
+    G = I + (S*count)[:, None]
+    flat = G.ravel()
+    w = np.zeros(stages*count)
+    m = np.zeros_like(w)
+    v = np.zeros_like(w)
+    target = (y + 1)/2
+    for t in range(1, iterations + 1):
+        z = w[G].sum(axis=1)
+        if fit == 'logistic':
+            residual = 1/(1 + np.exp(-z)) - target
+        else:
+            residual = z - y
+        gradient = np.bincount(flat, np.repeat(residual, G.shape[1]), len(w))/len(G) + ridge*w
+        m = 0.9*m + 0.1*gradient
+        v = 0.999*v + 0.001*gradient**2
+        w -= rate*(m/(1 - 0.9**t))/(np.sqrt(v/(1 - 0.999**t)) + 1e-8)
+    return w.reshape(stages, count)
+
+
+# Loss of the predictions z (log loss or mean squared error), and how often
+# their sign matches the winner of a won game
+def check_fit(z, y, fit):
+    if fit == 'logistic':
+        target = (y + 1)/2
+        loss = float(np.mean(np.logaddexp(0, z) - target*z))
+    else:
+        loss = float(np.mean((z - y)**2))
+    decided = y != 0
+    accuracy = float(np.mean(np.sign(z[decided]) == y[decided])) if decided.any() else 0.0
+    return loss, accuracy
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit evaluation weights to the results of played games')
+    parser.add_argument('game', help="game name, e.g. 'Connect4' or 'Othello:6x6'")
+    parser.add_argument('file', help='weight file to write')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--random-moves', type=int, default=4, help='random moves at the start of each game')
+    parser.add_argument('--player', default='m 1 b', help="player on both sides, e.g. 'r' or 'm 2 b'")
+    parser.add_argument('--fit', choices=['logistic', 'lsq'], default='logistic')
+    parser.add_argument('--ridge', type=float, default=1e-3, help='L2 penalty per position')
+    parser.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--patterns', action='store_true', help='fit Othello pattern tables (othello_patterns.py)')
+    parser.add_argument('--stages', type=int, default=1, help='sets of pattern tables, by disc count')
+    args = parser.parse_args()
+
+    lst = args.player.split()
+    lst.reverse()
+    try:
+        options = parse_player(lst)
+        if len(lst) != 0 or options[0] == 'h':
+            raise Exception
+    except Exception:
+        parser.error(f'bad player {args.player!r}')
+
+    game = new_game(args.game)
+    stages = 0
+    if args.patterns:
+        if type(game).__name__ != 'Othello':
+            parser.error('--patterns is only for Othello')
+        from othello_patterns import PatternSet, PatternEvaluator
+        patterns = PatternSet(game.num_rows, game.num_cols, args.stages)
+        stages = args.stages
+    else:
+        names = game.eval_feature_names()
+
+    start = time.time()
+    jobs = [(args.game, options, args.random_moves, args.seed, index, stages) for index in range(args.games)]
+    with multiprocessing.Pool(args.workers) as pool:
+        games = pool.map(play_positions, jobs, chunksize=4)
+    # positions, with their game's result
+    held_out = max(1, args.games//10) if args.games > 1 else 0
+
+    def positions(games):
+        F = np.concatenate([features for features, _, _ in games])
+        S = np.concatenate([position_stages for _, position_stages, _ in games])
+        y = np.concatenate([np.full(len(features), result, dtype=np.float64) for features, _, result in games])
+        return F, S, y
+
+    F, S, y = positions(games[:len(games) - held_out])
+    print(f'{len(F)} positions from {len(games) - held_out} games in {time.time() - start:.1f} s', file=sys.stderr)
+
+    if args.patterns:
+        values = fit_patterns(F, S, y, patterns.count, stages, args.fit, args.ridge)
+        predict = lambda F, S: values.ravel()[F + (S*patterns.count)[:, None]].sum(axis=1)
+    else:
+        if args.fit == 'logistic':
+            w = fit_logistic(F, y, args.ridge)
+        else:
+            w = fit_least_squares(F, y, args.ridge)
+        predict = lambda F, S: F @ w
+
+    loss, accuracy = check_fit(predict(F, S), y, args.fit)
+    print(f'training: loss {loss:.4f}, winner predicted {100*accuracy:.1f}%', file=sys.stderr)
+    if held_out and sum(len(features) for features, _, _ in games[-held_out:]) > 0:
+        F_test, S_test, y_test = positions(games[-held_out:])
+        loss, accuracy = check_fit(predict(F_test, S_test), y_test, args.fit)
+        print(f'held out: loss {loss:.4f}, winner predicted {100*accuracy:.1f}%', file=sys.stderr)
+
+    if args.patterns:
+        PatternEvaluator.write(args.file, game.num_rows, game.num_cols, values)
+        return
+    for name, weight in zip(names, w):
+        print(f'\t{name:>16} {weight:+.4f}', file=sys.stderr)
+    save_weights(args.file, game, names, w, fit=args.fit, games=len(games) - held_out, positions=len(F),
+                 player=args.player, random_moves=args.random_moves)
+
+
+if __name__ == "__main__":
+    main()